@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List
+
+from a1800da import instrumentation
+from a1800da.lib import DLC
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DEFAULT_MAX_MEMORY_BYTES = 256 * 1024 ** 2
+DEFAULT_MAX_DISK_BYTES = 1024 ** 3
+# rough size of an entry without buffer, for the memory bound
+_ENTRY_OVERHEAD = 256
+
+
+def get_key(compressed_gamesetup) -> str:
+    """Hash the compressed gamesetup.a7s bytes, which is much faster than inflating them."""
+    return hashlib.blake2b(compressed_gamesetup, digest_size=16).hexdigest()
+
+
+def get_default_cache_dir() -> str:
+    base = os.getenv("LOCALAPPDATA") or os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "a1800da", "gamesetup")
+
+
+@dataclass()
+class CachedGameSetup:
+    dlc_values: List[int]
+    # positions in the decompressed gamesetup.a7s, see GameSetupReader
+    count_ptr: int
+    insertion_ptr: int
+    # the decompressed gamesetup.a7s, None if only the ActiveDLCs state is cached
+    buffer: bytes | None = None
+
+    @property
+    def dlcs(self) -> List[DLC]:
+        return [DLC(value) for value in self.dlc_values]
+
+    @property
+    def size(self) -> int:
+        return _ENTRY_OVERHEAD + (len(self.buffer) if self.buffer is not None else 0)
+
+
+class GameSetupCache:
+    """LRU cache of the ActiveDLCs state and the decompressed bytes of gamesetup.a7s, keyed by get_key().
+
+    Entries are kept in memory up to max_memory_bytes and, with a directory, on disk up to max_disk_bytes: the state
+    as <key>.json and the buffer as <key>.bin. On disk the modification time marks the last use. Without
+    store_buffers only the state is cached, which is enough to inspect save games."""
+
+    def __init__(self, directory: str | None = None, max_memory_bytes: int = DEFAULT_MAX_MEMORY_BYTES,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES, store_buffers: bool = True):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.store_buffers = store_buffers
+        self._memory: OrderedDict[str, CachedGameSetup] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str, with_buffer: bool = False) -> CachedGameSetup | None:
+        """Get a cached entry. With with_buffer the buffer is loaded from disk too, if it was stored."""
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+        if cached is None or (with_buffer and cached.buffer is None):
+            cached = self._load(key, with_buffer) or cached
+        if instrumentation.enabled:
+            instrumentation.count("cache_hits" if cached is not None else "cache_misses")
+        return cached
+
+    def put(self, key: str, cached: CachedGameSetup):
+        if not self.store_buffers:
+            cached = CachedGameSetup(cached.dlc_values, cached.count_ptr, cached.insertion_ptr)
+        self._remember(key, cached)
+        if self.directory:
+            self._store(key, cached)
+            self._evict_from_disk()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith((".json", ".bin")):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key: str, cached: CachedGameSetup):
+        if cached.size > self.max_memory_bytes:
+            cached = CachedGameSetup(cached.dlc_values, cached.count_ptr, cached.insertion_ptr)
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous.size
+            self._memory[key] = cached
+            self._memory_bytes += cached.size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.size
+
+    def _get_path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key + extension)
+
+    def _load(self, key: str, with_buffer: bool) -> CachedGameSetup | None:
+        if not self.directory:
+            return None
+        try:
+            with open(self._get_path(key, ".json"), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION:
+                return None
+            cached = CachedGameSetup(data["dlc_values"], data["count_ptr"], data["insertion_ptr"])
+            os.utime(self._get_path(key, ".json"))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if with_buffer and data["buffer_size"] is not None:
+            try:
+                with open(self._get_path(key, ".bin"), "rb") as f:
+                    buffer = f.read()
+                os.utime(self._get_path(key, ".bin"))
+            except OSError:
+                # evicted on its own, the state is still good
+                buffer = None
+            if buffer is not None and len(buffer) == data["buffer_size"]:
+                cached.buffer = buffer
+        self._remember(key, cached)
+        return cached
+
+    def _store(self, key: str, cached: CachedGameSetup):
+        data = {"version": CACHE_VERSION, "dlc_values": cached.dlc_values, "count_ptr": cached.count_ptr,
+                "insertion_ptr": cached.insertion_ptr,
+                "buffer_size": len(cached.buffer) if cached.buffer is not None else None}
+        # other processes may read the cache at the same time, so files only appear complete
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if cached.buffer is not None:
+                with open(self._get_path(key, ".bin" + suffix), "wb") as f:
+                    f.write(cached.buffer)
+                os.replace(self._get_path(key, ".bin" + suffix), self._get_path(key, ".bin"))
+            with open(self._get_path(key, ".json" + suffix), "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(self._get_path(key, ".json" + suffix), self._get_path(key, ".json"))
+        except OSError as e:
+            log.debug("Cannot store %s in the gamesetup cache: %s", key, e)
+
+    def _evict_from_disk(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith((".json", ".bin"))]
+            stats = [(entry.stat(), entry.path) for entry in entries]
+        except OSError:
+            return
+        disk_bytes = sum(stat.st_size for stat, _ in stats)
+        for stat, path in sorted(stats, key=lambda item: item[0].st_mtime_ns):
+            if disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            disk_bytes -= stat.st_size
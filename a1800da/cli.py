@@ -0,0 +1,384 @@
+import argparse
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+from a1800da import cache, compact, filedb, instrumentation, lib, pipeline, watch
+from a1800da.lib import DLC, CompressionPolicy
+
+
+def parse_dlcs(names: Iterable[str]) -> List[DLC]:
+    """Map DLC names (case-insensitive, or 'all') to DLCs."""
+    dlcs: List[DLC] = []
+    for name in names:
+        for part in name.split(","):
+            part = part.strip().upper()
+            if not part:
+                continue
+            if part == "ALL":
+                selected = list(DLC)
+            elif part in DLC.__members__:
+                selected = [DLC[part]]
+            else:
+                raise argparse.ArgumentTypeError(
+                    f"Unknown DLC '{part}', pick from: {', '.join(DLC.__members__)} or ALL")
+            dlcs.extend(dlc for dlc in selected if dlc not in dlcs)
+    return dlcs
+
+
+def find_save_games(paths: Iterable[str]) -> List[str]:
+    """Expand directories and glob patterns to save game files.
+
+    Directories are searched recursively. Files this tool created are skipped, unless they are given by name."""
+    save_game_paths: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = [p for p in glob.glob(os.path.join(glob.escape(path), "**", "*.a7s"), recursive=True)
+                       if not pipeline.is_output_file(p)]
+        else:
+            matches = glob.glob(path, recursive=True)
+            matches = [p for p in matches if p == path or not pipeline.is_output_file(p)] if matches else [path]
+        for match in sorted(matches):
+            if match not in save_game_paths:
+                save_game_paths.append(match)
+    return save_game_paths
+
+
+# Compression policy and gamesetup cache of a worker process, kept across the files it processes
+_compression_policy: CompressionPolicy | None = None
+_gamesetup_cache: cache.GameSetupCache | None = None
+
+
+def _init_worker(compression: str, trace_path: str | None, cache_dir: str | None = None,
+                 store_buffers: bool = True):
+    global _compression_policy, _gamesetup_cache
+    _compression_policy = CompressionPolicy.parse(compression)
+    if cache_dir:
+        _gamesetup_cache = cache.GameSetupCache(cache_dir, store_buffers=store_buffers)
+    if trace_path:
+        instrumentation.enable(instrumentation.JsonLinesSink(open(trace_path, "a", encoding="utf-8")))
+
+
+def _activate_dlcs(save_game_path: str, dlcs: List[DLC], in_place: bool, use_index_cache: bool,
+                   verify_output: bool = True) -> Tuple[pipeline.PipelineResult, int, str]:
+    """Activate DLCs in a worker, return the result with the worker's process id and compression report so far."""
+    try:
+        result = pipeline.activate_dlcs(save_game_path, dlcs, in_place, use_index_cache, _compression_policy,
+                                        gamesetup_cache=_gamesetup_cache, verify_output=verify_output)
+    except Exception as e:
+        result = pipeline.PipelineResult(save_game_path, error=f"{type(e).__name__}: {e}")
+    return result, os.getpid(), _compression_policy.report()
+
+
+def _read_active_dlcs(save_game_path: str, use_index_cache: bool) -> pipeline.PipelineResult:
+    try:
+        return pipeline.read_active_dlcs(save_game_path, use_index_cache, gamesetup_cache=_gamesetup_cache)
+    except Exception as e:
+        return pipeline.PipelineResult(save_game_path, error=f"{type(e).__name__}: {e}")
+
+
+def format_result(result: pipeline.PipelineResult) -> str:
+    if result.error:
+        return f"FAILED  {result.save_game_path}: {result.error}"
+    if not result.activated_dlcs:
+        return f"SKIPPED {result.save_game_path}: all DLCs already active ({result.seconds:.2f}s)"
+    names = ", ".join(dlc.name for dlc in result.activated_dlcs)
+    return (f"OK      {result.save_game_path} -> {result.output_path}: activated {names} ({result.seconds:.2f}s, "
+            f"compression level {result.compression_level} {result.compression_seconds * 1000:.1f} ms"
+            f"{', verified' if result.verified else ''})")
+
+
+def format_compression_summary(results: List[pipeline.PipelineResult]) -> str:
+    levels: Dict[int, List[float]] = {}
+    for result in results:
+        if result.compression_level is not None:
+            level = levels.setdefault(result.compression_level, [0, 0.0])
+            level[0] += 1
+            level[1] += result.compression_seconds
+    if not levels:
+        return "Nothing compressed."
+    return "Compression: " + ", ".join(f"level {level}: {files} files in {seconds:.2f}s"
+                                       for level, (files, seconds) in sorted(levels.items()))
+
+
+def format_compression_reports(reports: Dict[int, str]) -> str:
+    """Format the CompressionPolicy reports of the workers, by process id."""
+    return "\n".join(f"Worker {worker}:\n" + "\n".join("  " + line for line in report.splitlines())
+                     for worker, report in sorted(reports.items()) if report)
+
+
+def parse_compression(value: str) -> str:
+    try:
+        CompressionPolicy.parse(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def run_batch(args) -> int:
+    save_game_paths = find_save_games(args.paths)
+    if not save_game_paths:
+        print("No save games found.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    results: List[pipeline.PipelineResult] = []
+    # the latest compression report of each worker, which covers all files it compressed
+    compression_reports: Dict[int, str] = {}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.compression, args.trace, args.cache)) as executor:
+        futures = [executor.submit(_activate_dlcs, path, args.dlcs, args.in_place, args.index_cache, args.verify)
+                   for path in save_game_paths]
+        for future in futures:
+            result, worker, compression_reports[worker] = future.result()
+            results.append(result)
+            print(format_result(result), flush=True)
+    seconds = time.perf_counter() - start
+
+    failed = sum(1 for result in results if result.error)
+    megabytes = sum(result.size for result in results) / 1024 ** 2
+    print(f"{len(results)} files ({failed} failed), {megabytes:.1f} MB in {seconds:.2f}s: "
+          f"{len(results) / seconds:.1f} files/s, {megabytes / seconds:.1f} MB/s")
+    print(format_compression_summary(results))
+    if any(compression_reports.values()):
+        print(format_compression_reports(compression_reports))
+    return 1 if failed else 0
+
+
+def run_inspect(args) -> int:
+    save_game_paths = find_save_games(args.paths)
+    if not save_game_paths:
+        print("No save games found.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=("9", args.trace, args.cache, False)) as executor:
+        futures = [executor.submit(_read_active_dlcs, path, args.index_cache) for path in save_game_paths]
+        for future in futures:
+            result = future.result()
+            if result.error:
+                failed += 1
+                print(f"FAILED  {result.save_game_path}: {result.error}", flush=True)
+            else:
+                names = ", ".join(dlc.name for dlc in result.priorly_active_dlcs) or "no DLCs"
+                print(f"{result.save_game_path}: {names}", flush=True)
+    seconds = time.perf_counter() - start
+    print(f"{len(save_game_paths)} files ({failed} failed) in {seconds:.2f}s: "
+          f"{len(save_game_paths) / seconds:.1f} files/s")
+    return 1 if failed else 0
+
+
+def run_watch(args) -> int:
+    paths = args.paths or watch.get_accounts_dirs()
+    if not paths:
+        print("No save game directory found, pass one.", file=sys.stderr)
+        return 1
+    if args.trace:
+        instrumentation.enable(instrumentation.JsonLinesSink(open(args.trace, "a", encoding="utf-8")))
+
+    def on_result(result: pipeline.PipelineResult):
+        print(format_result(result), flush=True)
+
+    compression_policy = CompressionPolicy.parse(args.compression)
+    watcher = watch.Watcher(paths, args.dlcs, args.in_place, args.settle, args.workers, compression_policy,
+                            on_result)
+    print(f"Watching {', '.join(paths)}, press Ctrl+C to stop.", flush=True)
+    try:
+        watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    report = compression_policy.report()
+    if report:
+        print(report)
+    return 0
+
+
+def run_extract_all(args) -> int:
+    start = time.perf_counter()
+    with lib.SaveGameReader.from_file(args.save_game) as save_game_reader:
+        sizes = save_game_reader.extract_all(args.output_dir, args.workers, decompress=not args.raw)
+    seconds = time.perf_counter() - start
+    for name, size in sizes.items():
+        print(f"{size:12d} {name}")
+    megabytes = sum(sizes.values()) / 1024 ** 2
+    print(f"{len(sizes)} files, {megabytes:.1f} MB in {seconds:.2f}s: {megabytes / seconds:.1f} MB/s")
+    return 0
+
+
+def run_export_xml(args) -> int:
+    start = time.perf_counter()
+    with lib.SaveGameReader.from_file(args.save_game) as save_game_reader, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        # decompressed to a file and memory mapped, so even data.a7s does not need to fit into memory
+        document_path = os.path.join(tmp_dir, "document")
+        save_game_reader.extract_to(args.entry, document_path)
+        with lib.GameSetupReader.from_file(document_path) as document_reader:
+            if args.output == "-":
+                nodes = filedb.export_reader_xml(document_reader, sys.stdout)
+            else:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    nodes = filedb.export_reader_xml(document_reader, f)
+            size = document_reader.size
+    print(f"Exported {nodes} nodes from {size} bytes of {args.entry} in {time.perf_counter() - start:.2f}s",
+          file=sys.stderr)
+    return 0
+
+
+def run_compile_xml(args) -> int:
+    start = time.perf_counter()
+    if args.save is None:
+        with open(args.xml, "rb") as source, open(args.output, "wb") as f:
+            if args.uncompressed:
+                size = filedb.compile_xml(source, f)
+            else:
+                size = filedb.compile_xml_compressed(source, f, args.level)
+    else:
+        with lib.SaveGameReader.from_file(args.save) as save_game_reader:
+            # keep the ids of the save game, so its tables stay as they are
+            game_setup_reader = lib.GameSetupReader(save_game_reader.get_gamesetup_bytes())
+            tag_ids = {name: node_id for node_id, name in game_setup_reader.enclosing_tags_combined.items()}
+            attribute_ids = {name: node_id for node_id, name in game_setup_reader.attribute_tags_combined.items()}
+            compressed = io.BytesIO()
+            with open(args.xml, "rb") as source:
+                size = filedb.compile_xml_compressed(source, compressed, args.level, tag_ids, attribute_ids)
+            with lib.SaveGameWriter(save_game_reader, save_game_reader.initial_bytes) as save_game_writer:
+                save_game_writer.add_gamesetup_a7s(compressed.getvalue())
+                save_game_writer.write_save_game(args.output)
+    print(f"Compiled {size} bytes of FileDB into {args.output} in {time.perf_counter() - start:.2f}s",
+          file=sys.stderr)
+    return 0
+
+
+def _compact_save_game(save_game_path: str, in_place: bool) -> Tuple[str, compact.CompactionResult | str]:
+    output_path = save_game_path if in_place else os.path.splitext(save_game_path)[0] + "_compact.a7s"
+    try:
+        return output_path, compact.compact_save_game(save_game_path, output_path)
+    except Exception as e:
+        return output_path, f"{type(e).__name__}: {e}"
+
+
+def run_compact(args) -> int:
+    save_game_paths = find_save_games(args.paths)
+    if not save_game_paths:
+        print("No save games found.", file=sys.stderr)
+        return 1
+
+    failed = 0
+    reclaimed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [(path, executor.submit(_compact_save_game, path, args.in_place)) for path in save_game_paths]
+        for path, future in futures:
+            output_path, result = future.result()
+            if isinstance(result, str):
+                failed += 1
+                print(f"FAILED  {path}: {result}", flush=True)
+            else:
+                reclaimed += result.reclaimed_bytes
+                print(f"OK      {path} -> {output_path}: {result.input_size} -> {result.output_size} bytes, "
+                      f"{result.reclaimed_bytes} reclaimed", flush=True)
+    print(f"{len(save_game_paths)} files ({failed} failed), {reclaimed / 1024 ** 2:.2f} MB reclaimed")
+    return 1 if failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m a1800da", description="Anno 1800 DLC activator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch = subparsers.add_parser("batch", help="Activate DLCs in many save games")
+    batch.add_argument("paths", nargs="+", help="Save game files, directories or glob patterns")
+    batch.add_argument("--dlc", dest="dlcs", action="extend", required=True, type=lambda name: parse_dlcs([name]),
+                       help="DLC to activate, comma separated or repeated. Use ALL for every DLC")
+    batch.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    batch.add_argument("--in-place", action="store_true",
+                       help="Patch the save games in place instead of writing *_dlc_activated.a7s files")
+    batch.add_argument("--compression", type=parse_compression, default="9",
+                       help="zlib level 0-9, 'fastest', or 'auto' to benchmark levels on the first files of each "
+                            "worker and keep the best time/size trade-off (default: 9)")
+    batch.add_argument("--index-cache", action="store_true",
+                       help="Keep the directory index of each save game in a .rdaindex file next to it")
+    batch.add_argument("--cache", metavar="DIR", nargs="?", const=cache.get_default_cache_dir(),
+                       help="Cache the active DLCs and decompressed gamesetup.a7s of the save games in DIR "
+                            "(default: %(const)s), so unchanged save games are not decompressed again")
+    batch.add_argument("--no-verify", dest="verify", action="store_false",
+                       help="Do not read back and check the written regions of each save game")
+    batch.add_argument("--trace", metavar="FILE",
+                       help="Append per-stage timings and counters as JSON lines to FILE")
+    batch.set_defaults(func=run_batch)
+
+    inspect = subparsers.add_parser("inspect", help="List the active DLCs of many save games")
+    inspect.add_argument("paths", nargs="+", help="Save game files, directories or glob patterns")
+    inspect.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    inspect.add_argument("--index-cache", action="store_true",
+                         help="Keep the directory index of each save game in a .rdaindex file next to it")
+    inspect.add_argument("--cache", metavar="DIR", nargs="?", const=cache.get_default_cache_dir(),
+                         help="Cache the active DLCs of the save games in DIR (default: %(const)s), so unchanged "
+                              "save games are not decompressed again")
+    inspect.add_argument("--trace", metavar="FILE",
+                         help="Append per-stage timings and counters as JSON lines to FILE")
+    inspect.set_defaults(func=run_inspect)
+
+    watch_ = subparsers.add_parser("watch", help="Activate DLCs in save games whenever the game writes them")
+    watch_.add_argument("paths", nargs="*",
+                        help="Directories to watch (default: the Anno 1800 accounts directory)")
+    watch_.add_argument("--dlc", dest="dlcs", action="extend", required=True, type=lambda name: parse_dlcs([name]),
+                        help="DLC to activate, comma separated or repeated. Use ALL for every DLC")
+    watch_.add_argument("-j", "--workers", type=int, default=watch.DEFAULT_WORKERS,
+                        help="Number of save games processed at the same time")
+    watch_.add_argument("--in-place", action="store_true",
+                        help="Patch the save games in place instead of writing *_dlc_activated.a7s files")
+    watch_.add_argument("--compression", type=parse_compression, default="9",
+                        help="zlib level 0-9, 'fastest' or 'auto' (default: 9)")
+    watch_.add_argument("--interval", type=float, default=watch.DEFAULT_POLL_INTERVAL,
+                        help="Seconds between polls of the directories")
+    watch_.add_argument("--settle", type=float, default=watch.DEFAULT_SETTLE_SECONDS,
+                        help="Seconds a save game must stay unchanged before it is processed")
+    watch_.add_argument("--trace", metavar="FILE",
+                        help="Append per-stage timings and counters as JSON lines to FILE")
+    watch_.set_defaults(func=run_watch)
+
+    extract_all = subparsers.add_parser("extract-all", help="Extract every file of a save game")
+    extract_all.add_argument("save_game", help="Save game file")
+    extract_all.add_argument("output_dir", help="Directory the files are written to")
+    extract_all.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                             help="Number of files decompressed at the same time")
+    extract_all.add_argument("--raw", action="store_true", help="Write the files as stored, without decompressing")
+    extract_all.set_defaults(func=run_extract_all)
+
+    export_xml = subparsers.add_parser("export-xml", help="Write a FileDB file of a save game as XML")
+    export_xml.add_argument("save_game", help="Save game file")
+    export_xml.add_argument("output", nargs="?", default="-", help="XML file to write (default: standard output)")
+    export_xml.add_argument("--entry", default="gamesetup.a7s",
+                            help="File in the save game to export, e.g. data.a7s (default: gamesetup.a7s)")
+    export_xml.set_defaults(func=run_export_xml)
+
+    compile_xml = subparsers.add_parser("compile-xml", help="Compile XML written by export-xml back into FileDB")
+    compile_xml.add_argument("xml", help="XML file")
+    compile_xml.add_argument("output", help="File to write, a save game with --save")
+    compile_xml.add_argument("--save", metavar="SAVE",
+                             help="Write a copy of SAVE with its gamesetup.a7s replaced by the compiled XML")
+    compile_xml.add_argument("--uncompressed", action="store_true", help="Do not zlib compress the output")
+    compile_xml.add_argument("--level", type=int, default=9, choices=range(10), metavar="0-9",
+                             help="zlib compression level (default: 9)")
+    compile_xml.set_defaults(func=run_compile_xml)
+
+    compact_ = subparsers.add_parser("compact", help="Drop the dead bytes earlier edits left in save games")
+    compact_.add_argument("paths", nargs="+", help="Save game files, directories or glob patterns")
+    compact_.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    compact_.add_argument("--in-place", action="store_true",
+                          help="Replace the save games instead of writing *_compact.a7s files")
+    compact_.set_defaults(func=run_compact)
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if hasattr(args, "dlcs"):
+        args.dlcs = list(dict.fromkeys(args.dlcs))
+    return args.func(args)
@@ -0,0 +1,120 @@
+import logging
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Tuple
+
+from a1800da import instrumentation
+from a1800da.lib import (BLOCK_HEADER_SIZE, DEFAULT_CHUNK_SIZE, DIRECTORY_ENTRY_SIZE, FILE_NAME_SIZE,
+                         FIRST_BLOCK_PTR_PTR, RESOURCE_FILE_HEADER_SIZE, BlockFlags, ParseError, RdaBlock, Reader,
+                         SaveGameReader, iter_blocks, write_file_atomically)
+
+log = logging.getLogger(__name__)
+
+
+@dataclass()
+class CompactionResult:
+    input_size: int
+    output_size: int = 0
+    blocks: int = 0
+    entries: int = 0
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.input_size - self.output_size
+
+
+@dataclass()
+class _BlockLayout:
+    block: RdaBlock
+    # (old offset, size, new offset) of the entry data not written by an earlier entry
+    data: List[Tuple[int, int, int]]
+    # new offset per directory entry
+    entry_offsets: List[int]
+    ptr: int = 0
+
+
+def plan_compaction(reader: Reader) -> Tuple[List[_BlockLayout], int]:
+    """Lay out the live blocks of a save game back to back and return the layouts and the new file size.
+
+    Each block is written as the data of its entries, its directory and its block header, like the game writes it.
+    Deleted blocks, data no directory entry points to and everything behind the last block is dropped."""
+    layouts: List[_BlockLayout] = []
+    ptr = RESOURCE_FILE_HEADER_SIZE
+    for block in iter_blocks(reader):
+        if block.directory_size != block.file_count * DIRECTORY_ENTRY_SIZE:
+            # end of the chain, as for RdaIndex.build
+            break
+        if block.flags & (BlockFlags.COMPRESSED | BlockFlags.ENCRYPTED | BlockFlags.MEMORY_RESIDENT):
+            raise ParseError(f"Cannot compact the {block.flags!r} block at 0x{block.ptr:x}")
+        if block.flags & BlockFlags.DELETED:
+            continue
+
+        layout = _BlockLayout(block, [], [])
+        # entries sharing their data keep sharing it
+        new_offsets: Dict[Tuple[int, int], int] = {}
+        for entry_ptr in block.get_directory_entry_ptrs():
+            offset, compressed_size = struct.unpack_from("<QQ", reader.view, entry_ptr + FILE_NAME_SIZE)
+            if offset + compressed_size > reader.size:
+                raise ParseError(f"Entry at 0x{entry_ptr:x} points beyond the end of the save game")
+            if (offset, compressed_size) not in new_offsets:
+                new_offsets[offset, compressed_size] = ptr
+                layout.data.append((offset, compressed_size, ptr))
+                ptr += compressed_size
+            layout.entry_offsets.append(new_offsets[offset, compressed_size])
+        ptr += block.directory_size
+        layout.ptr = ptr
+        ptr += BLOCK_HEADER_SIZE
+        layouts.append(layout)
+    if not layouts:
+        raise ParseError("No blocks to compact")
+    return layouts, ptr
+
+
+def _write_view(f: BinaryIO, view: memoryview, chunk_size: int):
+    for ptr in range(0, len(view), chunk_size):
+        f.write(view[ptr:ptr + chunk_size])
+
+
+def write_compacted(reader: Reader, f: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> CompactionResult:
+    """Stream a compacted copy of a save game to a file object."""
+    layouts, size = plan_compaction(reader)
+    result = CompactionResult(reader.size, size, len(layouts))
+    with instrumentation.span("compact", blocks=len(layouts)):
+        f.write(reader.view[:FIRST_BLOCK_PTR_PTR])
+        f.write(struct.pack("<Q", layouts[0].ptr))
+        for i, layout in enumerate(layouts):
+            for offset, compressed_size, _ in layout.data:
+                _write_view(f, reader.view[offset:offset + compressed_size], chunk_size)
+
+            directory = bytearray(reader.view[layout.block.directory_ptr:layout.block.ptr])
+            for j, new_offset in enumerate(layout.entry_offsets):
+                struct.pack_into("<Q", directory, j * DIRECTORY_ENTRY_SIZE + FILE_NAME_SIZE, new_offset)
+            f.write(directory)
+            result.entries += len(layout.entry_offsets)
+
+            # the last block points to the end of the file
+            next_block_ptr = layouts[i + 1].ptr if i + 1 < len(layouts) else size
+            block = layout.block
+            f.write(struct.pack("<IIQQQ", block.flags, block.file_count, block.directory_size,
+                                block.decompressed_size, next_block_ptr))
+    if instrumentation.enabled:
+        instrumentation.count("bytes_written", size)
+    return result
+
+
+def compact_save_game(filepath, output_path=None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> CompactionResult:
+    """Rewrite a save game with only the live entry data.
+
+    The copy is written with write_file_atomically, without output_path it replaces the save game once it is
+    complete."""
+    results: List[CompactionResult] = []
+
+    def write(fd: int):
+        # the save game is closed again before it is replaced
+        with SaveGameReader.from_file(filepath) as reader, open(fd, "wb", closefd=False) as f:
+            results.append(write_compacted(reader, f, chunk_size))
+
+    write_file_atomically(output_path or filepath, write)
+    result = results[0]
+    log.debug("Compacted %s from %d to %d bytes", filepath, result.input_size, result.output_size)
+    return result
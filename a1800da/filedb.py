@@ -0,0 +1,645 @@
+import struct
+import sys
+import zlib
+from array import array
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Self, TextIO, Tuple
+from xml.etree import ElementTree
+
+from a1800da.lib import (ATTRIBUTE, ATTRIBUTE_ID_MIN, CLOSING, CONTENT_BLOCK_SIZE, DLC, NODE_HEADER_SIZE, TAG,
+                         GameSetupReader, ParseError, decode_name_table, get_padded_size, iter_node_records)
+
+TRAILER_SIZE = 16
+TRAILER_MAGIC = b"\x08\x00\x00\x00\xfe\xff\xff\xff"
+
+
+def encode_name_table(names: Dict[int, str]) -> bytes:
+    """Encode a tag or attribute name table, the counterpart of lib.decode_name_table."""
+    table = bytearray(struct.pack("<I", len(names)))
+    ids = array("H", names)
+    if sys.byteorder == "big":
+        ids.byteswap()
+    table += ids.tobytes()
+    table += b"".join(name.encode() + b"\0" for name in names.values())
+    return bytes(table + bytes(-len(table) % CONTENT_BLOCK_SIZE))
+
+
+def build_attribute(node_id: int, content: bytes) -> bytes:
+    """Build an attribute node record, padding the content to the content block size."""
+    return (struct.pack("<iI", len(content), node_id) + content
+            + bytes(get_padded_size(len(content)) - len(content)))
+
+
+def build_tag(node_id: int, *children: bytes) -> bytes:
+    """Build the records of a tag enclosing the given child records."""
+    return struct.pack("<iI", 0, node_id) + b"".join(children) + struct.pack("<iI", 0, 0)
+
+
+class NodeTable:
+    """Columnar table of all nodes of a FileDB document.
+
+    Node i has kinds[i], ids[i], parents[i] (index of the enclosing tag, -1 on top level), offsets[i] (position of
+    the content, right after the 8 byte node header) and sizes[i] (content size). Closing nodes are part of the
+    table, their parent is the tag they close. The path index maps paths like "/GameSetup/ActiveDLCs/DLC" to the
+    indices of all tag and attribute nodes at that path, in document order."""
+
+    def __init__(self, tag_names: Dict[int, str], attribute_names: Dict[int, str]):
+        self.tag_names = tag_names
+        self.attribute_names = attribute_names
+        self.kinds = array("B")
+        self.ids = array("I")
+        self.parents = array("i")
+        self.offsets = array("I")
+        self.sizes = array("I")
+        self.path_index: Dict[str, array] = {}
+        # position right after the closing node which ends the document
+        self.end = 0
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @classmethod
+    def from_reader(cls, reader: GameSetupReader) -> Self:
+        return cls.parse(reader.view, reader.enclosing_tags_combined, reader.attribute_tags_combined)
+
+    @classmethod
+    def parse(cls, buffer, tag_names: Dict[int, str], attribute_names: Dict[int, str]) -> Self:
+        """Scan the node records of a FileDB document once and build the table and the path index."""
+        table = cls(tag_names, attribute_names)
+        kinds, ids, parents, offsets, sizes = table.kinds, table.ids, table.parents, table.offsets, table.sizes
+        path_index = table.path_index
+        parent = -1
+        path_stack: List[str] = [""]
+        for kind, node_id, ptr, content_size in iter_node_records(memoryview(buffer)):
+            index = len(kinds)
+            kinds.append(kind)
+            ids.append(node_id)
+            parents.append(parent)
+            offsets.append(ptr)
+            sizes.append(content_size)
+
+            if kind == CLOSING:
+                table.end = ptr
+                if parent >= 0:
+                    parent = parents[parent]
+                    path_stack.pop()
+                continue
+
+            names = tag_names if kind == TAG else attribute_names
+            name = names.get(node_id)
+            if name is None:
+                raise ParseError(f"Unknown FileDB node id {node_id} at 0x{ptr - NODE_HEADER_SIZE:x}")
+            path = f"{path_stack[-1]}/{name}"
+            indices = path_index.get(path)
+            if indices is None:
+                indices = path_index[path] = array("I")
+            indices.append(index)
+
+            if kind == TAG:
+                parent = index
+                path_stack.append(path)
+        return table
+
+    def find(self, path: str) -> array:
+        """Get the indices of all nodes at the given path."""
+        return self.path_index.get(path, array("I"))
+
+    def find_first(self, path: str) -> int | None:
+        indices = self.path_index.get(path)
+        return indices[0] if indices else None
+
+    def find_paths(self, name: str) -> List[str]:
+        """Get all paths ending with the given node name."""
+        return [path for path in self.path_index if path.rsplit("/", 1)[-1] == name]
+
+    def get_name(self, index: int) -> str | None:
+        kind = self.kinds[index]
+        if kind == CLOSING:
+            return None
+        return (self.tag_names if kind == TAG else self.attribute_names)[self.ids[index]]
+
+    def get_path(self, index: int) -> str:
+        names = []
+        while index >= 0:
+            names.append(self.get_name(index))
+            index = self.parents[index]
+        return "/" + "/".join(reversed(names))
+
+    def get_record_ptr(self, index: int) -> int:
+        """Get the position of the node header."""
+        return self.offsets[index] - NODE_HEADER_SIZE
+
+    def get_content(self, buffer, index: int) -> memoryview:
+        return memoryview(buffer)[self.offsets[index]:self.offsets[index] + self.sizes[index]]
+
+    def get_closing_index(self, index: int) -> int:
+        """Get the index of the closing node of a tag."""
+        for closing in range(index + 1, len(self.kinds)):
+            if self.kinds[closing] == CLOSING and self.parents[closing] == index:
+                return closing
+        raise ParseError(f"FileDB tag at 0x{self.get_record_ptr(index):x} is never closed")
+
+    def get_record_end(self, index: int) -> int:
+        """Get the position right after a node, including all children of a tag."""
+        kind = self.kinds[index]
+        if kind == ATTRIBUTE:
+            return self.offsets[index] + get_padded_size(self.sizes[index])
+        if kind == TAG:
+            return self.offsets[self.get_closing_index(index)]
+        return self.offsets[index]
+
+    def get_children(self, index: int) -> List[int]:
+        """Get the indices of the tags and attributes directly inside a tag, -1 for the top level."""
+        if index < 0:
+            start, end = 0, len(self.kinds)
+        else:
+            start, end = index + 1, self.get_closing_index(index)
+        return [child for child in range(start, end)
+                if self.parents[child] == index and self.kinds[child] != CLOSING]
+
+
+class FileDbTokenizer:
+    """Split a FileDB document which arrives in chunks into node records.
+
+    feed() yields (kind, node id, content offset, content) for every record completed by the chunk. Attribute
+    contents are returned without padding, tags and closing nodes have empty contents. Once the closing node which
+    ends the document is seen, done is set and further bytes are kept in remaining."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._ptr = 0
+        # document offset of the first byte in the buffer
+        self._buffer_offset = 0
+        self.depth = 0
+        self.done = False
+        # position right after the closing node which ends the document
+        self.end = 0
+
+    @property
+    def remaining(self) -> bytes:
+        """Bytes fed after the end of the node records."""
+        return bytes(self._buffer[self._ptr:]) if self.done else b""
+
+    def feed(self, data) -> Iterator[Tuple[int, int, int, bytes]]:
+        buffer = self._buffer
+        if self._ptr:
+            del buffer[:self._ptr]
+            self._buffer_offset += self._ptr
+            self._ptr = 0
+        buffer += data
+        if self.done:
+            return
+        for kind, node_id, content_ptr, content_size in iter_node_records(buffer, self._ptr, self.depth, partial=True):
+            if kind == ATTRIBUTE:
+                self._ptr = content_ptr + get_padded_size(content_size)
+                content = bytes(buffer[content_ptr:content_ptr + content_size])
+            else:
+                self._ptr = content_ptr
+                content = b""
+                if kind == TAG:
+                    self.depth += 1
+                elif self.depth:
+                    self.depth -= 1
+                else:
+                    self.done = True
+                    self.end = self._buffer_offset + content_ptr
+            yield kind, node_id, self._buffer_offset + content_ptr, content
+
+
+class ActiveDlcNameIds(NamedTuple):
+    active_dlcs: int
+    count: int
+    dlc: int
+
+
+# Name ids of the last document the active DLCs were resolved from by name, assumed to be the current game build
+_name_ids_hint: ActiveDlcNameIds | None = None
+
+
+class ActiveDlcStreamScan:
+    """Find the active DLCs of a FileDB document while it is fed in decompressed chunks.
+
+    The names of node ids are stored in tables at the end of the document, so node records are kept until the
+    tables arrive and are resolved by finish(). With the name ids of an earlier document of the same game build the
+    ActiveDLCs node is recognized as it streams by: feed() returns True once it is closed and its content is
+    plausible (a count matching the number of known DLCs), and the rest of the document does not need to be
+    decompressed at all."""
+
+    def __init__(self, name_ids: ActiveDlcNameIds | None = None):
+        self.name_ids = name_ids
+        self.tokenizer = FileDbTokenizer()
+        self.dlc_values: List[int] = []
+        # position of the content of the ActiveDLCs count attribute and right after the ActiveDLCs tag
+        self.count_ptr = -1
+        self.insertion_ptr = -1
+        self.resolved = False
+        self.resolved_early = False
+        self.bytes_fed = 0
+        self._records: List[Tuple[int, int, int, bytes]] = []
+        self._tail = bytearray()
+        self._candidate: Tuple[int, int, int, List[int]] | None = None
+        self._candidate_depth = 0
+
+    @property
+    def dlcs(self) -> List[DLC]:
+        return [DLC(value) for value in self.dlc_values]
+
+    def feed(self, data) -> bool:
+        """Feed the next decompressed chunk, return whether the active DLCs are known."""
+        self.bytes_fed += len(data)
+        if self.tokenizer.done:
+            self._tail += data
+            return False
+        for kind, node_id, offset, content in self.tokenizer.feed(data):
+            # only the small contents of count and DLC attributes are needed later on
+            self._records.append((kind, node_id, offset, content if len(content) <= 8 else b""))
+            if self.name_ids is not None and self._speculate(kind, node_id, offset, content):
+                return True
+        if self.tokenizer.done:
+            self._tail += self.tokenizer.remaining
+        return False
+
+    def _speculate(self, kind: int, node_id: int, offset: int, content: bytes) -> bool:
+        name_ids = self.name_ids
+        if self._candidate is None:
+            if kind == TAG and node_id == name_ids.active_dlcs:
+                # insertion ptr, count ptr, count, DLC values
+                self._candidate = (offset, -1, -1, [])
+                self._candidate_depth = 0
+            return False
+
+        insertion_ptr, count_ptr, count, dlc_values = self._candidate
+        if kind == TAG:
+            self._candidate_depth += 1
+        elif kind == CLOSING and self._candidate_depth:
+            self._candidate_depth -= 1
+        elif kind == ATTRIBUTE and not self._candidate_depth:
+            if node_id == name_ids.count and len(content) == 8 and count_ptr < 0:
+                self._candidate = (insertion_ptr, offset, struct.unpack("<q", content)[0], dlc_values)
+            elif node_id == name_ids.dlc and len(content) == 4:
+                dlc_values.append(int.from_bytes(content, "big"))
+            else:
+                self._candidate = None
+        elif kind == CLOSING:
+            self._candidate = None
+            if count == len(dlc_values) and all(value in DLC._value2member_map_ for value in dlc_values):
+                self.dlc_values, self.count_ptr, self.insertion_ptr = dlc_values, count_ptr, insertion_ptr
+                self.resolved = self.resolved_early = True
+                self._records.clear()
+                return True
+        return False
+
+    def finish(self):
+        """Resolve the active DLCs by name once the whole document was fed."""
+        global _name_ids_hint
+        if self.resolved:
+            return
+        if not self.tokenizer.done:
+            raise ParseError("FileDB document ends inside its node records")
+        tail = bytes(self._tail)
+        end = self.tokenizer.end
+        size = end + len(tail)
+        if len(tail) < TRAILER_SIZE:
+            raise ParseError("FileDB document has no name table pointers")
+        table_ptrs = struct.unpack_from("<II", tail, len(tail) - TRAILER_SIZE)
+        names = []
+        for table_ptr in table_ptrs:
+            table_end = min([ptr for ptr in table_ptrs if ptr > table_ptr] + [size - TRAILER_SIZE])
+            if not end <= table_ptr <= table_end:
+                raise ParseError(f"FileDB name table at 0x{table_ptr:x} is not behind the node records")
+            ids, table_names = decode_name_table(tail[table_ptr - end:table_end - end])
+            names.append(dict(zip(table_names, ids)))
+        tag_ids, attribute_ids = names
+
+        name_ids = ActiveDlcNameIds(tag_ids.get("ActiveDLCs", -1), attribute_ids.get("count", -1),
+                                    attribute_ids.get("DLC", -1))
+        self._resolve(name_ids)
+        self.resolved = True
+        if self.insertion_ptr >= 0:
+            _name_ids_hint = name_ids
+
+    def _resolve(self, name_ids: ActiveDlcNameIds):
+        """Replay the kept records like GameSetupReader does, stopping after the ActiveDLCs node."""
+        tag_stack: List[int] = []
+        active_dlcs_depth = -1
+        for kind, node_id, offset, content in self._records:
+            if kind == TAG:
+                tag_stack.append(node_id)
+                if node_id == name_ids.active_dlcs and active_dlcs_depth < 0:
+                    active_dlcs_depth = len(tag_stack)
+                    self.insertion_ptr = offset
+            elif kind == ATTRIBUTE and tag_stack and tag_stack[-1] == name_ids.active_dlcs:
+                if node_id == name_ids.count:
+                    self.count_ptr = offset
+                elif node_id == name_ids.dlc:
+                    self.dlc_values.append(int.from_bytes(content, "big"))
+            elif kind == CLOSING:
+                if len(tag_stack) == active_dlcs_depth:
+                    break
+                if tag_stack:
+                    tag_stack.pop()
+        self._records.clear()
+
+
+def scan_active_dlcs(chunks: Iterable[bytes], use_name_ids_hint: bool = True) -> ActiveDlcStreamScan:
+    """Find the active DLCs of a FileDB document from an iterable of decompressed chunks.
+
+    Iteration stops as soon as the active DLCs are known, so a lazy iterable such as
+    SaveGameReader.iter_entry_chunks() stops decompressing early."""
+    scan = ActiveDlcStreamScan(_name_ids_hint if use_name_ids_hint else None)
+    for chunk in chunks:
+        if scan.feed(chunk):
+            break
+    else:
+        scan.finish()
+    return scan
+
+
+class FileDbPatch:
+    """A batch of path addressed edits of a FileDB document, applied in a single pass.
+
+    Nodes are addressed by path as in the NodeTable path index, index picks one of several nodes at the same path.
+    All edits refer to positions in the original document, so edits can be added in any order. apply() sorts them,
+    relocates the trailing name table pointers by the size change in front of the tables and builds the new document
+    with one concatenation. Edits must not overlap, e.g. an attribute inside a removed tag cannot be set."""
+
+    def __init__(self, table: NodeTable, buffer):
+        self.table = table
+        self.view = memoryview(buffer)
+        self._tag_ids = {name: node_id for node_id, name in table.tag_names.items()}
+        self._attribute_ids = {name: node_id for node_id, name in table.attribute_names.items()}
+        # (start, end, replacement) in original positions
+        self._edits: List[Tuple[int, int, bytes]] = []
+
+    @classmethod
+    def from_reader(cls, reader: GameSetupReader) -> Self:
+        return cls(NodeTable.from_reader(reader), reader.view)
+
+    def _find(self, path: str, index: int) -> int:
+        indices = self.table.find(path)
+        if not -len(indices) <= index < len(indices):
+            raise KeyError(f"No node {path}[{index}] in the FileDB document")
+        return indices[index]
+
+    def make_attribute(self, name: str, content: bytes) -> bytes:
+        """Build the record of an attribute with a name from the attribute name table."""
+        if name not in self._attribute_ids:
+            raise KeyError(f"No attribute {name} in the FileDB name table")
+        return build_attribute(self._attribute_ids[name], content)
+
+    def make_tag(self, name: str, *children: bytes) -> bytes:
+        """Build the records of a tag with a name from the tag name table."""
+        if name not in self._tag_ids:
+            raise KeyError(f"No tag {name} in the FileDB name table")
+        return build_tag(self._tag_ids[name], *children)
+
+    def set_attribute(self, path: str, content: bytes, index: int = 0) -> Self:
+        """Replace the content of an attribute, its size may change."""
+        node = self._find(path, index)
+        if self.table.kinds[node] != ATTRIBUTE:
+            raise KeyError(f"{path} is not an attribute")
+        self._edits.append((self.table.get_record_ptr(node), self.table.get_record_end(node),
+                            build_attribute(self.table.ids[node], content)))
+        return self
+
+    def insert_node(self, parent_path: str, records: bytes, position: int | None = None, index: int = 0) -> Self:
+        """Insert node records (see make_attribute and make_tag) into a tag.
+
+        They go in front of the child at position, or behind the last child if position is None. A parent_path of
+        "/" inserts on the top level."""
+        parent = -1 if parent_path in ("", "/") else self._find(parent_path, index)
+        if parent >= 0 and self.table.kinds[parent] != TAG:
+            raise KeyError(f"{parent_path} is not a tag")
+        children = self.table.get_children(parent)
+        if position is None or position >= len(children):
+            if parent < 0:
+                ptr = self.table.end - NODE_HEADER_SIZE
+            else:
+                ptr = self.table.get_record_ptr(self.table.get_closing_index(parent))
+        else:
+            ptr = self.table.get_record_ptr(children[position])
+        self._edits.append((ptr, ptr, bytes(records)))
+        return self
+
+    def remove_node(self, path: str, index: int = 0) -> Self:
+        """Remove an attribute, or a tag with everything inside it."""
+        node = self._find(path, index)
+        self._edits.append((self.table.get_record_ptr(node), self.table.get_record_end(node), b""))
+        return self
+
+    def get_edits(self) -> List[Tuple[int, int, bytes]]:
+        """Get the edits sorted by position, including the relocated name table pointers."""
+        # stable sort: inserts at the same position keep their order and come before a removal starting there
+        edits = sorted(self._edits, key=lambda edit: (edit[0], edit[1]))
+        last_end = 0
+        for start, end, _ in edits:
+            if start < last_end:
+                raise ValueError(f"FileDB edits overlap at 0x{start:x}")
+            last_end = max(last_end, end)
+
+        size_change = sum(len(replacement) - (end - start) for start, end, replacement in edits)
+        if size_change:
+            trailer_ptr = len(self.view) - TRAILER_SIZE
+            table_ptrs = struct.unpack_from("<II", self.view, trailer_ptr)
+            if min(table_ptrs) < self.table.end:
+                raise ParseError("FileDB name tables are not behind the node records")
+            edits.append((trailer_ptr, trailer_ptr + 8,
+                          struct.pack("<II", *(ptr + size_change for ptr in table_ptrs))))
+        return edits
+
+    def apply(self) -> bytes:
+        """Build the patched document in one pass."""
+        parts = []
+        ptr = 0
+        for start, end, replacement in self.get_edits():
+            parts.append(self.view[ptr:start])
+            parts.append(replacement)
+            ptr = end
+        parts.append(self.view[ptr:])
+        return b"".join(parts)
+
+
+XML_ROOT_TAG = "Content"
+# marks attributes without content, which would look like empty tags otherwise
+XML_EMPTY_ATTRIBUTE = "fdb-attribute"
+# number of lines collected before they are written
+XML_BATCH_SIZE = 4096
+XML_HEX_CHUNK_SIZE = 64 * 1024
+
+
+def export_xml(buffer, f: TextIO, tag_names: Dict[int, str], attribute_names: Dict[int, str],
+               indent: str = "  ") -> int:
+    """Write a FileDB document as XML to a text file and return the number of tags and attributes.
+
+    The node records are walked once and written in batches of lines, so memory use does not grow with the document.
+    Attribute contents are written as upper case hex, like FileDBReader does."""
+    view = memoryview(buffer)
+    lines = [f"<{XML_ROOT_TAG}>\n"]
+    names: List[str] = []
+    pads = [indent]
+    nodes = 0
+    for kind, node_id, ptr, content_size in iter_node_records(view):
+        if kind == CLOSING:
+            if not names:
+                break
+            name = names.pop()
+            lines.append(f"{pads[len(names)]}</{name}>\n")
+            continue
+
+        name = (tag_names if kind == TAG else attribute_names).get(node_id)
+        if name is None:
+            raise ParseError(f"Unknown FileDB node id {node_id} at 0x{ptr - NODE_HEADER_SIZE:x}")
+        nodes += 1
+        pad = pads[len(names)]
+        if kind == TAG:
+            lines.append(f"{pad}<{name}>\n")
+            names.append(name)
+            if len(pads) <= len(names):
+                pads.append(pad + indent)
+        else:
+            if not content_size:
+                lines.append(f'{pad}<{name} {XML_EMPTY_ATTRIBUTE}="" />\n')
+            elif content_size <= XML_HEX_CHUNK_SIZE:
+                lines.append(f"{pad}<{name}>{view[ptr:ptr + content_size].hex().upper()}</{name}>\n")
+            else:
+                # large contents, e.g. in data.a7s, are converted piece by piece
+                lines.append(f"{pad}<{name}>")
+                f.write("".join(lines))
+                lines.clear()
+                for chunk_ptr in range(ptr, ptr + content_size, XML_HEX_CHUNK_SIZE):
+                    f.write(view[chunk_ptr:min(chunk_ptr + XML_HEX_CHUNK_SIZE, ptr + content_size)].hex().upper())
+                lines.append(f"</{name}>\n")
+        if len(lines) >= XML_BATCH_SIZE:
+            f.write("".join(lines))
+            lines.clear()
+    lines.append(f"</{XML_ROOT_TAG}>\n")
+    f.write("".join(lines))
+    return nodes
+
+
+def export_reader_xml(reader: GameSetupReader, f: TextIO, indent: str = "  ") -> int:
+    """Write the FileDB document of a reader as XML, with the names of its tag and attribute tables."""
+    return export_xml(reader.view, f, reader.enclosing_tags_combined, reader.attribute_tags_combined, indent)
+
+
+class _CompressingWriter:
+    """File-like wrapper which deflates everything written to it into another file."""
+
+    def __init__(self, f: BinaryIO, level: int):
+        self.f = f
+        self.compressor = zlib.compressobj(level)
+
+    def write(self, data):
+        self.f.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.f.write(self.compressor.flush())
+
+
+class _XmlCompiler:
+    def __init__(self, f: BinaryIO, tag_ids: Dict[str, int] | None, attribute_ids: Dict[str, int] | None):
+        self.f = f
+        self.tag_ids: Dict[str, int] = dict(tag_ids or {})
+        self.attribute_ids: Dict[str, int] = dict(attribute_ids or {})
+        self._next_tag_id = max(self.tag_ids.values(), default=0) + 1
+        self._next_attribute_id = max(self.attribute_ids.values(), default=ATTRIBUTE_ID_MIN - 1) + 1
+        self._buffer = bytearray()
+        self.size = 0
+
+    def get_tag_id(self, name: str) -> int:
+        node_id = self.tag_ids.get(name)
+        if node_id is None:
+            if self._next_tag_id >= ATTRIBUTE_ID_MIN:
+                raise ParseError("Too many tag names for a FileDB document")
+            node_id = self.tag_ids[name] = self._next_tag_id
+            self._next_tag_id += 1
+        return node_id
+
+    def get_attribute_id(self, name: str) -> int:
+        node_id = self.attribute_ids.get(name)
+        if node_id is None:
+            node_id = self.attribute_ids[name] = self._next_attribute_id
+            self._next_attribute_id += 1
+        return node_id
+
+    def write(self, data: bytes):
+        self._buffer += data
+        if len(self._buffer) >= XML_HEX_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.f.write(self._buffer)
+        self.size += len(self._buffer)
+        self._buffer = bytearray()
+
+    def write_leaf(self, name: str, text: str, marked_attribute: bool):
+        text = text.strip()
+        # an empty leaf is an empty tag, unless it is marked or its name is only known as attribute
+        if text or marked_attribute or (name in self.attribute_ids and name not in self.tag_ids):
+            try:
+                content = bytes.fromhex(text)
+            except ValueError:
+                raise ParseError(f"Content of the FileDB attribute {name} is not hex: {text[:32]!r}")
+            self.write(build_attribute(self.get_attribute_id(name), content))
+        else:
+            self.write(build_tag(self.get_tag_id(name)))
+
+    def compile(self, source) -> int:
+        pending: Tuple[str, bool] | None = None
+        elements: List[ElementTree.Element] = []
+        container = None
+        for event, element in ElementTree.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if not elements and element.tag == XML_ROOT_TAG:
+                    container = element
+                elif pending is not None:
+                    # the pending element has a child, so it is a tag
+                    self.write(struct.pack("<iI", 0, self.get_tag_id(pending[0])))
+                    pending = None
+                if element is not container:
+                    pending = (element.tag, XML_EMPTY_ATTRIBUTE in element.attrib)
+                elements.append(element)
+                continue
+
+            elements.pop()
+            if element is container:
+                break
+            if pending is not None:
+                self.write_leaf(pending[0], element.text or "", pending[1])
+                pending = None
+            else:
+                self.write(struct.pack("<iI", 0, 0))
+            # drop finished elements, so the tree never grows beyond the open tags
+            element.clear()
+            if elements:
+                elements[-1].clear()
+
+        self.write(struct.pack("<iI", 0, 0))
+        tags_ptr = self.size + len(self._buffer)
+        self.write(encode_name_table({node_id: name for name, node_id in self.tag_ids.items()}))
+        attributes_ptr = self.size + len(self._buffer)
+        self.write(encode_name_table({node_id: name for name, node_id in self.attribute_ids.items()}))
+        self.write(struct.pack("<ii", tags_ptr, attributes_ptr) + TRAILER_MAGIC)
+        self.flush()
+        return self.size
+
+
+def compile_xml(source, f: BinaryIO, tag_ids: Dict[str, int] | None = None,
+                attribute_ids: Dict[str, int] | None = None) -> int:
+    """Compile XML as written by export_xml into a FileDB document and return its size.
+
+    The XML is parsed incrementally and finished elements are dropped, records are written to f as they are
+    complete. An element with children is a tag, an element with hex text an attribute. Names get new ids in the
+    order they appear, unless tag_ids and attribute_ids give them, e.g. from the tables of the exported document.
+    Given names end up in the tables even if unused, so a document exported and compiled with its own tables is
+    identical to the original, as long as its name tables are laid out the way encode_name_table writes them."""
+    return _XmlCompiler(f, tag_ids, attribute_ids).compile(source)
+
+
+def compile_xml_compressed(source, f: BinaryIO, level: int = 9, tag_ids: Dict[str, int] | None = None,
+                           attribute_ids: Dict[str, int] | None = None) -> int:
+    """Compile XML into a zlib compressed FileDB document, as stored in a save game, and return its size before
+    compression."""
+    writer = _CompressingWriter(f, level)
+    size = compile_xml(source, writer, tag_ids, attribute_ids)
+    writer.flush()
+    return size
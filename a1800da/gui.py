@@ -1,10 +1,13 @@
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, ttk
 import os
-from typing import List, Tuple
+from typing import Any, Callable, List, Tuple
 
-from a1800da import lib
+from a1800da import cache, pipeline
 from a1800da.lib import DLC
+from a1800da.session import SaveSession
 
 
 class CheckboxesGuiModel:
@@ -37,33 +40,104 @@ def get_checkboxes_gui_models() -> List[CheckboxesGuiModel]:
 priorly_active_dlcs: List[DLC] = []
 
 
+class Worker:
+    """Runs one task at a time in a background thread and hands its progress and result to the Tk main loop.
+
+    Tk must only be used from the main thread, so the thread puts messages into a queue which is polled with
+    root.after."""
+    POLL_INTERVAL_MS = 50
+
+    def __init__(self, root: tk.Tk, on_progress: Callable[[str, float], None]):
+        self.root = root
+        self.on_progress = on_progress
+        self.messages: queue.Queue = queue.Queue()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def busy(self) -> bool:
+        return self.thread is not None
+
+    def run(self, task: Callable[[pipeline.Progress], Any], on_done: Callable[[Any, Exception | None], None]):
+        """Run task(progress) in the background, on_done(result, error) is called on the main thread."""
+        if self.busy:
+            raise RuntimeError("The worker is already busy")
+
+        def target():
+            try:
+                result = task(lambda stage, fraction: self.messages.put(("progress", stage, fraction)))
+            except Exception as e:
+                self.messages.put(("done", None, e))
+            else:
+                self.messages.put(("done", result, None))
+
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+        self.root.after(self.POLL_INTERVAL_MS, self._poll, on_done)
+
+    def _poll(self, on_done: Callable[[Any, Exception | None], None]):
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "progress":
+                self.on_progress(message[1], message[2])
+            else:
+                self.thread.join()
+                self.thread = None
+                on_done(message[1], message[2])
+                return
+        self.root.after(self.POLL_INTERVAL_MS, self._poll, on_done)
+
+
 class Gui:
 
     def apply_changes(self):
+        if self.worker.busy:
+            return
         dlcs_to_activate = [dlc for dlc in self.selected_dlcs if dlc not in self.priorly_active_dlcs]
-        if dlcs_to_activate:
-            self.game_setup_writer.insert_dlcs(dlcs_to_activate)
-
-            self.save_game_writer = lib.SaveGameWriter(self.save_game_reader, self.save_game_reader.initial_bytes)
-            self.save_game_writer.add_gamesetup_a7s(self.game_setup_writer.get_compressed_gamesetup_a7s())
-
-            old_filename = os.path.basename(self.save_game_file_path)
-            new_filename = old_filename.split(".")[0] + "_dlc_activated.a7s"
-            save_game_dir = os.path.dirname(self.save_game_file_path)
-
-            # with open(os.path.join(save_game_dir, "gui_gamesetup_original.a7s"), "w+b") as f:
-            #     f.write(self.save_game_reader.get_gamesetup_bytes())
-            # with open(os.path.join(save_game_dir, "gui_gamesetup_uncompressed.a7s"), "w+b") as f:
-            #     f.write(self.game_setup_writer.get_uncompressed_gamesetup_a7s())
-            # with open(os.path.join(save_game_dir, "gui_gamesetup.a7s"), "w+b") as f:
-            #     f.write(self.game_setup_writer.get_compressed_gamesetup_a7s())
-            self.save_game_writer.write_save_game(os.path.join(save_game_dir, new_filename))
-            self.status_message.set(f"New file '{new_filename}' created.")
-        elif not self.save_game_file_path:
+        if dlcs_to_activate and self.session is not None:
+            session = self.session
+            self.set_busy(True)
+            self.status_message.set("Activating DLCs...")
+
+            def activate(progress: pipeline.Progress) -> pipeline.PipelineResult:
+                # the session keeps the parsed save game, so applying again only adds the new DLCs
+                session.activate_dlcs(dlcs_to_activate)
+                return session.commit(verify_output=True, progress=progress)
+
+            self.worker.run(activate, self.on_changes_applied)
+        elif self.session is None:
             self.status_message.set(f"Select an Anno 1800 save game using 'Open Save File'.")
         else:
             self.status_message.set(f"Pick at least one DLC to activate.")
 
+    def on_changes_applied(self, result: pipeline.PipelineResult | None, error: Exception | None):
+        self.set_busy(False)
+        if error is not None:
+            self.status_message.set(f"Activating DLCs failed: {error}")
+            return
+        self.priorly_active_dlcs = self.session.active_dlcs
+        self.selected_dlcs = []
+        self.update_checkboxes()
+        if result.error is not None:
+            self.status_message.set(f"Activating DLCs failed: {result.error}")
+            return
+        self.status_message.set(f"New file '{os.path.basename(result.output_path)}' created.")
+
+    def show_progress(self, stage: str, fraction: float):
+        self.progress.set(fraction * 100)
+        if stage != "done":
+            self.status_message.set(f"{stage.capitalize()}...")
+
+    def set_busy(self, busy: bool):
+        """Disable the buttons while the worker is running."""
+        state = "disabled" if busy else "normal"
+        self.open_file_button.config(state=state)
+        self.apply_button.config(state=state)
+        if busy:
+            self.progress.set(0)
+
     def update_selected_dlcs(self, dlc: DLC):
         if dlc in self.selected_dlcs:
             self.selected_dlcs.remove(dlc)
@@ -72,6 +146,8 @@ class Gui:
         print(self.selected_dlcs)
 
     def open_file(self):
+        if self.worker.busy:
+            return
         folder1 = os.path.join(os.getenv("USERPROFILE"), "Documents", "Anno 1800", "accounts")
         folder2 = os.path.join(os.getenv("USERPROFILE"), "OneDrive", "Documents", "Anno 1800", "accounts")
 
@@ -95,39 +171,50 @@ class Gui:
 
     def refresh_activated_dlcs(self):
         self.selected_dlcs = []
+        self.priorly_active_dlcs = []
+        self.session = None
         if self.save_game_file_path:
-            f = open(self.save_game_file_path, "rb")
-
-            self.save_game_reader = lib.SaveGameReader(bytearray(f.read()))
-            print(f"Reading {self.save_game_file_path} ({self.save_game_reader.size} bytes) ")
-
-            self.game_setup_reader = lib.GameSetupReader(self.save_game_reader.get_gamesetup_bytes())
-
-            self.priorly_active_dlcs = self.game_setup_reader.get_activated_dlcs()
-
-            self.game_setup_writer = lib.GameSetupWriter(self.game_setup_reader, self.game_setup_reader.initial_bytes)
-
-            for (dlc, checkbox) in self.checkboxes:
-                checkbox.config(state='active')
-                checkbox.deselect()
-                if self.priorly_active_dlcs and dlc in self.priorly_active_dlcs:
-                    checkbox.select()
-                    checkbox.config(state='disabled')
+            save_game_file_path = self.save_game_file_path
+            self.set_busy(True)
+            self.status_message.set("Reading save game...")
+            self.worker.run(lambda progress: SaveSession(save_game_file_path, gamesetup_cache=self.gamesetup_cache,
+                                                         progress=progress),
+                            self.on_session_opened)
+
+    def on_session_opened(self, session: SaveSession | None, error: Exception | None):
+        self.set_busy(False)
+        if error is not None:
+            self.status_message.set(f"Reading the save game failed: {error}")
+            return
+        print(f"Read {session.save_game_path} ({session.size} bytes) ")
+        self.session = session
+        self.status_message.set("")
+        self.priorly_active_dlcs = session.active_dlcs
+        self.update_checkboxes()
+
+    def update_checkboxes(self):
+        for (dlc, checkbox) in self.checkboxes:
+            checkbox.config(state='active')
+            checkbox.deselect()
+            if self.priorly_active_dlcs and dlc in self.priorly_active_dlcs:
+                checkbox.select()
+                checkbox.config(state='disabled')
 
     def __init__(self):
-        self.save_game_reader: lib.SaveGameReader | None = None
-        self.game_setup_reader: lib.GameSetupReader | None = None
-        self.game_setup_writer: lib.GameSetupWriter | None = None
-        self.save_game_writer: lib.SaveGameWriter | None = None
+        # picking the same save game again does not decompress it again
+        self.gamesetup_cache = cache.GameSetupCache(cache.get_default_cache_dir())
         # DLCs selected by the checkboxes
         self.selected_dlcs: List[DLC] = []
         self.save_game_file_path: str | None = None
+        # the parsed save game, kept so DLCs can be applied more than once. It does not keep the file open.
+        self.session: SaveSession | None = None
         self.priorly_active_dlcs: List[DLC] = []
 
         # Create the main window
         root = tk.Tk()
         root.title("Anno 1800 DLC Activator - ALPHA 1")
         root.resizable(False, False)
+        self.worker = Worker(root, self.show_progress)
 
         # configure columns to fill available space
         for i in range(3):
@@ -146,8 +233,8 @@ class Gui:
         version_disclaimer_label.grid(row=current_row, column=0, columnspan=4)
         current_row+=1
 
-        open_file_button = tk.Button(root, text="Open Save File", command=self.open_file)
-        open_file_button.grid(row=current_row, column=0, padx=16, pady=16, ipadx=16, columnspan=4)
+        self.open_file_button = tk.Button(root, text="Open Save File", command=self.open_file)
+        self.open_file_button.grid(row=current_row, column=0, padx=16, pady=16, ipadx=16, columnspan=4)
 
         current_row += 1
         self.selected_dir_label = tk.StringVar()
@@ -164,9 +251,14 @@ class Gui:
 
         # Create an "Apply" button
         current_row += 5
-        open_file_button = tk.Button(root, text="Apply", command=self.apply_changes)
-        open_file_button.grid(row=current_row, column=0, padx=(32, 32), pady=(32, 16), ipadx=16, sticky="e",
-                              columnspan=4)
+        self.apply_button = tk.Button(root, text="Apply", command=self.apply_changes)
+        self.apply_button.grid(row=current_row, column=0, padx=(32, 32), pady=(32, 16), ipadx=16, sticky="e",
+                               columnspan=4)
+
+        current_row += 1
+        self.progress = tk.DoubleVar()
+        progress_bar = ttk.Progressbar(root, variable=self.progress, maximum=100, mode="determinate")
+        progress_bar.grid(row=current_row, column=0, padx=16, sticky="ew", columnspan=4)
 
         current_row += 1
         self.status_message = tk.StringVar()
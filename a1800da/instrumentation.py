@@ -0,0 +1,116 @@
+"""Timing spans and counters for the save game pipeline, reported to a pluggable sink.
+
+Instrumentation is disabled by default. While disabled, span() returns a shared no-op context manager and count()
+returns immediately; hot loops check `instrumentation.enabled` before counting, so nothing is formatted or recorded.
+
+    instrumentation.enable(instrumentation.JsonLinesSink(open("timings.jsonl", "a")))
+    with instrumentation.span("decompress", file=path):
+        ...
+    instrumentation.count("bytes_read", size)
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, TextIO
+
+STAGES = ("locate", "decompress", "parse", "patch", "compress", "write", "verify")
+
+enabled = False
+_sink: "Sink | None" = None
+_counters: Dict[str, int] = {}
+_lock = threading.Lock()
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Sink:
+    """Receives events: dicts with a "type" of "span" or "counters"."""
+
+    def emit(self, event: dict):
+        raise NotImplementedError
+
+
+class LoggingSink(Sink):
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("a1800da.instrumentation")
+        self.level = level
+
+    def emit(self, event: dict):
+        self.logger.log(self.level, "%s", event)
+
+
+class JsonLinesSink(Sink):
+    def __init__(self, file: TextIO):
+        self.file = file
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+
+class CallbackSink(Sink):
+    def __init__(self, callback: Callable[[dict], None]):
+        self.callback = callback
+
+    def emit(self, event: dict):
+        self.callback(event)
+
+
+class _Span:
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        sink = _sink
+        if sink is not None:
+            sink.emit({"type": "span", "name": self.name, "seconds": time.perf_counter() - self.start,
+                       "error": exc_type.__name__ if exc_type else None, **self.fields})
+        return False
+
+
+def enable(sink: Sink):
+    global enabled, _sink
+    _sink = sink
+    enabled = True
+
+
+def disable():
+    """Stop recording, emitting the counters collected so far."""
+    global enabled, _sink
+    flush()
+    enabled = False
+    _sink = None
+
+
+def span(name: str, **fields):
+    """Time the enclosed block as a stage, extra fields are added to the event."""
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name, fields)
+
+
+def count(name: str, value: int = 1):
+    """Add to a counter, e.g. bytes_read, bytes_written, nodes_visited or buffer_copies."""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def flush(**fields):
+    """Emit the counters collected since the last flush and reset them, extra fields are added to the event."""
+    global _counters
+    with _lock:
+        counters, _counters = _counters, {}
+    if counters and _sink is not None:
+        _sink.emit({"type": "counters", "counters": counters, **fields})
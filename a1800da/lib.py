@@ -1,16 +1,25 @@
-import io
+import errno
+import functools
+import hashlib
+import json
+import logging
+import mmap
+import os
 import struct
 import sys
+import threading
+import time
 import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from enum import Enum
-from io import BytesIO
-from typing import List, Self
+from enum import Enum, IntFlag
+from typing import Dict, Iterator, List, Self, Set, Tuple
 
+from a1800da import instrumentation
 
-def print(content):
-    """Hack to disable print output"""
-    pass
+
+log = logging.getLogger(__name__)
 
 
 class DLC(Enum):
@@ -30,66 +39,121 @@ class DLC(Enum):
 
 
 class Reader:
-    """Supply utility methods for reading bytes from a bytearray."""
+    """Supply utility methods for reading bytes from a bytearray or a memory mapped file.
+
+    All positional reads are served from a memoryview over the initial bytes, so no read copies the buffer."""
 
-    def __init__(self, initial_bytes: bytearray):
-        self.initial_bytes: bytearray = initial_bytes
-        self.initial_bytes_buffer = io.BytesIO(initial_bytes)
+    _STRUCT_FORMATS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+    def __init__(self, initial_bytes: bytearray | bytes | mmap.mmap):
+        self.initial_bytes: bytearray | bytes | mmap.mmap = initial_bytes
+        self.view = memoryview(initial_bytes)
         self.size = len(initial_bytes)
+        self.position = 0
+        self.file_path: str | None = None
+        self._mmap: mmap.mmap | None = None
+        self._file = None
+
+    @classmethod
+    def from_file(cls, filepath, use_mmap: bool = True) -> Self:
+        """Create a reader for the file at the given path.
+
+        With use_mmap the file is memory mapped read-only instead of being read into a bytearray."""
+        if not use_mmap:
+            with open(filepath, "rb") as f:
+                reader = cls(bytearray(f.read()))
+            reader.file_path = filepath
+            return reader
+        f = open(filepath, "rb")
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            f.close()
+            raise
+        reader = cls(mapped)
+        reader.file_path = filepath
+        reader._mmap = mapped
+        reader._file = f
+        return reader
+
+    def fileno(self) -> int | None:
+        """Get the file descriptor of the memory mapped file, None if the reader does not hold a file."""
+        return self._file.fileno() if self._file is not None else None
+
+    def close(self):
+        """Release the memory mapped file, if any."""
+        self.view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def seek(self, pos: int):
+        """Move the position used by the sequential read methods."""
+        self.position = pos
+
+    def tell(self) -> int:
+        return self.position
+
+    def _unpack(self, pos: int, size: int, byteorder: str) -> int:
+        if pos < 0:
+            raise ParseError(f"Cannot read {size} bytes at negative position {pos}")
+        if pos > self.size - size:
+            raise ParseError(f"Cannot read {size} bytes at 0x{pos:x}, only 0x{self.size:x} bytes are available")
+        fmt = self._STRUCT_FORMATS.get(size)
+        if fmt is not None:
+            return struct.unpack_from(("<" if byteorder == "little" else ">") + fmt, self.view, pos)[0]
+        return int.from_bytes(self.view[pos:pos + size], byteorder)
 
     def read_utf8(self, pos: int, size: int) -> str:
         """Read bytes from the initial bytes.
 
         Interpret bytes as UTF-8 string."""
-        buffer = BytesIO(self.initial_bytes)
-        buffer.seek(pos)
-        return buffer.read(size).decode("utf-8")
+        return str(self.view[pos:pos + size], "utf-8")
 
     def read(self, pos: int, size: int) -> int:
         """Read bytes from the initial bytes.
 
         Interpret bytes as little endian."""
-        buffer = BytesIO(self.initial_bytes)
-        buffer.seek(pos)
-        value = int.from_bytes(buffer.read(size), "little")
-        print(f"DEBUG: read() value {value} (0x{value:x}), {size} bytes from position (0x{pos:x})")
-        return value
+        return self._unpack(pos, size, "little")
 
     def read_sequentially(self, size: int) -> int:
-        """Read bytes from the given buffer.
+        """Read bytes from the current position.
 
         Interpret bytes as little endian."""
-        buffer = self.initial_bytes_buffer
-        value = int.from_bytes(buffer.read(size), "little")
-        print(
-            f"DEBUG: read_sequentially() value {value} (0x{value:x}), {size} bytes from position (0x{buffer.tell():x})")
+        value = self._unpack(self.position, size, "little")
+        self.position = min(self.position + size, self.size)
         return value
 
     def read_sequentially_big(self, size: int) -> int:
-        """Read bytes from the given buffer.
+        """Read bytes from the current position.
 
-        Interpret bytes as little endian."""
-        buffer = self.initial_bytes_buffer
-        value = int.from_bytes(buffer.read(size), "big")
-        print(
-            f"DEBUG: read_sequentially_big() value {value} (0x{value:x}), {size} bytes from position (0x{buffer.tell():x})")
+        Interpret bytes as big endian."""
+        value = self._unpack(self.position, size, "big")
+        self.position = min(self.position + size, self.size)
         return value
 
     def read_bytes(self, pos: int, size: int) -> bytes:
         """Read bytes from the initial bytes."""
-        buffer = BytesIO(self.initial_bytes)
-        buffer.seek(pos)
-        value = buffer.read(size)
-        print(f"DEBUG: read_bytes() {size} bytes from position (0x{pos:x})")
-        return value
+        return self.view[pos:pos + size].tobytes()
+
+    def read_view(self, pos: int, size: int) -> memoryview:
+        """Get a zero-copy view of bytes from the initial bytes."""
+        return self.view[pos:pos + size]
 
     def read_big(self, pos: int, size: int) -> int:
         """Read bytes from the initial  bytes.
 
         Interpret bytes as big endian."""
-        byio = BytesIO(self.initial_bytes)
-        byio.seek(pos)
-        return int.from_bytes(byio.read(size), "big")
+        return self._unpack(pos, size, "big")
 
 
 class GameSetupNodeTypes(Enum):
@@ -98,28 +162,158 @@ class GameSetupNodeTypes(Enum):
     CLOSING = 3
 
 
-@dataclass()
-class GameSetupNode:
-    node_id: int | None
-    node_name: str | None
-    parent: Self | None
+@functools.lru_cache(maxsize=64)
+def decode_name_table(raw: bytes) -> Tuple[Tuple[int, ...], Tuple[str, ...]]:
+    """Decode the raw bytes of a FileDB tag or attribute name table.
+
+    The table holds a 4 byte count, count 2 byte ids and count null terminated names. Ids are decoded in one go,
+    names with a single split. Saves of the same game build share identical tables, so results are cached by the
+    raw bytes."""
+    if len(raw) < 4:
+        raise ParseError("FileDB name table is truncated")
+    count = struct.unpack_from("<I", raw)[0]
+    names_ptr = 4 + 2 * count
+    if names_ptr > len(raw):
+        raise ParseError(f"FileDB name table with {count} names is truncated")
+    ids = array("H")
+    ids.frombytes(raw[4:names_ptr])
+    if sys.byteorder == "big":
+        ids.byteswap()
+    names = raw[names_ptr:].split(b"\0", count)
+    if len(names) <= count:
+        raise ParseError(f"FileDB name table with {count} names is truncated")
+    return tuple(ids), tuple(name.decode() for name in names[:count])
+
+
+# FileDB node kinds: a tag encloses nodes up to its closing node, an attribute holds content
+TAG = 1
+ATTRIBUTE = 2
+CLOSING = 3
+
+ATTRIBUTE_ID_MIN = 32768
+NODE_HEADER_SIZE = 8
+CONTENT_BLOCK_SIZE = 8
+_NODE_HEADER = struct.Struct("<II")
+
+
+def get_padded_size(content_size: int) -> int:
+    """Get the size an attribute content occupies, padded to the content block size."""
+    return -(-content_size // CONTENT_BLOCK_SIZE) * CONTENT_BLOCK_SIZE
+
+
+def iter_node_records(buffer, ptr: int = 0, depth: int = 0,
+                      partial: bool = False) -> Iterator[Tuple[int, int, int, int]]:
+    """Walk the node records of a FileDB document and yield (kind, node id, content offset, content size).
+
+    This is the one walk over node records which the readers, the node table, the tokenizer and the XML export share.
+    Tags and closing nodes have a content size of 0. The walk ends after the closing node which leaves the depth it
+    started at. A record which does not fit into the buffer raises a ParseError, with partial the walk stops in front
+    of it instead, for documents which arrive in chunks. The buffer is not held between records, so a bytearray may
+    be resized while the walk is suspended."""
+    size = len(buffer)
+    unpack_from = _NODE_HEADER.unpack_from
+    while True:
+        if ptr + NODE_HEADER_SIZE > size:
+            if partial:
+                return
+            raise ParseError(f"FileDB node at 0x{ptr:x} is beyond the end of the document")
+        content_size, node_id = unpack_from(buffer, ptr)
+        content_ptr = ptr + NODE_HEADER_SIZE
+        if node_id >= ATTRIBUTE_ID_MIN:
+            ptr = content_ptr + get_padded_size(content_size)
+            if ptr > size:
+                if partial:
+                    return
+                raise ParseError(f"FileDB attribute at 0x{content_ptr - NODE_HEADER_SIZE:x} is beyond the end of the "
+                                 f"document")
+            yield ATTRIBUTE, node_id, content_ptr, content_size
+        elif node_id:
+            ptr = content_ptr
+            depth += 1
+            yield TAG, node_id, content_ptr, 0
+        else:
+            ptr = content_ptr
+            yield CLOSING, node_id, content_ptr, 0
+            if not depth:
+                return
+            depth -= 1
 
 
 class GameSetupReader(Reader):
-    def __init__(self, initial_bytes: bytearray):
-        super().__init__(initial_bytes)
+    """Read the tag and attribute names and the active DLCs of a decompressed gamesetup.a7s.
 
-        self.existing_dlcs: List[DLC] = []
-        self.existing_count_node_ptr: int = -1
+    Nothing is parsed up front: the name tables are parsed on first access, the active DLCs on first access by a scan
+    which stops right after the ActiveDLCs node is closed."""
 
-        # debug:
-        self._parse_enclosing_nodes_block(self.get_enclosing_nodes_block_ptr())
-        self._parse_attribute_nodes_block(self.get_attribute_nodes_block_ptr())
-        self._parse_active_dlcs()
+    def __init__(self, initial_bytes: bytearray | bytes | mmap.mmap):
+        super().__init__(initial_bytes)
+
+        self._enclosing_tags_combined: Dict[int, str] | None = None
+        self._attribute_tags_combined: Dict[int, str] | None = None
+        self._attribute_node_to_id: Dict[str, int] | None = None
+        self._existing_dlcs: List[DLC] | None = None
+        self._existing_count_node_ptr: int = -1
+        self._new_dlc_insertion_ptr: int = -1
 
     def get_activated_dlcs(self):
         return self.existing_dlcs
 
+    def get_active_dlcs_state(self) -> Tuple[List[int], int, int]:
+        """Get the DLC values, count pointer and insertion pointer the ActiveDLCs scan found."""
+        return [dlc.value for dlc in self.existing_dlcs], self.existing_count_node_ptr, self.new_dlc_insertion_ptr
+
+    def restore_active_dlcs_state(self, dlc_values: List[int], count_ptr: int, insertion_ptr: int):
+        """Use the result of an earlier ActiveDLCs scan of the same bytes instead of scanning again."""
+        self._existing_dlcs = [DLC(value) for value in dlc_values]
+        self._existing_count_node_ptr = count_ptr
+        self._new_dlc_insertion_ptr = insertion_ptr
+
+    def copy_name_tables(self, other: Self):
+        """Use the name tables another reader parsed, for bytes with the same name tables."""
+        self._enclosing_tags_combined = other.enclosing_tags_combined
+        self._attribute_tags_combined = other.attribute_tags_combined
+        self._attribute_node_to_id = other.attribute_node_to_id
+        self.enclosing_tag_ids, self.enclosing_tag_names = other.enclosing_tag_ids, other.enclosing_tag_names
+        self.attribute_tag_ids, self.attribute_tag_names = other.attribute_tag_ids, other.attribute_tag_names
+
+    @property
+    def enclosing_tags_combined(self) -> Dict[int, str]:
+        if self._enclosing_tags_combined is None:
+            self._parse_enclosing_nodes_block(self.get_enclosing_nodes_block_ptr())
+        return self._enclosing_tags_combined
+
+    @property
+    def attribute_tags_combined(self) -> Dict[int, str]:
+        if self._attribute_tags_combined is None:
+            self._parse_attribute_nodes_block(self.get_attribute_nodes_block_ptr())
+        return self._attribute_tags_combined
+
+    @property
+    def attribute_node_to_id(self) -> Dict[str, int]:
+        if self._attribute_node_to_id is None:
+            self._parse_attribute_nodes_block(self.get_attribute_nodes_block_ptr())
+        return self._attribute_node_to_id
+
+    @property
+    def existing_dlcs(self) -> List[DLC]:
+        if self._existing_dlcs is None:
+            self._parse_active_dlcs()
+        return self._existing_dlcs
+
+    @property
+    def existing_count_node_ptr(self) -> int:
+        """Position of the content of the ActiveDLCs count attribute, -1 if there is none."""
+        if self._existing_dlcs is None:
+            self._parse_active_dlcs()
+        return self._existing_count_node_ptr
+
+    @property
+    def new_dlc_insertion_ptr(self) -> int:
+        """Position right after the ActiveDLCs tag, -1 if there is none."""
+        if self._existing_dlcs is None:
+            self._parse_active_dlcs()
+        return self._new_dlc_insertion_ptr
+
     def get_enclosing_nodes_block_ptr(self) -> int:
         """Get the pointer to where the enclosing nodes block is saved."""
         return self.read(self.size - 16, 4)
@@ -128,25 +322,24 @@ class GameSetupReader(Reader):
         """Get the pointer to where the attribute nodes block is saved."""
         return self.read(self.size - 12, 4)
 
+    def _read_name_table(self, ptr) -> Tuple[Tuple[int, ...], Tuple[str, ...]]:
+        """Read the ids and names of a tag or attribute name table.
+
+        The table ends at the next table or at the trailing pointers, whichever comes first."""
+        end = self.size - 16
+        for table_ptr in (self.get_enclosing_nodes_block_ptr(), self.get_attribute_nodes_block_ptr()):
+            if ptr < table_ptr < end:
+                end = table_ptr
+        return decode_name_table(self.read_bytes(ptr, end - ptr))
+
     def _parse_enclosing_nodes_block(self, ptr):
-        self.initial_bytes_buffer.seek(ptr)
-        enclosing_tags_count = self.read_sequentially(4)
-        self.enclosing_tag_ids = [self.read_sequentially(2) for _ in range(0, enclosing_tags_count)]
-        self.enclosing_tag_names = [self._collect_single_chars_until_empty_byte() for _ in
-                                    range(0, enclosing_tags_count)]
-        self.enclosing_tags_combined = dict(zip(self.enclosing_tag_ids, self.enclosing_tag_names))
-        print(self.enclosing_tags_combined)
+        self.enclosing_tag_ids, self.enclosing_tag_names = self._read_name_table(ptr)
+        self._enclosing_tags_combined = dict(zip(self.enclosing_tag_ids, self.enclosing_tag_names))
 
     def _parse_attribute_nodes_block(self, ptr):
-        self.initial_bytes_buffer.seek(ptr)
-        attribute_tags_count = self.read_sequentially(4)
-        self.attribute_tag_ids = [self.read_sequentially(2) for _ in range(0, attribute_tags_count)]
-        self.attribute_tag_names = [self._collect_single_chars_until_empty_byte() for _ in
-                                    range(0, attribute_tags_count)]
-        self.attribute_node_to_id = dict(zip(self.attribute_tag_names, self.attribute_tag_ids))
-        print(self.attribute_node_to_id)
-        self.attribute_tags_combined = dict(zip(self.attribute_tag_ids, self.attribute_tag_names))
-        print(self.attribute_tags_combined)
+        self.attribute_tag_ids, self.attribute_tag_names = self._read_name_table(ptr)
+        self._attribute_node_to_id = dict(zip(self.attribute_tag_names, self.attribute_tag_ids))
+        self._attribute_tags_combined = dict(zip(self.attribute_tag_ids, self.attribute_tag_names))
 
     @staticmethod
     def get_node_type(number):
@@ -157,60 +350,320 @@ class GameSetupReader(Reader):
         if number <= 0:
             return GameSetupNodeTypes.CLOSING
 
-    def _parse_active_dlcs(self):
-        self.initial_bytes_buffer.seek(0)
-        xml_nested_level = 0
-        current_opening_node: GameSetupNode = GameSetupNode(None, None, None)
-
-        while xml_nested_level >= 0:
-            node_content_size = self.read_sequentially(4)
-            node_id = self.read_sequentially(4)
-            node_type = self.get_node_type(node_id)
-
-            if node_type == GameSetupNodeTypes.OPENING:
-                current_opening_node = GameSetupNode(node_id, self.enclosing_tags_combined[node_id],
-                                                     current_opening_node)
-                xml_nested_level += 1
-                if self.enclosing_tags_combined[node_id] == "ActiveDLCs":
-                    self.new_dlc_insertion_ptr = self.initial_bytes_buffer.tell()
-                    print(f"SAVED new_dlc_insertion_ptr = 0x{self.new_dlc_insertion_ptr:x}")
-
-            if node_type == GameSetupNodeTypes.ATTRIBUTE:
-                content_block_size = 8
-                node_content = self.read_sequentially_big(node_content_size)
-                if self.attribute_tags_combined[node_id] == "count" and current_opening_node.node_name == "ActiveDLCs":
-                    self.existing_count_node_ptr: int = self.initial_bytes_buffer.tell() - node_content_size
-                    print(
-                        f"FOUND COUNT the <ActiveDLC><count> tag. Write value to: 0x{self.existing_count_node_ptr:x}, {node_content_size} bytes, current content 0x{node_content:x}")
-                if self.attribute_tags_combined[node_id] == "DLC":
-                    self.existing_dlcs.append(DLC(node_content))
-                rest_of_bytes_to_read = content_block_size - node_content_size % content_block_size
-                if rest_of_bytes_to_read % content_block_size > 0:
-                    self.read_sequentially(rest_of_bytes_to_read)
-
-            if node_type == GameSetupNodeTypes.CLOSING:
-                current_opening_node = current_opening_node.parent
-                xml_nested_level -= 1
-
-        return self.existing_dlcs
-
-    def _collect_single_chars_until_empty_byte(self):
-        character = ""
-        collected_chars = ""
-        while character != '\0':
-            character = self.initial_bytes_buffer.read(1).decode()
-            if character == '\0':
-                return collected_chars
-            collected_chars = collected_chars + character
+    def _parse_active_dlcs(self, full_scan: bool = False):
+        """Find the active DLCs and the positions needed to add DLCs.
+
+        Only DLC attributes directly inside ActiveDLCs are active DLCs, and the scan stops as soon as the ActiveDLCs
+        node is closed. With full_scan the whole document is walked and DLC attributes are collected wherever they
+        appear, as the first release did."""
+        with instrumentation.span("parse"):
+            nodes_visited = self._scan_active_dlcs(full_scan)
+        if instrumentation.enabled:
+            instrumentation.count("nodes_visited", nodes_visited)
+        return self._existing_dlcs
+
+    def _scan_active_dlcs(self, full_scan: bool) -> int:
+        """Walk the nodes for _parse_active_dlcs, return the number of nodes visited."""
+        enclosing_tags_combined = self.enclosing_tags_combined
+        attribute_tags_combined = self.attribute_tags_combined
+        self._existing_dlcs = []
+        self._existing_count_node_ptr = -1
+        self._new_dlc_insertion_ptr = -1
+
+        view = self.view
+        # names of the open tags
+        tag_names: List[str] = []
+        active_dlcs_depth = -1
+        nodes_visited = 0
+        for kind, node_id, ptr, content_size in iter_node_records(view):
+            nodes_visited += 1
+            if kind == TAG:
+                name = enclosing_tags_combined.get(node_id)
+                if name is None:
+                    raise ParseError(f"Unknown tag id {node_id} at 0x{ptr - NODE_HEADER_SIZE:x}")
+                tag_names.append(name)
+                if name == "ActiveDLCs":
+                    active_dlcs_depth = len(tag_names)
+                    self._new_dlc_insertion_ptr = ptr
+                    log.debug("SAVED new_dlc_insertion_ptr = 0x%x", ptr)
+
+            elif kind == ATTRIBUTE:
+                in_active_dlcs = bool(tag_names) and tag_names[-1] == "ActiveDLCs"
+                if full_scan or in_active_dlcs:
+                    name = attribute_tags_combined.get(node_id)
+                    if name is None:
+                        raise ParseError(f"Unknown attribute id {node_id} at 0x{ptr - NODE_HEADER_SIZE:x}")
+                    if name == "count" and in_active_dlcs:
+                        self._existing_count_node_ptr = ptr
+                        log.debug("FOUND COUNT the <ActiveDLC><count> tag. Write value to: 0x%x, %d bytes, "
+                                  "current content %s", ptr, content_size, view[ptr:ptr + content_size].hex())
+                    if name == "DLC":
+                        self._existing_dlcs.append(DLC(int.from_bytes(view[ptr:ptr + content_size], "big")))
+
+            elif len(tag_names) == active_dlcs_depth and not full_scan:
+                break
+            elif tag_names:
+                tag_names.pop()
+
+        return nodes_visited
 
 
 class ParseError(Exception):
     pass
 
 
+RESOURCE_FILE_MAGIC = "Resource File V2.2"
+FIRST_BLOCK_PTR_PTR = 784
+RESOURCE_FILE_HEADER_SIZE = 792
+BLOCK_HEADER_SIZE = 32
+DIRECTORY_ENTRY_SIZE = 560
+FILE_NAME_SIZE = 520
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class BlockFlags(IntFlag):
+    COMPRESSED = 1
+    ENCRYPTED = 2
+    MEMORY_RESIDENT = 4
+    DELETED = 8
+
+
+@dataclass()
+class RdaEntry:
+    name: str
+    offset: int
+    compressed_size: int
+    size: int
+    timestamp: int
+    directory_entry_ptr: int
+
+    @property
+    def offset_ptr(self) -> int:
+        return self.directory_entry_ptr + FILE_NAME_SIZE + 0 * 8
+
+    @property
+    def compressed_size_ptr(self) -> int:
+        return self.directory_entry_ptr + FILE_NAME_SIZE + 1 * 8
+
+    @property
+    def size_ptr(self) -> int:
+        return self.directory_entry_ptr + FILE_NAME_SIZE + 2 * 8
+
+
+@dataclass()
+class RdaBlock:
+    ptr: int
+    flags: BlockFlags
+    file_count: int
+    directory_size: int
+    decompressed_size: int
+    next_block_ptr: int
+
+    @property
+    def directory_ptr(self) -> int:
+        return self.ptr - self.directory_size
+
+    def get_directory_entry_ptrs(self) -> range:
+        return range(self.directory_ptr, self.directory_ptr + self.file_count * DIRECTORY_ENTRY_SIZE,
+                     DIRECTORY_ENTRY_SIZE)
+
+
+def iter_blocks(reader: Reader) -> Iterator[RdaBlock]:
+    """Walk the block chain of a Resource File V2.2.
+
+    The walk stops at the end of the file, on a block pointing back into the chain or on a block whose directory
+    would start inside the file header."""
+    if reader.read_utf8(0, len(RESOURCE_FILE_MAGIC)) != RESOURCE_FILE_MAGIC:
+        raise ParseError(f"Not a {RESOURCE_FILE_MAGIC}")
+    visited = set()
+    block_ptr = reader.read(FIRST_BLOCK_PTR_PTR, 8)
+    while RESOURCE_FILE_HEADER_SIZE <= block_ptr <= reader.size - BLOCK_HEADER_SIZE and block_ptr not in visited:
+        visited.add(block_ptr)
+        flags, file_count, directory_size, decompressed_size, next_block_ptr = struct.unpack_from(
+            "<IIQQQ", reader.view, block_ptr)
+        block = RdaBlock(block_ptr, BlockFlags(flags), file_count, directory_size, decompressed_size, next_block_ptr)
+        if block.directory_ptr < RESOURCE_FILE_HEADER_SIZE:
+            return
+        yield block
+        block_ptr = next_block_ptr
+
+
+class RdaIndex:
+    """Index of every file entry in the directories of a Resource File V2.2.
+
+    Names map to positions in parallel arrays of offsets, sizes, timestamps and directory entry pointers. If a name
+    occurs more than once, the first entry along the block chain wins. Entries of compressed, encrypted, memory
+    resident or deleted blocks are not indexed."""
+
+    SIDECAR_SUFFIX = ".rdaindex"
+    SIDECAR_VERSION = 1
+    _FINGERPRINT_TAIL_SIZE = 4096
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.name_to_index: Dict[str, int] = {}
+        self.offsets = array("Q")
+        self.compressed_sizes = array("Q")
+        self.sizes = array("Q")
+        self.timestamps = array("Q")
+        self.directory_entry_ptrs = array("Q")
+        self.block_ptrs = array("Q")
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name: str):
+        return name in self.name_to_index
+
+    def __getitem__(self, name: str) -> RdaEntry:
+        return self.get_entry(self.name_to_index[name])
+
+    def __iter__(self) -> Iterator[RdaEntry]:
+        return (self.get_entry(i) for i in range(len(self.names)))
+
+    def get(self, name: str) -> RdaEntry | None:
+        index = self.name_to_index.get(name)
+        return None if index is None else self.get_entry(index)
+
+    def get_entry(self, index: int) -> RdaEntry:
+        return RdaEntry(self.names[index], self.offsets[index], self.compressed_sizes[index], self.sizes[index],
+                        self.timestamps[index], self.directory_entry_ptrs[index])
+
+    def update_entry(self, name: str, offset: int, compressed_size: int, size: int):
+        """Change the offset and sizes of an entry whose directory entry was rewritten."""
+        index = self.name_to_index[name]
+        self.offsets[index] = offset
+        self.compressed_sizes[index] = compressed_size
+        self.sizes[index] = size
+
+    def _add(self, name: str, offset: int, compressed_size: int, size: int, timestamp: int, directory_entry_ptr: int,
+             block_ptr: int):
+        if name not in self.name_to_index:
+            self.name_to_index[name] = len(self.names)
+        self.names.append(name)
+        self.offsets.append(offset)
+        self.compressed_sizes.append(compressed_size)
+        self.sizes.append(size)
+        self.timestamps.append(timestamp)
+        self.directory_entry_ptrs.append(directory_entry_ptr)
+        self.block_ptrs.append(block_ptr)
+
+    @classmethod
+    def build(cls, reader: Reader) -> Self:
+        """Walk the block chain once and decode every directory entry.
+
+        The walk stops at the end of the file, on a block pointing back into the chain or on a block header which
+        does not describe a directory in front of it."""
+        index = cls()
+        for block in iter_blocks(reader):
+            if block.flags & (BlockFlags.COMPRESSED | BlockFlags.ENCRYPTED | BlockFlags.MEMORY_RESIDENT):
+                continue
+            if block.directory_size != block.file_count * DIRECTORY_ENTRY_SIZE:
+                break
+            if not block.flags & BlockFlags.DELETED:
+                for entry_ptr in block.get_directory_entry_ptrs():
+                    name = str(reader.view[entry_ptr:entry_ptr + FILE_NAME_SIZE], "utf-16-le").split("\0", 1)[0]
+                    offset, compressed_size, size, timestamp, _ = struct.unpack_from(
+                        "<QQQQQ", reader.view, entry_ptr + FILE_NAME_SIZE)
+                    index._add(name, offset, compressed_size, size, timestamp, entry_ptr, block.ptr)
+        return index
+
+    @classmethod
+    def get_fingerprint(cls, reader: Reader) -> Dict[str, int | str]:
+        """Identify the file a reader was created from by size, modification time and a hash of header and tail."""
+        digest = hashlib.blake2b(reader.view[:RESOURCE_FILE_HEADER_SIZE], digest_size=16)
+        digest.update(reader.view[max(reader.size - cls._FINGERPRINT_TAIL_SIZE, 0):])
+        mtime_ns = os.stat(reader.file_path).st_mtime_ns if reader.file_path else 0
+        return {"size": reader.size, "mtime_ns": mtime_ns, "hash": digest.hexdigest()}
+
+    @classmethod
+    def load_or_build(cls, reader: Reader) -> Self:
+        """Load the index from the sidecar file next to the save game, or build and save it.
+
+        The sidecar is only used if size, modification time and the header hash of the save game still match."""
+        if not reader.file_path:
+            return cls.build(reader)
+        sidecar_path = reader.file_path + cls.SIDECAR_SUFFIX
+        fingerprint = cls.get_fingerprint(reader)
+        try:
+            with open(sidecar_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == cls.SIDECAR_VERSION and data.get("fingerprint") == fingerprint:
+                return cls._from_json(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        index = cls.build(reader)
+        try:
+            with open(sidecar_path, "w", encoding="utf-8") as f:
+                json.dump(index._to_json(fingerprint), f)
+        except OSError:
+            pass
+        return index
+
+    def _to_json(self, fingerprint: Dict[str, int | str]) -> dict:
+        return {
+            "version": self.SIDECAR_VERSION,
+            "fingerprint": fingerprint,
+            "names": self.names,
+            "offsets": self.offsets.tolist(),
+            "compressed_sizes": self.compressed_sizes.tolist(),
+            "sizes": self.sizes.tolist(),
+            "timestamps": self.timestamps.tolist(),
+            "directory_entry_ptrs": self.directory_entry_ptrs.tolist(),
+            "block_ptrs": self.block_ptrs.tolist(),
+        }
+
+    @classmethod
+    def _from_json(cls, data: dict) -> Self:
+        index = cls()
+        for entry in zip(data["names"], data["offsets"], data["compressed_sizes"], data["sizes"], data["timestamps"],
+                         data["directory_entry_ptrs"], data["block_ptrs"]):
+            index._add(*entry)
+        return index
+
+
+def is_zlib_stream(data) -> bool:
+    """Check whether data starts with a zlib header."""
+    return len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0
+
+
+def get_extract_path(output_dir, name: str) -> str:
+    """Get the path a file in the save game is extracted to, refusing names which point outside output_dir."""
+    relative_path = os.path.normpath(name.replace("\\", "/"))
+    if os.path.isabs(relative_path) or os.path.splitdrive(relative_path)[0] or \
+            relative_path.split(os.sep)[0] in ("..", "", "."):
+        raise ParseError(f"Refusing to extract {name} outside of the output directory")
+    return os.path.join(output_dir, relative_path)
+
+
 class SaveGameReader(Reader):
-    def __init__(self, initial_bytes: bytearray):
+    def __init__(self, initial_bytes: bytearray | bytes | mmap.mmap):
         super().__init__(initial_bytes)
+        self._index: RdaIndex | None = None
+
+    def get_index(self, use_sidecar: bool = False) -> RdaIndex:
+        """Get the index of all files in the save game, built on first access.
+
+        With use_sidecar the index is cached in a file next to the save game."""
+        if self._index is None:
+            with instrumentation.span("locate"):
+                self._index = RdaIndex.load_or_build(self) if use_sidecar else RdaIndex.build(self)
+        return self._index
+
+    def set_index(self, index: RdaIndex):
+        """Use an index which is known to match the save game, e.g. one updated after patching it in place."""
+        self._index = index
+
+    def locate_gamesetup(self) -> RdaEntry:
+        """Get the gamesetup.a7s entry and save its file header pointers, without decompressing it."""
+        entry = self.get_index().get("gamesetup.a7s")
+        if entry is None:
+            raise ParseError("No gamesetup.a7s in the save game")
+        self.gamesetup_bytes_ptr_ptr = entry.offset_ptr
+        self.gamesetup_compressed_ptr = entry.compressed_size_ptr
+        self.gamesetup_file_size_ptr = entry.size_ptr
+        return entry
 
     def get_gamesetup_bytes(self) -> bytearray:
         """Extract the gamesetup.a7s bytes from the save file.
@@ -218,106 +671,476 @@ class SaveGameReader(Reader):
         The file is returned decompressed. Save the file header pointers for bytes, file size and compressed for
         later usage.
         """
-        if self.read_utf8(0, 18) != "Resource File V2.2":
-            raise ParseError("Not a Resource File V2.2")
-        magic_bytes = 784
-        first_block_ptr = self.read(magic_bytes, 8)
-        return bytearray(zlib.decompress(self._find_gamesetup_bytes(first_block_ptr)))
-
-    def _find_gamesetup_bytes(self, block_ptr) -> bytes:
-        """Find the gamesetup.a7s bytes by looking through each file header of each directory of each block."""
-
-        # Scan through block headers
-        file_count = self.read(block_ptr + 4, 4)
-        directory_size = self.read(block_ptr + 8, 8)
-        next_block_ptr = self.read(block_ptr + 24, 8)
-
-        directory_block_size = 560
-        for i in range(0, file_count):
-            # Scan through file headers
-            directory_block_ptr = block_ptr - directory_size + i * directory_block_size
-            file_name = self.read_utf8(directory_block_ptr, 520).replace("\0", "")
-            if file_name == "gamesetup.a7s":
-                self.gamesetup_bytes_ptr_ptr = directory_block_ptr + 520 + 0 * 8
-                gamesetup_bytes_ptr = self.read(self.gamesetup_bytes_ptr_ptr, 8)
-                self.gamesetup_compressed_ptr = directory_block_ptr + 520 + 1 * 8
-                self.gamesetup_file_size_ptr = directory_block_ptr + 520 + 2 * 8
-                gamesetup_file_size = self.read(self.gamesetup_file_size_ptr, 8)
-                return self.read_bytes(gamesetup_bytes_ptr, gamesetup_file_size)
-        return self._find_gamesetup_bytes(next_block_ptr)
+        entry = self.locate_gamesetup()
+        with instrumentation.span("decompress"):
+            gamesetup_bytes = bytearray(zlib.decompress(self.read_view(entry.offset, entry.compressed_size)))
+        if instrumentation.enabled:
+            instrumentation.count("bytes_read", entry.compressed_size)
+            instrumentation.count("bytes_decompressed", len(gamesetup_bytes))
+            instrumentation.count("buffer_copies")
+        return gamesetup_bytes
+
+    def get_entry(self, name: str) -> RdaEntry:
+        entry = self.get_index().get(name)
+        if entry is None:
+            raise ParseError(f"No {name} in the save game")
+        return entry
+
+    def iter_entry_chunks(self, name: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                          decompress: bool = True) -> Iterator[bytes]:
+        """Iterate over the bytes of a file in the save game in chunks of at most chunk_size bytes.
+
+        With decompress the file is inflated with zlib on the fly, so memory use is bounded by the chunk size and not
+        by the size of the file."""
+        return self._iter_chunks(self.get_entry(name), chunk_size, decompress)
+
+    def _iter_chunks(self, entry: RdaEntry, chunk_size: int, decompress: bool) -> Iterator[bytes]:
+        name = entry.name
+        ptr, end = entry.offset, entry.offset + entry.compressed_size
+        if end > self.size:
+            raise ParseError(f"{name} at 0x{entry.offset:x} ends beyond the end of the save game")
+        if not decompress:
+            for chunk_ptr in range(ptr, end, chunk_size):
+                yield self.read_bytes(chunk_ptr, min(chunk_size, end - chunk_ptr))
+            return
+
+        decompressor = zlib.decompressobj()
+        while ptr < end and not decompressor.eof:
+            data = self.read_view(ptr, min(chunk_size, end - ptr))
+            ptr += len(data)
+            if instrumentation.enabled:
+                instrumentation.count("bytes_read", len(data))
+            while data and not decompressor.eof:
+                chunk = decompressor.decompress(data, chunk_size)
+                if chunk:
+                    yield chunk
+                data = decompressor.unconsumed_tail
+        if not decompressor.eof:
+            raise ParseError(f"{name} at 0x{entry.offset:x} is truncated")
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+    def extract_to(self, name: str, filepath, chunk_size: int = DEFAULT_CHUNK_SIZE, decompress: bool = True) -> int:
+        """Stream a file in the save game to the given path and return the number of bytes written."""
+        return self._extract_entry(self.get_entry(name), filepath, chunk_size, decompress)
+
+    def _extract_entry(self, entry: RdaEntry, filepath, chunk_size: int, decompress: bool) -> int:
+        written = 0
+        with open(filepath, "wb") as f:
+            for chunk in self._iter_chunks(entry, chunk_size, decompress):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def extract_all(self, output_dir, workers: int | None = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    decompress: bool = True) -> Dict[str, int]:
+        """Extract every file in the save game to a directory and return the number of bytes written per file.
+
+        The files are inflated concurrently by a pool of workers threads, zlib releases the GIL while inflating. Files
+        which are not zlib streams are written as stored."""
+        jobs = []
+        for name, index in self.get_index().name_to_index.items():
+            entry = self.get_index().get_entry(index)
+            filepath = get_extract_path(output_dir, name)
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            compressed = decompress and is_zlib_stream(self.read_view(entry.offset, 2))
+            jobs.append((entry, filepath, compressed))
+
+        with instrumentation.span("extract", files=len(jobs)), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(entry.name, executor.submit(self._extract_entry, entry, filepath, chunk_size, compressed))
+                       for entry, filepath, compressed in jobs]
+            return {name: future.result() for name, future in futures}
 
 
 class Writer:
-    def __init__(self, base_bytes: bytearray):
-        self.base_bytes: bytearray = base_bytes.copy()
+    """Record inserts and overwrites on top of base bytes as an ordered edit log.
+
+    The edits are kept in a piece table: a list of (base offset, view) pieces, where the base offset is None for
+    inserted content. The base bytes are never copied or modified, the output is built once in a single linear pass
+    when it is requested."""
+
+    def __init__(self, base_bytes: bytearray | bytes | mmap.mmap):
+        self._base_view = memoryview(base_bytes)
+        self._pieces: List[Tuple[int | None, memoryview]] = [(0, self._base_view)] if len(self._base_view) else []
+        self._size = len(self._base_view)
         self.added_bytes = 0
 
     @property
-    def _base_bytes_buffer(self):
-        return io.BytesIO(self.base_bytes)
+    def size(self):
+        return self._size
+
+    def release(self):
+        """Release the views of the base bytes, so the memory mapped file they may come from can be closed.
+
+        The writer cannot be used afterwards. Release it before closing the Reader of the base bytes, also when an
+        error occurred, as a traceback keeps the writer alive."""
+        for _, piece in self._pieces:
+            piece.release()
+        self._pieces = []
+        self._base_view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
 
     @property
-    def size(self):
-        return len(self.base_bytes)
+    def base_bytes(self) -> bytearray:
+        """Build the edited bytes, copying each piece once into a buffer of the final size."""
+        if instrumentation.enabled:
+            instrumentation.count("buffer_copies")
+        buffer = bytearray(self._size)
+        for offset, _, piece in self.iter_pieces():
+            buffer[offset:offset + len(piece)] = piece
+        return buffer
+
+    def iter_chunks(self) -> Iterator[memoryview]:
+        """Iterate over the pieces making up the edited bytes, in order."""
+        for _, piece in self._pieces:
+            yield piece
+
+    def iter_pieces(self) -> Iterator[Tuple[int, int | None, memoryview]]:
+        """Iterate over (output offset, base offset, view) for each piece.
+
+        The base offset is None for pieces which were inserted or overwritten."""
+        offset = 0
+        for base_offset, piece in self._pieces:
+            yield offset, base_offset, piece
+            offset += len(piece)
+
+    def _split(self, ptr: int) -> int:
+        """Split the pieces at the given position and return the index of the first piece starting there."""
+        offset = 0
+        for i, (base_offset, piece) in enumerate(self._pieces):
+            if offset == ptr:
+                return i
+            end = offset + len(piece)
+            if ptr < end:
+                cut = ptr - offset
+                self._pieces[i:i + 1] = [(base_offset, piece[:cut]),
+                                         (None if base_offset is None else base_offset + cut, piece[cut:])]
+                return i + 1
+            offset = end
+        return len(self._pieces)
+
+    @staticmethod
+    def _as_piece(content: bytes) -> memoryview:
+        return memoryview(content if isinstance(content, bytes) else bytes(content))
 
     def insert(self, ptr: int, content: bytes):
-        print(f"Inserting at 0x{ptr:x}, {len(content)} bytes")
-        self.base_bytes[ptr:ptr] = content
+        log.debug("Inserting at 0x%x, %d bytes", ptr, len(content))
+        ptr = min(ptr, self._size)
+        index = self._split(ptr)
+        self._pieces.insert(index, (None, self._as_piece(content)))
+        self._size += len(content)
         self.added_bytes += len(content)
 
     def overwrite(self, ptr: int, content: bytes):
-        print(f"Overwriting at 0x{ptr:x}, {len(content)} bytes")
-        buffer = self._base_bytes_buffer
-        buffer.seek(ptr)
-        buffer.write(content)
-        buffer.seek(0)
-        self.base_bytes = bytearray(buffer.read())
-        buffer.close()
+        log.debug("Overwriting at 0x%x, %d bytes", ptr, len(content))
+        if not content:
+            return
+        if ptr > self._size:
+            self._pieces.append((None, memoryview(bytes(ptr - self._size))))
+            self._size = ptr
+        start = self._split(ptr)
+        end = self._split(min(ptr + len(content), self._size))
+        self._pieces[start:end] = [(None, self._as_piece(content))]
+        self._size = max(self._size, ptr + len(content))
+
+    def replace(self, ptr: int, size: int, content: bytes):
+        """Replace size bytes at ptr with the content, which may be shorter or longer."""
+        log.debug("Replacing at 0x%x, %d by %d bytes", ptr, size, len(content))
+        start = self._split(ptr)
+        end = self._split(min(ptr + size, self._size))
+        self._pieces[start:end] = [(None, self._as_piece(content))] if content else []
+        self._size += len(content) - size
+        self.added_bytes += len(content) - size
+
+    def read_bytes(self, ptr: int, size: int) -> bytes:
+        """Read bytes from the edited bytes."""
+        chunks = []
+        for offset, _, piece in self.iter_pieces():
+            end = offset + len(piece)
+            if end <= ptr:
+                continue
+            if offset >= ptr + size:
+                break
+            chunks.append(piece[max(ptr - offset, 0):min(ptr + size - offset, len(piece))])
+        return b"".join(chunks)
+
+    def write_to(self, f):
+        """Write the edited bytes to the given file object."""
+        for piece in self.iter_chunks():
+            f.write(piece)
+        if instrumentation.enabled:
+            instrumentation.count("bytes_written", self.size)
+
+    def write_to_fd(self, fd: int, source_fd: int | None = None):
+        """Write the edited bytes to a file descriptor.
+
+        source_fd is a file holding the base bytes, unchanged regions of at least KERNEL_COPY_MIN_SIZE bytes are
+        copied from it in the kernel instead of through memory."""
+        copied = 0
+        for _, base_offset, piece in self.iter_pieces():
+            done = 0
+            if source_fd is not None and base_offset is not None and len(piece) >= KERNEL_COPY_MIN_SIZE:
+                done = copy_file_region(source_fd, fd, base_offset, len(piece))
+                copied += done
+            while done < len(piece):
+                done += os.write(fd, piece[done:])
+        if instrumentation.enabled:
+            instrumentation.count("bytes_written", self.size)
+            instrumentation.count("bytes_copied_in_kernel", copied)
+
+    def write_file(self, filepath, source_fd: int | None = None):
+        """Write the edited bytes to filepath through a synced temporary file, see write_file_atomically."""
+        write_file_atomically(filepath, lambda fd: self.write_to_fd(fd, source_fd))
+
+
+# minimum size of a region copied in the kernel, smaller ones are written from memory
+KERNEL_COPY_MIN_SIZE = 64 * 1024
+_KERNEL_COPY_FUNCTIONS = tuple(name for name in ("copy_file_range", "sendfile") if hasattr(os, name))
+# errors telling a function is not supported at all, other errors only concern the files at hand
+_UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EOPNOTSUPP, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.ENOTSOCK}
+_unsupported_kernel_copy_functions: Set[str] = set()
+_kernel_copy_lock = threading.Lock()
+
+
+def copy_file_region(source_fd: int, target_fd: int, offset: int, size: int) -> int:
+    """Copy size bytes at offset of the source file to the current position of the target file in the kernel.
+
+    os.copy_file_range is tried first, then os.sendfile. If one fails for these files, e.g. across file systems, the
+    next one is tried for this call only. A function the platform does not support at all, e.g. sendfile where it
+    needs a socket, is not tried again. Returns the number of bytes copied, the caller writes the rest itself."""
+    copied = 0
+    for name in _KERNEL_COPY_FUNCTIONS:
+        if name in _unsupported_kernel_copy_functions:
+            continue
+        try:
+            while copied < size:
+                if name == "copy_file_range":
+                    count = os.copy_file_range(source_fd, target_fd, size - copied, offset + copied)
+                else:
+                    count = os.sendfile(target_fd, source_fd, offset + copied, size - copied)
+                if count <= 0:
+                    break
+                copied += count
+        except OSError as e:
+            log.debug("%s not usable, falling back: %s", name, e)
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                with _kernel_copy_lock:
+                    _unsupported_kernel_copy_functions.add(name)
+            continue
+        break
+    return copied
+
+
+def write_file_atomically(filepath, write):
+    """Call write(fd) for a temporary file next to filepath, sync it and rename it over filepath.
+
+    Readers of filepath see either the old or the complete new file, never a partial one."""
+    filepath = os.fspath(filepath)
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        try:
+            write(fd)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if os.name == "posix":
+        # make the rename itself durable
+        dir_fd = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class CompressionPolicy:
+    """Choose the zlib level gamesetup.a7s is compressed with.
+
+    The level is either fixed (0-9), "fastest" (level 1) or "auto". In auto mode the first sample_size files are
+    compressed with each of the candidate levels, then the fastest level is kept whose output is at most
+    size_tolerance larger than the smallest output. Levels used and time spent are recorded for reporting.
+
+    A policy may be shared by threads. Files are compressed in parallel, the recorded state is updated under a lock
+    and compress() returns the level and time of each file."""
+
+    FASTEST_LEVEL = 1
+    AUTO_CANDIDATE_LEVELS = (1, 3, 6, 9)
+
+    def __init__(self, level: int | str = 9, sample_size: int = 5, size_tolerance: float = 0.05):
+        if level == "fastest":
+            level = self.FASTEST_LEVEL
+        if level != "auto" and level not in range(0, 10):
+            raise ValueError(f"Compression level must be 0-9, 'fastest' or 'auto', not {level!r}")
+        self.mode = level if level == "auto" else "fixed"
+        self.level: int | None = None if level == "auto" else level
+        self.sample_size = sample_size
+        self.size_tolerance = size_tolerance
+        # level -> [seconds, input bytes, output bytes] of the auto mode samples
+        self.samples: Dict[int, List[float]] = {level: [0.0, 0, 0] for level in self.AUTO_CANDIDATE_LEVELS}
+        self.sampled_files = 0
+        # level -> [files, seconds, input bytes, output bytes] of the actually used outputs
+        self.usage: Dict[int, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, value: str) -> Self:
+        """Create a policy from a command line value: a level, 'fastest' or 'auto'."""
+        return cls(int(value) if value.isdigit() else value)
+
+    @staticmethod
+    def _compress(pieces: List[memoryview], level: int) -> bytes:
+        compressor = zlib.compressobj(level=level)
+        return b"".join([compressor.compress(piece) for piece in pieces] + [compressor.flush()])
+
+    def compress(self, pieces: List[memoryview]) -> Tuple[bytes, int, float]:
+        """Compress the concatenation of the given pieces according to the policy.
+
+        Return the compressed bytes, the level used and the seconds spent."""
+        input_size = sum(len(piece) for piece in pieces)
+        level = self.level
+        if level is not None:
+            start = time.perf_counter()
+            compressed = self._compress(pieces, level)
+            seconds = time.perf_counter() - start
+        else:
+            level, compressed, seconds = self._compress_samples(pieces, input_size)
+
+        with self._lock:
+            usage = self.usage.setdefault(level, [0, 0.0, 0, 0])
+            usage[0] += 1
+            usage[1] += seconds
+            usage[2] += input_size
+            usage[3] += len(compressed)
+        return compressed, level, seconds
+
+    def _compress_samples(self, pieces: List[memoryview], input_size: int) -> Tuple[int, bytes, float]:
+        """Compress with every candidate level, keep the smallest output and pick a level once sampling is done."""
+        best: Tuple[int, bytes, float] | None = None
+        # level -> (seconds, output bytes)
+        results: Dict[int, Tuple[float, int]] = {}
+        for level in self.AUTO_CANDIDATE_LEVELS:
+            start = time.perf_counter()
+            compressed = self._compress(pieces, level)
+            seconds = time.perf_counter() - start
+            results[level] = (seconds, len(compressed))
+            if best is None or len(compressed) < len(best[1]):
+                best = (level, compressed, seconds)
+        with self._lock:
+            for level, (seconds, output_size) in results.items():
+                sample = self.samples[level]
+                sample[0] += seconds
+                sample[1] += input_size
+                sample[2] += output_size
+            self.sampled_files += 1
+            if self.level is None and self.sampled_files >= self.sample_size:
+                smallest = min(sample[2] for sample in self.samples.values())
+                self.level = min((level for level, sample in self.samples.items()
+                                  if sample[2] <= smallest * (1 + self.size_tolerance)),
+                                 key=lambda level: self.samples[level][0])
+        return best
+
+    def report(self) -> str:
+        """Describe the chosen level and the time spent compressing."""
+        with self._lock:
+            return self._report()
+
+    def _report(self) -> str:
+        lines = []
+        if self.mode == "auto":
+            chosen = "still sampling" if self.level is None else f"chose level {self.level}"
+            lines.append(f"auto compression {chosen} after {self.sampled_files} sampled files")
+            for level, (seconds, input_size, output_size) in self.samples.items():
+                if input_size:
+                    lines.append(f"  sample level {level}: {seconds * 1000:.1f} ms, {input_size} -> {output_size} bytes")
+        for level, (files, seconds, input_size, output_size) in sorted(self.usage.items()):
+            lines.append(f"level {level}: {files} files, {seconds * 1000:.1f} ms, {input_size} -> {output_size} bytes")
+        return "\n".join(lines)
+
+
+DLC_NODE_SIZE = 16
 
 
 class GameSetupWriter(Writer):
-    def __init__(self, game_setup_reader: GameSetupReader, base_bytes: bytearray):
+    def __init__(self, game_setup_reader: GameSetupReader, base_bytes: bytearray,
+                 compression_policy: CompressionPolicy | None = None):
         super().__init__(base_bytes)
         self.game_setup_reader = game_setup_reader
+        self.compression_policy = compression_policy or CompressionPolicy()
+        self.inserted_dlcs: List[DLC] = []
+        # level and seconds of the last get_compressed_gamesetup_a7s
+        self.compression_level: int | None = None
+        self.compression_seconds = 0.0
 
     def insert_dlcs(self, dlcs: List[DLC]):
-        for dlc in dlcs:
-            self.insert_dlc(dlc)
-        self.update_dlc_count(len(dlcs))
-        self.update_node_block_pointers()
+        if self.game_setup_reader.new_dlc_insertion_ptr < 0:
+            raise ParseError("No ActiveDLCs in gamesetup.a7s")
+        if self.game_setup_reader.existing_count_node_ptr < 0:
+            raise ParseError("No count in the ActiveDLCs of gamesetup.a7s")
+        with instrumentation.span("patch"):
+            # All DLC records are spliced in as one block. Inserting them one by one at the same position would put
+            # the last DLC first, the block keeps that order.
+            ptr = self.game_setup_reader.new_dlc_insertion_ptr
+            dlc_bytes_to_insert = b"".join(self.get_dlc_bytes(dlc) for dlc in reversed(dlcs))
+            self.insert(ptr, dlc_bytes_to_insert)
+            log.debug("INSERTED %s at 0x%x", [dlc.name for dlc in dlcs], ptr)
+            self.update_dlc_count(len(dlcs))
+            self.update_node_block_pointers()
+            self.inserted_dlcs.extend(dlcs)
 
     def update_dlc_count(self, added_dlc_count):
         count = len(self.game_setup_reader.existing_dlcs) + added_dlc_count
         count_bytes = struct.pack("<q", count)
         # count is shifted down by inserted dlcs by 16 bytes each dlc
-        ptr = self.game_setup_reader.existing_count_node_ptr + added_dlc_count * 16
-        print(f"Update DLC count {len(self.game_setup_reader.existing_dlcs)}, to {count_bytes} at 0x{ptr:x}")
+        ptr = self.game_setup_reader.existing_count_node_ptr + added_dlc_count * DLC_NODE_SIZE
+        log.debug("Update DLC count %d, to %s at 0x%x", len(self.game_setup_reader.existing_dlcs), count_bytes, ptr)
         self.overwrite(ptr, count_bytes)
 
-    def insert_dlc(self, dlc: DLC):
+    def get_dlc_bytes(self, dlc: DLC) -> bytes:
+        """Get the 16 byte DLC attribute node for the given DLC."""
         dlc_content_size = 4
         dlc_element_id = self.game_setup_reader.attribute_node_to_id["DLC"]
         dlc_content = dlc.value
-        dlc_bytes_to_insert = (struct.pack("<i", dlc_content_size)
-                               + struct.pack("<i", dlc_element_id)
-                               + struct.pack(">I", dlc_content)
-                               + b"\x00\x00\x00\x00")
+        return (struct.pack("<i", dlc_content_size)
+                + struct.pack("<i", dlc_element_id)
+                + struct.pack(">I", dlc_content)
+                + b"\x00\x00\x00\x00")
 
-        print(f"INSERTING {dlc.name} ...")
+    def insert_dlc(self, dlc: DLC):
+        dlc_bytes_to_insert = self.get_dlc_bytes(dlc)
         ptr = self.game_setup_reader.new_dlc_insertion_ptr
         self.insert(ptr, dlc_bytes_to_insert)
-        print(f"INSERTED {dlc_bytes_to_insert} at {ptr} ({ptr:x})")
+        log.debug("INSERTED %s %s at %d (0x%x)", dlc.name, dlc_bytes_to_insert, ptr, ptr)
 
     def update_node_block_pointers(self):
         new_enclosing_node_block_ptr = self.game_setup_reader.get_enclosing_nodes_block_ptr() + self.added_bytes
-        new_enclosing_node_block_ptr_bytes = struct.pack("<i", new_enclosing_node_block_ptr)
         new_attribute_node_block_ptr = self.game_setup_reader.get_attribute_nodes_block_ptr() + self.added_bytes
-        new_attribute_node_block_ptr_bytes = struct.pack("<i", new_attribute_node_block_ptr)
-        self.overwrite(self.size - 16, new_enclosing_node_block_ptr_bytes)
-        self.overwrite(self.size - 12, new_attribute_node_block_ptr_bytes)
+        self.overwrite(self.size - 16, struct.pack("<ii", new_enclosing_node_block_ptr, new_attribute_node_block_ptr))
+
+    def apply_patch(self, edits: List[Tuple[int, int, bytes]]):
+        """Apply edits given as (start, end, replacement) in positions of the unedited gamesetup.
+
+        Use filedb.FileDbPatch.get_edits() to get them, the writer must not have been edited before."""
+        if self.added_bytes or len(self._pieces) > 1:
+            raise ValueError("Patches can only be applied to an unedited gamesetup")
+        with instrumentation.span("patch"):
+            for start, end, replacement in reversed(edits):
+                self.replace(start, end - start, replacement)
 
     def get_compressed_gamesetup_a7s(self) -> bytearray:
-        gamesetup_a7s = zlib.compress(self.base_bytes, level=9)
+        with instrumentation.span("compress"):
+            gamesetup_a7s, self.compression_level, self.compression_seconds = self.compression_policy.compress(
+                list(self.iter_chunks()))
         # gamesetup_a7s.extend(b"xda030000000001f00000")
         return gamesetup_a7s
 
@@ -325,6 +1148,28 @@ class GameSetupWriter(Writer):
         gamesetup_a7s = self.base_bytes
         return gamesetup_a7s
 
+    def get_edited_reader(self) -> GameSetupReader:
+        """Get a reader of the edited gamesetup.a7s which knows its names and ActiveDLCs without parsing them.
+
+        insert_dlcs keeps the name tables and moves the count down behind the inserted DLC nodes, so the state of
+        the reader this writer was created with is shifted instead of scanned again."""
+        if self.added_bytes != len(self.inserted_dlcs) * DLC_NODE_SIZE:
+            raise ValueError("The ActiveDLCs state is only known after insert_dlcs")
+        dlc_values, count_ptr, insertion_ptr = self.game_setup_reader.get_active_dlcs_state()
+        if count_ptr >= 0:
+            count_ptr += self.added_bytes
+        # insert_dlcs puts the nodes in reverse order in front of the existing ones
+        dlc_values = [dlc.value for dlc in reversed(self.inserted_dlcs)] + dlc_values
+        reader = GameSetupReader(self.get_uncompressed_gamesetup_a7s())
+        reader.copy_name_tables(self.game_setup_reader)
+        reader.restore_active_dlcs_state(dlc_values, count_ptr, insertion_ptr)
+        return reader
+
+
+# written right behind the appended gamesetup.a7s
+GAMESETUP_A7S_MARKER = b"xda030000000001f00000"
+FILE_SUFFIX_SIZE = 80
+
 
 class SaveGameWriter(Writer):
     def __init__(self, save_game_reader: SaveGameReader, base_bytes: bytearray):
@@ -332,25 +1177,28 @@ class SaveGameWriter(Writer):
         self.save_game_reader = save_game_reader
 
     def add_gamesetup_a7s(self, gamesetup_bytes: bytearray):
-        file_suffix_bytes = self.base_bytes[-80:]
+        file_suffix_bytes = self.read_bytes(self.size - FILE_SUFFIX_SIZE, FILE_SUFFIX_SIZE)
         gamesetup_bytes_ptr = self.size
+        # kept to verify the written save game
+        self.gamesetup_a7s_ptr = gamesetup_bytes_ptr
+        self.gamesetup_a7s_size = len(gamesetup_bytes)
+        self.gamesetup_a7s_stored_size = sys.getsizeof(gamesetup_bytes)
+        self.file_suffix_bytes = file_suffix_bytes
 
         self.insert(gamesetup_bytes_ptr, gamesetup_bytes)
 
         # self.added_bytes += len(gamesetup_bytes)
-        self._update_gamesetup_block_file_header(sys.getsizeof(gamesetup_bytes), gamesetup_bytes_ptr)
-        self.insert(self.size, b"xda030000000001f00000")
+        self._update_gamesetup_block_file_header(self.gamesetup_a7s_stored_size, gamesetup_bytes_ptr)
+        self.insert(self.size, GAMESETUP_A7S_MARKER)
         self._add_new_file_suffix_bytes(file_suffix_bytes)
 
     def _update_gamesetup_block_file_header(self, gamesetup_size: int, gamesetup_bytes_ptr: int):
         gamesetup_size_bytes = struct.pack("<i", gamesetup_size)
-        print(f"gamesetup_file_size_ptr {self.save_game_reader.gamesetup_file_size_ptr}")
         self.overwrite(self.save_game_reader.gamesetup_file_size_ptr, gamesetup_size_bytes)
-        print(f"gamesetup_compressed_ptr {self.save_game_reader.gamesetup_compressed_ptr}")
         self.overwrite(self.save_game_reader.gamesetup_compressed_ptr, gamesetup_size_bytes)
         gamesetup_bytes_ptr_bytes = struct.pack("<i", gamesetup_bytes_ptr)
-        print(f"Gamesetup bytes ptr at {self.save_game_reader.gamesetup_bytes_ptr_ptr}")
-        print(f"Gamesetup bytes now at {gamesetup_bytes_ptr}")
+        log.debug("Gamesetup bytes ptr at 0x%x, gamesetup bytes now at 0x%x",
+                  self.save_game_reader.gamesetup_bytes_ptr_ptr, gamesetup_bytes_ptr)
         self.overwrite(self.save_game_reader.gamesetup_bytes_ptr_ptr, gamesetup_bytes_ptr_bytes)
 
         # original 55928
@@ -360,6 +1208,57 @@ class SaveGameWriter(Writer):
         self.insert(self.size, file_suffix_bytes)
 
     def write_save_game(self, filepath):
-        print(f"Writing {filepath}")
-        with open(filepath, "w+b") as f:
-            f.write(self.base_bytes)
+        """Write the save game to filepath atomically.
+
+        If the base bytes are the memory mapped file of the save game reader, its unchanged regions are copied file
+        to file and only the patched directory entry and the new tail go through memory. Other base bytes may
+        differ from the file, so they are written from memory."""
+        log.debug("Writing %s", filepath)
+        source_fd = self.save_game_reader.fileno() if self._base_view.obj is self.save_game_reader.initial_bytes \
+            else None
+        with instrumentation.span("write"):
+            self.write_file(filepath, source_fd)
+
+    def write_save_game_in_place(self, filepath):
+        """Patch the save game the base bytes were read from, instead of rewriting it.
+
+        Only the pieces which differ from the base bytes are written: the patched directory entry fields and the
+        appended bytes. Pieces of the base bytes which were moved by an insert cannot be patched in place.
+
+        The appended bytes are written and synced before the directory entry is patched and synced, so a crash never
+        leaves the directory pointing at missing data. If writing fails, the patched bytes are restored and the file
+        is truncated to its original size."""
+        log.debug("Writing %s in place", filepath)
+        base_size = len(self._base_view)
+        patches: List[Tuple[int, memoryview]] = []
+        appends: List[Tuple[int, memoryview]] = []
+        for offset, base_offset, piece in self.iter_pieces():
+            if base_offset == offset:
+                continue
+            if base_offset is not None:
+                raise ValueError(f"Cannot write in place, bytes at 0x{base_offset:x} moved to 0x{offset:x}")
+            (appends if offset >= base_size else patches).append((offset, piece))
+
+        with instrumentation.span("write", in_place=True), open(filepath, "r+b") as f:
+            if os.fstat(f.fileno()).st_size != base_size:
+                raise ValueError(f"{filepath} does not match the save game the writer was created for")
+            originals = [(offset, bytes(self._base_view[offset:min(offset + len(piece), base_size)]))
+                         for offset, piece in patches]
+            try:
+                for pieces in (appends, patches):
+                    for offset, piece in pieces:
+                        f.seek(offset)
+                        f.write(piece)
+                        if instrumentation.enabled:
+                            instrumentation.count("bytes_written", len(piece))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except BaseException:
+                log.debug("Restoring %s after a failed write", filepath)
+                for offset, original in originals:
+                    f.seek(offset)
+                    f.write(original)
+                f.truncate(base_size)
+                f.flush()
+                os.fsync(f.fileno())
+                raise
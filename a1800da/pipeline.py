@@ -0,0 +1,176 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+from a1800da import cache, filedb, instrumentation, lib, verify
+from a1800da.lib import DLC
+
+OUTPUT_FILE_SUFFIX = "_dlc_activated"
+
+# called with the stage which starts and the fraction of the stages done, ends with ("done", 1.0)
+Progress = Callable[[str, float], None]
+
+
+def report_progress(progress: Progress | None, stage: str):
+    if progress is not None:
+        fraction = 1.0 if stage == "done" else instrumentation.STAGES.index(stage) / len(instrumentation.STAGES)
+        progress(stage, fraction)
+
+
+@dataclass()
+class PipelineResult:
+    save_game_path: str
+    output_path: str | None = None
+    size: int = 0
+    priorly_active_dlcs: List[DLC] = field(default_factory=list)
+    activated_dlcs: List[DLC] = field(default_factory=list)
+    seconds: float = 0.0
+    compression_level: int | None = None
+    compression_seconds: float = 0.0
+    verified: bool = False
+    error: str | None = None
+
+
+def get_output_file_path(save_game_file_path: str) -> str:
+    """Get the path of the file a save game with activated DLCs is written to."""
+    return os.path.splitext(save_game_file_path)[0] + OUTPUT_FILE_SUFFIX + ".a7s"
+
+
+def is_output_file(path: str) -> bool:
+    """Check whether a file is named like the files get_output_file_path returns."""
+    return os.path.splitext(path)[0].endswith(OUTPUT_FILE_SUFFIX)
+
+
+INSPECT_CHUNK_SIZE = 64 * 1024
+
+
+def get_gamesetup_key(save_game_reader: lib.SaveGameReader) -> str:
+    """Get the key of the gamesetup.a7s of a save game in a GameSetupCache."""
+    entry = save_game_reader.locate_gamesetup()
+    return cache.get_key(save_game_reader.read_view(entry.offset, entry.compressed_size))
+
+
+def read_active_dlcs(save_game_file_path: str, use_index_cache: bool = False,
+                     progress: Progress | None = None,
+                     gamesetup_cache: cache.GameSetupCache | None = None) -> PipelineResult:
+    """Read which DLCs are active in a save game without changing it.
+
+    gamesetup.a7s is decompressed and scanned incrementally, decompression stops as soon as the active DLCs are
+    known. With a gamesetup_cache an unchanged gamesetup.a7s is neither decompressed nor scanned again."""
+    start = time.perf_counter()
+    result = PipelineResult(save_game_file_path)
+    with instrumentation.span("save_game", file=save_game_file_path, mode="inspect"), \
+            lib.SaveGameReader.from_file(save_game_file_path) as save_game_reader:
+        result.size = save_game_reader.size
+        report_progress(progress, "locate")
+        save_game_reader.get_index(use_sidecar=use_index_cache)
+        key = get_gamesetup_key(save_game_reader) if gamesetup_cache is not None else None
+        cached = gamesetup_cache.get(key) if gamesetup_cache is not None else None
+        if cached is not None:
+            result.priorly_active_dlcs = cached.dlcs
+        else:
+            chunks = save_game_reader.iter_entry_chunks("gamesetup.a7s", INSPECT_CHUNK_SIZE)
+            report_progress(progress, "parse")
+            try:
+                with instrumentation.span("parse"):
+                    scan = filedb.scan_active_dlcs(chunks)
+            finally:
+                chunks.close()
+            result.priorly_active_dlcs = scan.dlcs
+            if gamesetup_cache is not None:
+                gamesetup_cache.put(key, cache.CachedGameSetup(scan.dlc_values, scan.count_ptr, scan.insertion_ptr))
+    instrumentation.flush(file=save_game_file_path)
+    result.seconds = time.perf_counter() - start
+    report_progress(progress, "done")
+    return result
+
+
+def activate_dlcs(save_game_file_path: str, dlcs: List[DLC], in_place: bool = False,
+                  use_index_cache: bool = False,
+                  compression_policy: lib.CompressionPolicy | None = None,
+                  progress: Progress | None = None,
+                  gamesetup_cache: cache.GameSetupCache | None = None,
+                  verify_output: bool = False) -> PipelineResult:
+    """Activate the given DLCs in a save game.
+
+    Runs the whole pipeline: read the save game, decompress and parse gamesetup.a7s, insert the DLCs which are not
+    active yet, compress and write the save game. Without in_place a new file is created next to the save game.
+    With use_index_cache the directory index of the save game is kept in a sidecar file. progress is called at the
+    start of each stage. With a gamesetup_cache the decompressed gamesetup.a7s is reused if it did not change. With
+    verify_output the written regions are read back and checked, problems are reported as error."""
+    start = time.perf_counter()
+    result = PipelineResult(save_game_file_path)
+    with instrumentation.span("save_game", file=save_game_file_path, mode="activate"):
+        save_game_reader = lib.SaveGameReader.from_file(save_game_file_path)
+        try:
+            result.size = save_game_reader.size
+            report_progress(progress, "locate")
+            save_game_reader.get_index(use_sidecar=use_index_cache)
+            _activate_dlcs(save_game_reader, dlcs, in_place, compression_policy, result, progress, gamesetup_cache,
+                           verify_output)
+        finally:
+            save_game_reader.close()
+    instrumentation.flush(file=save_game_file_path)
+    result.seconds = time.perf_counter() - start
+    report_progress(progress, "done")
+    return result
+
+
+def _activate_dlcs(save_game_reader: lib.SaveGameReader, dlcs: List[DLC], in_place: bool,
+                   compression_policy: lib.CompressionPolicy | None, result: PipelineResult,
+                   progress: Progress | None = None, gamesetup_cache: cache.GameSetupCache | None = None,
+                   verify_output: bool = False):
+    report_progress(progress, "decompress")
+    key = get_gamesetup_key(save_game_reader) if gamesetup_cache is not None else None
+    cached = gamesetup_cache.get(key, with_buffer=True) if gamesetup_cache is not None else None
+    if cached is not None and all(dlc in cached.dlcs for dlc in dlcs):
+        result.priorly_active_dlcs = cached.dlcs
+        return
+
+    if cached is not None and cached.buffer is not None:
+        game_setup_reader = lib.GameSetupReader(cached.buffer)
+        game_setup_reader.restore_active_dlcs_state(cached.dlc_values, cached.count_ptr, cached.insertion_ptr)
+    else:
+        game_setup_reader = lib.GameSetupReader(save_game_reader.get_gamesetup_bytes())
+    report_progress(progress, "parse")
+    result.priorly_active_dlcs = list(game_setup_reader.get_activated_dlcs())
+    if gamesetup_cache is not None and (cached is None or cached.buffer is None):
+        buffer = bytes(game_setup_reader.initial_bytes) if gamesetup_cache.store_buffers else None
+        gamesetup_cache.put(key, cache.CachedGameSetup(*game_setup_reader.get_active_dlcs_state(), buffer))
+    dlcs_to_activate = [dlc for dlc in dlcs if dlc not in result.priorly_active_dlcs]
+    if not dlcs_to_activate:
+        return
+
+    report_progress(progress, "patch")
+    game_setup_writer = lib.GameSetupWriter(game_setup_reader, game_setup_reader.initial_bytes, compression_policy)
+    game_setup_writer.insert_dlcs(dlcs_to_activate)
+    # released before the memory mapped save game is closed, also on errors
+    with lib.SaveGameWriter(save_game_reader, save_game_reader.initial_bytes) as save_game_writer:
+        report_progress(progress, "compress")
+        compressed_gamesetup = game_setup_writer.get_compressed_gamesetup_a7s()
+        save_game_writer.add_gamesetup_a7s(compressed_gamesetup)
+        result.compression_level = game_setup_writer.compression_level
+        result.compression_seconds = game_setup_writer.compression_seconds
+        if in_place:
+            # the save game is the only copy, check the new gamesetup.a7s before patching it
+            verification = verify.verify_gamesetup_a7s(result.save_game_path, save_game_writer, compressed_gamesetup,
+                                                       result.priorly_active_dlcs + dlcs_to_activate)
+            if not verification.ok:
+                result.error = "Verification failed, save game not written: " + "; ".join(verification.problems)
+                return
+        report_progress(progress, "write")
+        if in_place:
+            result.output_path = result.save_game_path
+            save_game_writer.write_save_game_in_place(result.output_path)
+        else:
+            result.output_path = get_output_file_path(result.save_game_path)
+            save_game_writer.write_save_game(result.output_path)
+        result.activated_dlcs = dlcs_to_activate
+        if verify_output:
+            report_progress(progress, "verify")
+            verification = verify.verify_save_game(result.output_path, save_game_writer,
+                                                   result.priorly_active_dlcs + dlcs_to_activate)
+            result.verified = verification.ok
+            if not verification.ok:
+                result.error = "Verification failed: " + "; ".join(verification.problems)
@@ -0,0 +1,178 @@
+import logging
+import time
+from typing import Dict, Iterable, List
+
+from a1800da import cache, instrumentation, lib, verify
+from a1800da.lib import DLC
+from a1800da.pipeline import PipelineResult, Progress, get_gamesetup_key, get_output_file_path, report_progress
+
+log = logging.getLogger(__name__)
+
+
+class SaveSession:
+    """A save game opened for any number of edits.
+
+    The save game is indexed and its gamesetup.a7s decompressed and scanned once, when the session is created. Edits
+    are applied to the decompressed gamesetup.a7s and shift the known ActiveDLCs positions, so no edit parses again.
+    Nothing is written before commit(), which may be called again after further edits.
+
+    The save game file is only open while the session is created and while it commits, so the game can replace or
+    delete it in between. A commit fails if the file changed since the session read it."""
+
+    def __init__(self, save_game_path: str, use_index_cache: bool = False,
+                 compression_policy: lib.CompressionPolicy | None = None,
+                 gamesetup_cache: cache.GameSetupCache | None = None, progress: Progress | None = None):
+        self.save_game_path = save_game_path
+        self.compression_policy = compression_policy or lib.CompressionPolicy()
+        self.gamesetup_cache = gamesetup_cache
+        with lib.SaveGameReader.from_file(save_game_path) as save_game_reader:
+            self.game_setup_reader = self._open(save_game_reader, use_index_cache, progress)
+            self.size = save_game_reader.size
+            self.index: lib.RdaIndex = save_game_reader.get_index()
+            # identifies the save game the index and gamesetup.a7s belong to
+            self.fingerprint: Dict[str, int | str] = lib.RdaIndex.get_fingerprint(save_game_reader)
+        # active in the save game on disk, which later commits start from
+        self.saved_dlcs: List[DLC] = list(self.game_setup_reader.existing_dlcs)
+        # edited since the last commit
+        self.dirty = False
+        # the compressed gamesetup.a7s of the last commit, reused while there are no edits
+        self._compressed_gamesetup: bytes | None = None
+
+    def _open(self, save_game_reader: lib.SaveGameReader, use_index_cache: bool,
+              progress: Progress | None) -> lib.GameSetupReader:
+        with instrumentation.span("save_game", file=self.save_game_path, mode="session"):
+            report_progress(progress, "locate")
+            save_game_reader.get_index(use_sidecar=use_index_cache)
+            save_game_reader.locate_gamesetup()
+            report_progress(progress, "decompress")
+            key = get_gamesetup_key(save_game_reader) if self.gamesetup_cache is not None else None
+            cached = self.gamesetup_cache.get(key, with_buffer=True) if self.gamesetup_cache is not None else None
+            if cached is not None and cached.buffer is not None:
+                game_setup_reader = lib.GameSetupReader(cached.buffer)
+                game_setup_reader.restore_active_dlcs_state(cached.dlc_values, cached.count_ptr,
+                                                            cached.insertion_ptr)
+            else:
+                game_setup_reader = lib.GameSetupReader(save_game_reader.get_gamesetup_bytes())
+            report_progress(progress, "parse")
+            if game_setup_reader.new_dlc_insertion_ptr < 0:
+                raise lib.ParseError("No ActiveDLCs in gamesetup.a7s")
+            if cached is None or cached.buffer is None:
+                self._put_in_cache(key, game_setup_reader)
+        instrumentation.flush(file=self.save_game_path)
+        report_progress(progress, "done")
+        return game_setup_reader
+
+    def _put_in_cache(self, key: str, game_setup_reader: lib.GameSetupReader):
+        if self.gamesetup_cache is None:
+            return
+        buffer = bytes(game_setup_reader.initial_bytes) if self.gamesetup_cache.store_buffers else None
+        self.gamesetup_cache.put(key, cache.CachedGameSetup(*game_setup_reader.get_active_dlcs_state(), buffer))
+
+    def _open_save_game(self) -> lib.SaveGameReader:
+        """Open the save game again with the known index, after checking that it did not change."""
+        save_game_reader = lib.SaveGameReader.from_file(self.save_game_path)
+        try:
+            if lib.RdaIndex.get_fingerprint(save_game_reader) != self.fingerprint:
+                raise lib.ParseError(f"{self.save_game_path} changed since it was read, open it again")
+            save_game_reader.set_index(self.index)
+            save_game_reader.locate_gamesetup()
+        except BaseException:
+            save_game_reader.close()
+            raise
+        return save_game_reader
+
+    @property
+    def active_dlcs(self) -> List[DLC]:
+        """The active DLCs, including the ones activated in this session."""
+        return list(self.game_setup_reader.existing_dlcs)
+
+    @property
+    def unsaved_dlcs(self) -> List[DLC]:
+        """The DLCs activated in this session which the opened save game does not have yet."""
+        return [dlc for dlc in self.active_dlcs if dlc not in self.saved_dlcs]
+
+    def activate_dlcs(self, dlcs: Iterable[DLC]) -> List[DLC]:
+        """Activate the given DLCs which are not active yet and return them."""
+        active_dlcs = self.active_dlcs
+        dlcs_to_activate = [dlc for dlc in dict.fromkeys(dlcs) if dlc not in active_dlcs]
+        if not dlcs_to_activate:
+            return []
+        game_setup_writer = lib.GameSetupWriter(self.game_setup_reader, self.game_setup_reader.initial_bytes,
+                                                self.compression_policy)
+        game_setup_writer.insert_dlcs(dlcs_to_activate)
+        self.game_setup_reader = game_setup_writer.get_edited_reader()
+        self.dirty = True
+        self._compressed_gamesetup = None
+        return dlcs_to_activate
+
+    def commit(self, in_place: bool = False, output_path: str | None = None, verify_output: bool = True,
+               progress: Progress | None = None) -> PipelineResult:
+        """Write the save game with all DLCs activated in this session.
+
+        Without in_place a new file is written, output_path defaults to the one activate_dlcs uses, and the opened
+        save game stays the base of later commits. With in_place the opened save game is patched and its index is
+        updated instead of rebuilt. Nothing is written if the opened save game has all DLCs already."""
+        start = time.perf_counter()
+        result = PipelineResult(self.save_game_path, size=self.size, priorly_active_dlcs=list(self.saved_dlcs),
+                                activated_dlcs=self.unsaved_dlcs)
+        if not result.activated_dlcs:
+            self.dirty = False
+            report_progress(progress, "done")
+            return result
+
+        with instrumentation.span("save_game", file=self.save_game_path, mode="commit"):
+            report_progress(progress, "compress")
+            if self._compressed_gamesetup is None:
+                game_setup_writer = lib.GameSetupWriter(self.game_setup_reader, self.game_setup_reader.initial_bytes,
+                                                        self.compression_policy)
+                self._compressed_gamesetup = game_setup_writer.get_compressed_gamesetup_a7s()
+                result.compression_level = game_setup_writer.compression_level
+                result.compression_seconds = game_setup_writer.compression_seconds
+
+            # the writer is released before the save game is closed, also on errors
+            with self._open_save_game() as save_game_reader, \
+                    lib.SaveGameWriter(save_game_reader, save_game_reader.initial_bytes) as save_game_writer:
+                save_game_writer.add_gamesetup_a7s(self._compressed_gamesetup)
+                if in_place:
+                    # the save game is the only copy, check the new gamesetup.a7s before patching it
+                    verification = verify.verify_gamesetup_a7s(self.save_game_path, save_game_writer,
+                                                               self._compressed_gamesetup, self.active_dlcs)
+                    if not verification.ok:
+                        result.error = "Verification failed, save game not written: " + "; ".join(
+                            verification.problems)
+                        return result
+
+                report_progress(progress, "write")
+                if in_place:
+                    result.output_path = self.save_game_path
+                    save_game_writer.write_save_game_in_place(result.output_path)
+                else:
+                    result.output_path = output_path or get_output_file_path(self.save_game_path)
+                    save_game_writer.write_save_game(result.output_path)
+                self.dirty = False
+
+                if verify_output:
+                    report_progress(progress, "verify")
+                    verification = verify.verify_save_game(result.output_path, save_game_writer, self.active_dlcs)
+                    result.verified = verification.ok
+                    if not verification.ok:
+                        result.error = "Verification failed: " + "; ".join(verification.problems)
+            if in_place:
+                self._update_after_in_place_write(save_game_writer.gamesetup_a7s_ptr,
+                                                  save_game_writer.gamesetup_a7s_stored_size)
+        instrumentation.flush(file=self.save_game_path)
+        result.seconds = time.perf_counter() - start
+        report_progress(progress, "done")
+        return result
+
+    def _update_after_in_place_write(self, gamesetup_ptr: int, gamesetup_size: int):
+        """Update the index and fingerprint after patching the save game in place, which only moved gamesetup.a7s."""
+        self.index.update_entry("gamesetup.a7s", gamesetup_ptr, gamesetup_size, gamesetup_size)
+        with lib.SaveGameReader.from_file(self.save_game_path) as save_game_reader:
+            self.size = save_game_reader.size
+            self.fingerprint = lib.RdaIndex.get_fingerprint(save_game_reader)
+            save_game_reader.set_index(self.index)
+            if self.gamesetup_cache is not None:
+                self._put_in_cache(get_gamesetup_key(save_game_reader), self.game_setup_reader)
+        self.saved_dlcs = self.active_dlcs
+        log.debug("Updated %s, gamesetup.a7s now at 0x%x", self.save_game_path, gamesetup_ptr)
@@ -0,0 +1,119 @@
+"""Generate synthetic Anno 1800 save games for benchmarks, without shipping real player saves."""
+import os
+import struct
+import zlib
+from typing import Iterable, List
+
+from a1800da.lib import (BLOCK_HEADER_SIZE, DLC, FILE_NAME_SIZE, FIRST_BLOCK_PTR_PTR, RESOURCE_FILE_HEADER_SIZE,
+                         RESOURCE_FILE_MAGIC)
+
+TAG_NAMES = {1: "GameSetup", 2: "Settings", 3: "ActiveDLCs"}
+ATTRIBUTE_NAMES = {32768: "count", 32769: "DLC", 32770: "Value", 32771: "Name"}
+FILEDB_MAGIC = b"\x08\x00\x00\x00\xfe\xff\xff\xff"
+FILLER_BLOCK_SIZE = 64 * 1024
+
+
+def _tag(node_id: int) -> bytes:
+    return struct.pack("<iI", 0, node_id)
+
+
+def _closing() -> bytes:
+    return struct.pack("<iI", 0, 0)
+
+
+def _attribute(node_id: int, content: bytes) -> bytes:
+    padding = -len(content) % 8
+    return struct.pack("<iI", len(content), node_id) + content + bytes(padding)
+
+
+def _name_table(names: dict) -> bytes:
+    table = bytearray(struct.pack("<i", len(names)))
+    for node_id in names:
+        table += struct.pack("<H", node_id)
+    for name in names.values():
+        table += name.encode() + b"\0"
+    return bytes(table + bytes(-len(table) % 8))
+
+
+def build_gamesetup(node_count: int = 1000, active_dlcs: Iterable[DLC] = (DLC.S1_SUNKEN_TREASURES, DLC.S1_BOTANICA),
+                    active_dlcs_first: bool = False) -> bytes:
+    """Build an uncompressed FileDB gamesetup document.
+
+    About node_count attribute nodes go into a Settings tag, next to an ActiveDLCs tag holding a count and the given
+    DLCs."""
+    active_dlcs = list(active_dlcs)
+    settings = [_tag(2)]
+    for i in range(node_count // 2):
+        settings.append(_attribute(32770, struct.pack("<q", i)))
+        settings.append(_attribute(32771, f"name {i}".encode()))
+    settings.append(_closing())
+    active = [_tag(3), _attribute(32768, struct.pack("<q", len(active_dlcs)))]
+    active += [_attribute(32769, struct.pack(">I", dlc.value)) for dlc in active_dlcs]
+    active.append(_closing())
+
+    nodes = [_tag(1)] + (active + settings if active_dlcs_first else settings + active) + [_closing(), _closing()]
+    document = bytearray(b"".join(nodes))
+    tags_ptr = len(document)
+    document += _name_table(TAG_NAMES)
+    attributes_ptr = len(document)
+    document += _name_table(ATTRIBUTE_NAMES)
+    document += struct.pack("<ii", tags_ptr, attributes_ptr) + FILEDB_MAGIC
+    return bytes(document)
+
+
+def _write_filler_entry(f, size: int) -> int:
+    """Write a zlib stream decompressing to size bytes and return its compressed size."""
+    compressor = zlib.compressobj(level=0)
+    block = os.urandom(FILLER_BLOCK_SIZE)
+    start = f.tell()
+    for ptr in range(0, size, FILLER_BLOCK_SIZE):
+        f.write(compressor.compress(block[:min(FILLER_BLOCK_SIZE, size - ptr)]))
+    f.write(compressor.flush())
+    return f.tell() - start
+
+
+def write_save_game(filepath, gamesetup: bytes, block_count: int = 3, entries_per_block: int = 2,
+                    entry_size: int = 1024 * 1024, timestamp: int = 1672531200):
+    """Write a Resource File V2.2 archive with the layout SaveGameReader expects.
+
+    Each block holds entries_per_block filler entries of entry_size uncompressed bytes, followed by its directory
+    and its 32 byte header. The compressed gamesetup is added to the last block."""
+    compressed_gamesetup = zlib.compress(gamesetup, level=9)
+    with open(filepath, "w+b") as f:
+        f.write(RESOURCE_FILE_MAGIC.encode().ljust(RESOURCE_FILE_HEADER_SIZE, b"\0"))
+        next_block_ptr_ptr = FIRST_BLOCK_PTR_PTR
+        for block in range(block_count):
+            directory: List[bytes] = []
+            names = [f"data{block}_{entry}.a7s" for entry in range(entries_per_block)]
+            for name in names:
+                offset = f.tell()
+                compressed_size = _write_filler_entry(f, entry_size)
+                directory.append(_directory_entry(name, offset, compressed_size, entry_size, timestamp))
+            if block == block_count - 1:
+                offset = f.tell()
+                f.write(compressed_gamesetup)
+                directory.append(_directory_entry("gamesetup.a7s", offset, len(compressed_gamesetup), len(gamesetup),
+                                                  timestamp))
+            directory_bytes = b"".join(directory)
+            f.write(directory_bytes)
+            block_ptr = f.tell()
+            f.write(struct.pack("<IIQQQ", 0, len(directory), len(directory_bytes), len(directory_bytes), 0))
+            f.seek(next_block_ptr_ptr)
+            f.write(struct.pack("<Q", block_ptr))
+            next_block_ptr_ptr = block_ptr + BLOCK_HEADER_SIZE - 8
+            f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(next_block_ptr_ptr)
+        f.write(struct.pack("<Q", end))
+
+
+def _directory_entry(name: str, offset: int, compressed_size: int, size: int, timestamp: int) -> bytes:
+    return name.encode("utf-16-le").ljust(FILE_NAME_SIZE, b"\0") + struct.pack("<QQQQQ", offset, compressed_size,
+                                                                              size, timestamp, 0)
+
+
+def write_synthetic_save_game(filepath, total_size: int, block_count: int = 3, entries_per_block: int = 2,
+                              node_count: int = 1000, active_dlcs: Iterable[DLC] = (DLC.S1_SUNKEN_TREASURES,)):
+    """Write a save game of roughly total_size bytes, spread evenly over the filler entries."""
+    entry_size = max(total_size // (block_count * entries_per_block), 1)
+    write_save_game(filepath, build_gamesetup(node_count, active_dlcs), block_count, entries_per_block, entry_size)
@@ -0,0 +1,144 @@
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterable, List
+
+from a1800da import instrumentation, lib
+from a1800da.lib import DIRECTORY_ENTRY_SIZE, DLC, FILE_NAME_SIZE, FILE_SUFFIX_SIZE, GAMESETUP_A7S_MARKER
+
+
+@dataclass()
+class VerificationResult:
+    save_game_path: str
+    problems: List[str] = field(default_factory=list)
+    dlcs: List[DLC] = field(default_factory=list)
+    bytes_read: int = 0
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+def _read(f: BinaryIO, ptr: int, size: int, result: VerificationResult) -> bytes:
+    f.seek(ptr)
+    data = f.read(size)
+    result.bytes_read += len(data)
+    return data
+
+
+def _check_directory_entry(f: BinaryIO, save_game_writer: lib.SaveGameWriter, result: VerificationResult):
+    entry_ptr = save_game_writer.save_game_reader.gamesetup_bytes_ptr_ptr - FILE_NAME_SIZE
+    entry = _read(f, entry_ptr, DIRECTORY_ENTRY_SIZE, result)
+    if len(entry) < DIRECTORY_ENTRY_SIZE:
+        result.problems.append(f"Directory entry at 0x{entry_ptr:x} is truncated")
+        return
+    name = str(entry[:FILE_NAME_SIZE], "utf-16-le").split("\0", 1)[0]
+    if name != "gamesetup.a7s":
+        result.problems.append(f"Directory entry at 0x{entry_ptr:x} is {name!r}, not gamesetup.a7s")
+    fields = struct.unpack_from("<QQQ", entry, FILE_NAME_SIZE)
+    expected_fields = (save_game_writer.gamesetup_a7s_ptr, save_game_writer.gamesetup_a7s_stored_size,
+                       save_game_writer.gamesetup_a7s_stored_size)
+    for i, (field_name, value, expected) in enumerate(zip(("offset", "compressed size", "size"), fields,
+                                                          expected_fields)):
+        if value != expected:
+            result.problems.append(f"gamesetup.a7s {field_name} at 0x{entry_ptr + FILE_NAME_SIZE + i * 8:x} is "
+                                   f"{value}, expected {expected}")
+
+
+def _check_active_dlcs(document: bytes, expected_dlcs: List[DLC], result: VerificationResult):
+    game_setup_reader = lib.GameSetupReader(document)
+    try:
+        result.dlcs = list(game_setup_reader.existing_dlcs)
+    except (lib.ParseError, ValueError, KeyError, struct.error) as e:
+        result.problems.append(f"ActiveDLCs of the new gamesetup.a7s cannot be read: {e}")
+        return
+    if game_setup_reader.new_dlc_insertion_ptr < 0:
+        result.problems.append("New gamesetup.a7s has no ActiveDLCs")
+        return
+
+    count_ptr = game_setup_reader.existing_count_node_ptr
+    if count_ptr < 0:
+        result.problems.append("ActiveDLCs of the new gamesetup.a7s has no count")
+    else:
+        count = struct.unpack_from("<q", document, count_ptr)[0]
+        if count != len(result.dlcs):
+            result.problems.append(f"ActiveDLCs count at 0x{count_ptr:x} of the new gamesetup.a7s is {count} for "
+                                   f"{len(result.dlcs)} DLCs")
+    if len(set(result.dlcs)) != len(result.dlcs):
+        result.problems.append("ActiveDLCs of the new gamesetup.a7s lists DLCs more than once")
+    missing = [dlc.name for dlc in expected_dlcs if dlc not in result.dlcs]
+    unexpected = [dlc.name for dlc in result.dlcs if dlc not in expected_dlcs]
+    if missing:
+        result.problems.append(f"ActiveDLCs of the new gamesetup.a7s misses {', '.join(missing)}")
+    if unexpected:
+        result.problems.append(f"ActiveDLCs of the new gamesetup.a7s unexpectedly holds {', '.join(unexpected)}")
+
+
+def _check_gamesetup_a7s(blob: bytes, blob_ptr: int, expected_dlcs: List[DLC], result: VerificationResult):
+    decompressor = zlib.decompressobj()
+    try:
+        document = decompressor.decompress(blob)
+    except zlib.error as e:
+        result.problems.append(f"gamesetup.a7s at 0x{blob_ptr:x} does not decompress: {e}")
+        return
+    if not decompressor.eof:
+        result.problems.append(f"zlib stream of gamesetup.a7s at 0x{blob_ptr:x} is not complete")
+    elif decompressor.unused_data:
+        result.problems.append(f"gamesetup.a7s at 0x{blob_ptr:x} has {len(decompressor.unused_data)} bytes behind "
+                               f"its zlib stream")
+    else:
+        _check_active_dlcs(document, expected_dlcs, result)
+
+
+def verify_gamesetup_a7s(filepath, save_game_writer: lib.SaveGameWriter, compressed_gamesetup: bytes,
+                         expected_dlcs: Iterable[DLC]) -> VerificationResult:
+    """Check a compressed gamesetup.a7s before SaveGameWriter writes it.
+
+    The checks are the ones verify_save_game does on the written gamesetup.a7s. Run before patching a save game in
+    place, they keep a broken gamesetup.a7s from replacing the only copy of the save game."""
+    start = time.perf_counter()
+    result = VerificationResult(filepath)
+    with instrumentation.span("verify", file=filepath):
+        _check_gamesetup_a7s(compressed_gamesetup, save_game_writer.gamesetup_a7s_ptr, list(expected_dlcs), result)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def verify_save_game(filepath, save_game_writer: lib.SaveGameWriter,
+                     expected_dlcs: Iterable[DLC]) -> VerificationResult:
+    """Check the regions of a written save game which SaveGameWriter.add_gamesetup_a7s changed.
+
+    Only the gamesetup.a7s directory entry, the appended gamesetup.a7s with the marker behind it and the file suffix
+    are read back, so the cost depends on the size of gamesetup.a7s and not on the size of the save game. The new
+    gamesetup.a7s must decompress completely and its ActiveDLCs must hold exactly the expected DLCs, with a matching
+    count. Problems are reported with the offsets they were found at."""
+    start = time.perf_counter()
+    expected_dlcs = list(expected_dlcs)
+    result = VerificationResult(filepath)
+    blob_ptr, blob_size = save_game_writer.gamesetup_a7s_ptr, save_game_writer.gamesetup_a7s_size
+    with instrumentation.span("verify", file=filepath), open(filepath, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size != save_game_writer.size:
+            result.problems.append(f"File size is {file_size}, expected {save_game_writer.size}")
+
+        _check_directory_entry(f, save_game_writer, result)
+
+        blob = _read(f, blob_ptr, blob_size, result)
+        if len(blob) != blob_size:
+            result.problems.append(f"gamesetup.a7s at 0x{blob_ptr:x} is truncated to {len(blob)} of {blob_size} bytes")
+        else:
+            _check_gamesetup_a7s(blob, blob_ptr, expected_dlcs, result)
+
+        marker_ptr = blob_ptr + blob_size
+        if _read(f, marker_ptr, len(GAMESETUP_A7S_MARKER), result) != GAMESETUP_A7S_MARKER:
+            result.problems.append(f"Marker behind gamesetup.a7s at 0x{marker_ptr:x} is missing")
+        suffix_ptr = file_size - FILE_SUFFIX_SIZE
+        if _read(f, suffix_ptr, FILE_SUFFIX_SIZE, result) != save_game_writer.file_suffix_bytes:
+            result.problems.append(f"File suffix at 0x{suffix_ptr:x} does not match the original one")
+    if instrumentation.enabled:
+        instrumentation.count("bytes_verified", result.bytes_read)
+    result.seconds = time.perf_counter() - start
+    return result
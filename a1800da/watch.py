@@ -0,0 +1,173 @@
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from a1800da import lib, pipeline
+from a1800da.lib import DLC
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 2.0
+# a save game is only touched once its size and modification time did not change for this long
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_WORKERS = 2
+
+
+def get_accounts_dirs() -> List[str]:
+    """Get the directories Anno 1800 keeps the save games of its accounts in."""
+    home = os.getenv("USERPROFILE") or os.path.expanduser("~")
+    candidates = [os.path.join(home, "Documents", "Anno 1800", "accounts"),
+                  os.path.join(home, "OneDrive", "Documents", "Anno 1800", "accounts")]
+    return [candidate for candidate in candidates if os.path.isdir(candidate)]
+
+
+def iter_save_games(path: str) -> Iterator[os.DirEntry]:
+    """Recursively yield the save game files below a directory, skipping files this tool created."""
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_save_games(entry.path)
+        elif entry.name.endswith(".a7s") and not pipeline.is_output_file(entry.name):
+            yield entry
+
+
+def get_hash(path: str) -> str:
+    """Hash the header and tail of a save game, which change whenever the game writes it."""
+    with lib.Reader.from_file(path) as reader:
+        return lib.RdaIndex.get_fingerprint(reader)["hash"]
+
+
+@dataclass()
+class FileState:
+    size: int
+    mtime_ns: int
+    # processed files only, used when the modification time changed but the size did not
+    hash: str | None = None
+    # when the size or modification time was last seen changing
+    changed_at: float = 0.0
+
+
+class Watcher:
+    """Activates DLCs in save games as soon as the game finished writing them.
+
+    Every poll only stats the save games. A new or changed file is processed once its size and modification time
+    stayed the same for settle_seconds. Files whose active DLCs already match are skipped after a cheap streaming
+    scan. At most workers files are processed at a time, the rest waits for the following polls."""
+
+    def __init__(self, paths: Iterable[str], dlcs: List[DLC], in_place: bool = False,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS, workers: int = DEFAULT_WORKERS,
+                 compression_policy: lib.CompressionPolicy | None = None,
+                 on_result: Callable[[pipeline.PipelineResult], None] | None = None):
+        self.paths = list(paths)
+        self.dlcs = dlcs
+        self.in_place = in_place
+        self.settle_seconds = settle_seconds
+        self.workers = workers
+        self.compression_policy = compression_policy
+        self.on_result = on_result
+        self.pending: Dict[str, FileState] = {}
+        self.processed: Dict[str, FileState] = {}
+        self.in_flight: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="a1800da-watch")
+
+    def _is_processed(self, path: str, size: int, mtime_ns: int) -> bool:
+        state = self.processed.get(path)
+        if state is None or state.size != size:
+            return False
+        if state.mtime_ns == mtime_ns:
+            return True
+        # touched but maybe not rewritten
+        try:
+            if get_hash(path) == state.hash:
+                state.mtime_ns = mtime_ns
+                return True
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def scan(self, now: float | None = None) -> List[str]:
+        """Stat all save games and get the ones which settled and need processing."""
+        now = time.monotonic() if now is None else now
+        ready: List[str] = []
+        seen = set()
+        for root in self.paths:
+            for entry in iter_save_games(root):
+                path = entry.path
+                seen.add(path)
+                if path in self.in_flight:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if self._is_processed(path, stat.st_size, stat.st_mtime_ns):
+                    self.pending.pop(path, None)
+                    continue
+                state = self.pending.get(path)
+                if state is None or (state.size, state.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                    self.pending[path] = FileState(stat.st_size, stat.st_mtime_ns, changed_at=now)
+                elif now - state.changed_at >= self.settle_seconds:
+                    ready.append(path)
+        for path in list(self.pending):
+            if path not in seen:
+                del self.pending[path]
+        for path in list(self.processed):
+            if path not in seen:
+                del self.processed[path]
+        return ready
+
+    def _process(self, path: str) -> Tuple[pipeline.PipelineResult, FileState]:
+        result = pipeline.read_active_dlcs(path)
+        if all(dlc in result.priorly_active_dlcs for dlc in self.dlcs):
+            result.seconds = 0.0
+        else:
+            result = pipeline.activate_dlcs(path, self.dlcs, self.in_place,
+                                            compression_policy=self.compression_policy, verify_output=True)
+        # stat after writing in place, so the file is not picked up again
+        stat = os.stat(path)
+        return result, FileState(stat.st_size, stat.st_mtime_ns, get_hash(path))
+
+    def _collect(self):
+        for path, future in list(self.in_flight.items()):
+            if not future.done():
+                continue
+            del self.in_flight[path]
+            try:
+                result, state = future.result()
+                self.processed[path] = state
+            except Exception as e:
+                # retried once the file changes again
+                stat = self.pending.pop(path, None)
+                if stat is not None:
+                    self.processed[path] = stat
+                result = pipeline.PipelineResult(path, error=f"{type(e).__name__}: {e}")
+            if self.on_result is not None:
+                self.on_result(result)
+
+    def poll(self, now: float | None = None):
+        """Collect finished files and start processing the settled ones."""
+        self._collect()
+        for path in self.scan(now):
+            if len(self.in_flight) >= self.workers:
+                break
+            log.debug("Processing %s", path)
+            self.in_flight[path] = self._executor.submit(self._process, path)
+
+    def run(self, interval: float = DEFAULT_POLL_INTERVAL, should_stop: Callable[[], bool] = lambda: False):
+        """Poll until should_stop() returns True, then wait for the files being processed."""
+        try:
+            while not should_stop():
+                self.poll()
+                time.sleep(interval)
+        finally:
+            self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._collect()
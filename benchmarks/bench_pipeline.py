@@ -0,0 +1,93 @@
+"""Time and memory-profile every stage of the DLC activation pipeline on synthetic save games.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --sizes 1M,10M,100M,1G
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from a1800da import lib, synthetic  # noqa: E402
+from a1800da.lib import DLC  # noqa: E402
+
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+DLCS_TO_ADD = [DLC.S3_HIGH_LIFE, DLC.S4_NEW_WORLD_RISING, DLC.THE_ANARCHIST]
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    if value[-1:] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def measure(stage: Callable) -> Tuple[object, float, int]:
+    """Run a stage, return its result, the seconds it took and the peak of Python allocations."""
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = stage()
+    seconds = time.perf_counter() - start
+    return result, seconds, tracemalloc.get_traced_memory()[1] - before
+
+
+def run_stages(save_game_path: str, output_path: str) -> Dict[str, Tuple[float, int]]:
+    timings: Dict[str, Tuple[float, int]] = {}
+
+    def timed(name: str, stage: Callable):
+        result, seconds, peak = measure(stage)
+        timings[name] = (seconds, peak)
+        return result
+
+    with lib.SaveGameReader.from_file(save_game_path) as save_game_reader:
+        timed("header scan", save_game_reader.get_index)
+        gamesetup_bytes = timed("decompress", save_game_reader.get_gamesetup_bytes)
+        game_setup_reader = lib.GameSetupReader(gamesetup_bytes)
+        timed("parse", lambda: game_setup_reader.existing_dlcs)
+        game_setup_writer = lib.GameSetupWriter(game_setup_reader, game_setup_reader.initial_bytes)
+        timed("insert_dlcs", lambda: game_setup_writer.insert_dlcs(DLCS_TO_ADD))
+        compressed = timed("compress", game_setup_writer.get_compressed_gamesetup_a7s)
+        with lib.SaveGameWriter(save_game_reader, save_game_reader.initial_bytes) as save_game_writer:
+            save_game_writer.add_gamesetup_a7s(compressed)
+            timed("write_save_game", lambda: save_game_writer.write_save_game(output_path))
+    return timings
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1M,10M,100M", help="Comma separated save game sizes, e.g. 1M,100M,1G")
+    parser.add_argument("--nodes", type=int, default=10000, help="Number of gamesetup attribute nodes")
+    parser.add_argument("--blocks", type=int, default=3, help="Number of archive blocks")
+    parser.add_argument("--entries", type=int, default=2, help="Filler entries per block")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size, the fastest run is reported")
+    parser.add_argument("--dir", default=None, help="Directory for the generated save games")
+    args = parser.parse_args(argv)
+
+    tracemalloc.start()
+    print(f"{'size':>8} {'stage':<16} {'seconds':>10} {'peak MiB':>10}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size_value in args.sizes.split(","):
+            size = parse_size(size_value)
+            save_game_path = os.path.join(directory, f"synthetic_{size_value}.a7s")
+            output_path = os.path.join(directory, f"synthetic_{size_value}_out.a7s")
+            tracemalloc.stop()
+            synthetic.write_synthetic_save_game(save_game_path, size, args.blocks, args.entries, args.nodes)
+            tracemalloc.start()
+
+            runs = [run_stages(save_game_path, output_path) for _ in range(args.repeat)]
+            for stage in runs[0]:
+                seconds = min(run[stage][0] for run in runs)
+                peak = max(run[stage][1] for run in runs)
+                print(f"{size_value:>8} {stage:<16} {seconds:>10.4f} {peak / 1024 ** 2:>10.2f}")
+            os.remove(save_game_path)
+            os.remove(output_path)
+
+
+if __name__ == "__main__":
+    main()
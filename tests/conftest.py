@@ -0,0 +1,32 @@
+from typing import Callable, List
+
+import pytest
+
+from a1800da import synthetic
+from a1800da.lib import DLC
+
+
+@pytest.fixture()
+def active_dlcs() -> List[DLC]:
+    """The DLCs active in the gamesetup fixture."""
+    return [DLC.S1_SUNKEN_TREASURES, DLC.S1_BOTANICA]
+
+
+@pytest.fixture()
+def gamesetup(active_dlcs) -> bytes:
+    return synthetic.build_gamesetup(node_count=100, active_dlcs=active_dlcs)
+
+
+@pytest.fixture()
+def make_save_game(tmp_path) -> Callable[..., str]:
+    """Get a function which writes a synthetic save game with the given gamesetup.a7s and returns its path."""
+    def make(gamesetup: bytes, name: str = "synthetic.a7s") -> str:
+        path = str(tmp_path / name)
+        synthetic.write_save_game(path, gamesetup, block_count=2, entries_per_block=2, entry_size=16 * 1024)
+        return path
+    return make
+
+
+@pytest.fixture()
+def save_game_path(make_save_game, gamesetup) -> str:
+    return make_save_game(gamesetup)
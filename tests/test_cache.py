@@ -0,0 +1,81 @@
+import os
+import shutil
+
+from a1800da import cache, pipeline
+from a1800da.cache import CachedGameSetup, GameSetupCache
+from a1800da.lib import DLC, SaveGameReader
+
+
+def make_entry(value: int, buffer: bytes | None = None) -> CachedGameSetup:
+    return CachedGameSetup([DLC.S1_BOTANICA.value], value, value + 8, buffer)
+
+
+def test_memory_eviction_drops_least_recently_used():
+    game_setup_cache = GameSetupCache(max_memory_bytes=3 * cache._ENTRY_OVERHEAD)
+    for key in "abc":
+        game_setup_cache.put(key, make_entry(ord(key)))
+    assert game_setup_cache.get("a").count_ptr == ord("a")
+    game_setup_cache.put("d", make_entry(ord("d")))
+    assert game_setup_cache.get("b") is None
+    assert [game_setup_cache.get(key).count_ptr for key in "acd"] == [ord(key) for key in "acd"]
+
+
+def test_memory_keeps_the_state_of_entries_too_large_to_hold():
+    game_setup_cache = GameSetupCache(max_memory_bytes=2 * cache._ENTRY_OVERHEAD)
+    game_setup_cache.put("a", make_entry(1, bytes(cache._ENTRY_OVERHEAD * 4)))
+    cached = game_setup_cache.get("a")
+    assert cached.count_ptr == 1 and cached.buffer is None
+
+
+def test_disk_eviction_drops_least_recently_used(tmp_path):
+    directory = str(tmp_path / "cache")
+    buffer = bytes(1000)
+    # room for two entries with their buffer and state
+    game_setup_cache = GameSetupCache(directory, max_memory_bytes=0, max_disk_bytes=2500)
+    for i, key in enumerate("ab"):
+        game_setup_cache.put(key, make_entry(i, buffer))
+        for extension in (".json", ".bin"):
+            os.utime(os.path.join(directory, key + extension), ns=(i * 10 ** 9, i * 10 ** 9))
+
+    # loading a from disk marks it as used
+    assert GameSetupCache(directory, max_memory_bytes=0).get("a", with_buffer=True).buffer == buffer
+    game_setup_cache.put("c", make_entry(2, buffer))
+    # files are evicted one by one, the state of b may stay without its buffer
+    files = os.listdir(directory)
+    assert "b.bin" not in files
+    assert {"a.bin", "a.json", "c.bin", "c.json"} <= set(files)
+    fresh_cache = GameSetupCache(directory)
+    cached = fresh_cache.get("b", with_buffer=True)
+    assert cached is None or cached.buffer is None
+    assert fresh_cache.get("a", with_buffer=True).buffer == buffer
+    assert fresh_cache.get("c", with_buffer=True).buffer == buffer
+
+
+def test_without_store_buffers_only_the_state_is_cached(tmp_path):
+    directory = str(tmp_path / "cache")
+    game_setup_cache = GameSetupCache(directory, store_buffers=False)
+    game_setup_cache.put("a", make_entry(1, bytes(64)))
+    assert os.listdir(directory) == ["a.json"]
+    for cached in (game_setup_cache.get("a", with_buffer=True),
+                   GameSetupCache(directory).get("a", with_buffer=True)):
+        assert cached.buffer is None
+        assert (cached.dlcs, cached.count_ptr, cached.insertion_ptr) == ([DLC.S1_BOTANICA], 1, 9)
+
+
+def test_activation_from_cached_buffer_is_identical(tmp_path, monkeypatch, save_game_path):
+    game_setup_cache = GameSetupCache(str(tmp_path / "cache"))
+    dlcs = [DLC.S3_HIGH_LIFE, DLC.THE_ANARCHIST]
+    uncached_path = pipeline.activate_dlcs(save_game_path, dlcs, gamesetup_cache=game_setup_cache).output_path
+
+    copy_path = str(tmp_path / "copy.a7s")
+    shutil.copy(save_game_path, copy_path)
+
+    def get_gamesetup_bytes(self):
+        raise AssertionError("gamesetup.a7s is decompressed although it is cached")
+
+    monkeypatch.setattr(SaveGameReader, "get_gamesetup_bytes", get_gamesetup_bytes)
+    result = pipeline.activate_dlcs(copy_path, dlcs, gamesetup_cache=GameSetupCache(str(tmp_path / "cache")),
+                                    verify_output=True)
+    assert result.error is None and result.verified
+    with open(uncached_path, "rb") as uncached, open(result.output_path, "rb") as cached:
+        assert uncached.read() == cached.read()
@@ -0,0 +1,14 @@
+import os
+
+from a1800da import cli
+
+
+def test_find_save_games_skips_output_files(tmp_path):
+    for name in ("a.1.a7s", "a.1_dlc_activated.a7s", "b.a7s", "b_dlc_activated.a7s"):
+        (tmp_path / name).write_bytes(b"")
+    expected = [str(tmp_path / "a.1.a7s"), str(tmp_path / "b.a7s")]
+    assert cli.find_save_games([str(tmp_path)]) == expected
+    assert cli.find_save_games([os.path.join(str(tmp_path), "*.a7s")]) == expected
+    # unless given by name
+    output_path = str(tmp_path / "b_dlc_activated.a7s")
+    assert cli.find_save_games([output_path]) == [output_path]
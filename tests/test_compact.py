@@ -0,0 +1,43 @@
+from a1800da import compact, pipeline
+from a1800da.lib import DLC, SaveGameReader
+
+
+def read_entries(path):
+    """Get the decompressed gamesetup.a7s and the stored bytes of the other entries by name."""
+    with SaveGameReader.from_file(path) as reader:
+        entries = {entry.name: reader.read_bytes(entry.offset, entry.compressed_size)
+                   for entry in reader.get_index() if entry.name != "gamesetup.a7s"}
+        entries["gamesetup.a7s"] = bytes(reader.get_gamesetup_bytes())
+    return entries
+
+
+def get_gamesetup_compressed_size(path) -> int:
+    with SaveGameReader.from_file(path) as reader:
+        return reader.locate_gamesetup().compressed_size
+
+
+def test_compaction_round_trip(tmp_path, save_game_path):
+    activated_path = pipeline.activate_dlcs(save_game_path, [DLC.S3_HIGH_LIFE]).output_path
+    compacted_path = str(tmp_path / "compacted.a7s")
+    result = compact.compact_save_game(activated_path, compacted_path)
+
+    # at least the replaced gamesetup.a7s is dropped
+    assert result.reclaimed_bytes >= get_gamesetup_compressed_size(save_game_path)
+    assert read_entries(compacted_path) == read_entries(activated_path)
+    assert DLC.S3_HIGH_LIFE in pipeline.read_active_dlcs(compacted_path).priorly_active_dlcs
+
+    # a compacted save game has nothing left to drop
+    again_path = str(tmp_path / "again.a7s")
+    assert compact.compact_save_game(compacted_path, again_path).reclaimed_bytes == 0
+    with open(compacted_path, "rb") as compacted, open(again_path, "rb") as again:
+        assert compacted.read() == again.read()
+
+
+def test_compaction_in_place(save_game_path):
+    activated_path = pipeline.activate_dlcs(save_game_path, [DLC.S3_HIGH_LIFE]).output_path
+    entries = read_entries(activated_path)
+    result = compact.compact_save_game(activated_path)
+    assert result.reclaimed_bytes > 0
+    assert read_entries(activated_path) == entries
+    with SaveGameReader.from_file(activated_path) as reader:
+        assert reader.size == result.output_size
@@ -0,0 +1,30 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from a1800da.lib import CompressionPolicy
+
+
+def test_shared_policy_records_every_file():
+    policy = CompressionPolicy("auto", sample_size=3)
+    documents = [os.urandom(256) * (i + 1) for i in range(40)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda document: policy.compress([memoryview(document)]), documents))
+
+    for document, (compressed, level, seconds) in zip(documents, results):
+        assert zlib.decompress(compressed) == document
+        assert level in CompressionPolicy.AUTO_CANDIDATE_LEVELS
+        assert seconds >= 0
+    assert policy.level in CompressionPolicy.AUTO_CANDIDATE_LEVELS
+    assert sum(usage[0] for usage in policy.usage.values()) == len(documents)
+    assert sum(usage[2] for usage in policy.usage.values()) == sum(len(document) for document in documents)
+    assert policy.sampled_files >= policy.sample_size
+    # every sampled file was compressed with every candidate level
+    assert len({sample[1] for sample in policy.samples.values()}) == 1
+
+
+def test_fixed_policy_returns_its_level():
+    compressed, level, _ = CompressionPolicy(3).compress([memoryview(b"abc" * 100)])
+    assert level == 3
+    assert zlib.decompress(compressed) == b"abc" * 100
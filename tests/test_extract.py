@@ -0,0 +1,91 @@
+import os
+import zlib
+
+import pytest
+
+from a1800da.lib import FILE_NAME_SIZE, ParseError, SaveGameReader, get_extract_path
+
+CHUNK_SIZE = 1000
+
+
+def rename_entry(save_game_path: str, old_name: str, new_name: str):
+    with SaveGameReader.from_file(save_game_path) as reader:
+        directory_entry_ptr = reader.get_entry(old_name).directory_entry_ptr
+    with open(save_game_path, "r+b") as f:
+        f.seek(directory_entry_ptr)
+        f.write(new_name.encode("utf-16-le").ljust(FILE_NAME_SIZE, b"\0"))
+
+
+def test_iter_entry_chunks_bounds(gamesetup, save_game_path):
+    with SaveGameReader.from_file(save_game_path) as reader:
+        entry = reader.get_entry("gamesetup.a7s")
+        compressed = bytes(reader.read_view(entry.offset, entry.compressed_size))
+
+        chunks = list(reader.iter_entry_chunks("gamesetup.a7s", CHUNK_SIZE))
+        assert all(0 < len(chunk) <= CHUNK_SIZE for chunk in chunks)
+        assert b"".join(chunks) == gamesetup
+
+        chunks = list(reader.iter_entry_chunks("gamesetup.a7s", CHUNK_SIZE, decompress=False))
+        assert [len(chunk) for chunk in chunks[:-1]] == [CHUNK_SIZE] * (len(chunks) - 1)
+        assert b"".join(chunks) == compressed
+
+        with pytest.raises(ParseError, match="No missing.a7s"):
+            reader.iter_entry_chunks("missing.a7s")
+
+
+def test_iter_entry_chunks_truncated(save_game_path):
+    with SaveGameReader.from_file(save_game_path) as reader:
+        entry = reader.get_entry("gamesetup.a7s")
+    # the compressed gamesetup.a7s ends early, the bytes after it are its directory
+    with open(save_game_path, "r+b") as f:
+        f.seek(entry.compressed_size_ptr)
+        f.write((entry.compressed_size - 8).to_bytes(8, "little"))
+    with SaveGameReader.from_file(save_game_path) as reader:
+        with pytest.raises(ParseError, match="truncated"):
+            b"".join(reader.iter_entry_chunks("gamesetup.a7s", CHUNK_SIZE))
+
+
+def test_extract_to(gamesetup, save_game_path, tmp_path):
+    output_path = tmp_path / "gamesetup.a7s"
+    with SaveGameReader.from_file(save_game_path) as reader:
+        assert reader.extract_to("gamesetup.a7s", output_path, CHUNK_SIZE) == len(gamesetup)
+        assert output_path.read_bytes() == gamesetup
+
+        entry = reader.get_entry("gamesetup.a7s")
+        assert reader.extract_to("gamesetup.a7s", output_path, CHUNK_SIZE, decompress=False) == entry.compressed_size
+        assert zlib.decompress(output_path.read_bytes()) == gamesetup
+
+
+def test_extract_all(gamesetup, save_game_path, tmp_path):
+    rename_entry(save_game_path, "data0_0.a7s", "data\\nested\\data0_0.a7s")
+    output_dir = tmp_path / "extracted"
+    with SaveGameReader.from_file(save_game_path) as reader:
+        written = reader.extract_all(output_dir, workers=2, chunk_size=CHUNK_SIZE)
+        names = [entry.name for entry in reader.get_index()]
+    assert sorted(written) == sorted(names)
+    assert written["gamesetup.a7s"] == len(gamesetup)
+    assert (output_dir / "gamesetup.a7s").read_bytes() == gamesetup
+    assert os.path.getsize(output_dir / "data" / "nested" / "data0_0.a7s") == 16 * 1024
+    assert all(written[name] == 16 * 1024 for name in names if name != "gamesetup.a7s")
+
+
+@pytest.mark.parametrize("name", ["../escaped.a7s", "data/../../escaped.a7s", "..\\escaped.a7s", "/escaped.a7s",
+                                  "\\escaped.a7s", ".", ""])
+def test_get_extract_path_refuses_unsafe_names(name, tmp_path):
+    with pytest.raises(ParseError, match="Refusing to extract"):
+        get_extract_path(tmp_path, name)
+
+
+def test_get_extract_path(tmp_path):
+    assert get_extract_path(tmp_path, "data\\a.a7s") == os.path.join(tmp_path, "data", "a.a7s")
+    assert get_extract_path(tmp_path, "data/../a.a7s") == os.path.join(tmp_path, "a.a7s")
+
+
+def test_extract_all_refuses_unsafe_names(save_game_path, tmp_path):
+    rename_entry(save_game_path, "data0_0.a7s", "../escaped.a7s")
+    output_dir = tmp_path / "extracted"
+    with SaveGameReader.from_file(save_game_path) as reader:
+        with pytest.raises(ParseError, match="Refusing to extract"):
+            reader.extract_all(output_dir)
+    assert not (tmp_path / "escaped.a7s").exists()
+    assert not output_dir.exists()
@@ -0,0 +1,135 @@
+import io
+import struct
+from typing import Dict
+
+import pytest
+
+from a1800da import filedb, synthetic
+from a1800da.lib import DLC, GameSetupReader, GameSetupWriter
+
+
+def export_and_compile(document: bytes) -> bytes:
+    reader = GameSetupReader(document)
+    xml = io.StringIO()
+    filedb.export_reader_xml(reader, xml)
+    compiled = io.BytesIO()
+    filedb.compile_xml(io.BytesIO(xml.getvalue().encode()), compiled,
+                       {name: node_id for node_id, name in reader.enclosing_tags_combined.items()},
+                       reader.attribute_node_to_id)
+    return compiled.getvalue()
+
+
+def build_document(tag_names: Dict[int, str], attribute_names: Dict[int, str], *records: bytes) -> bytes:
+    # the document ends with a closing node on the top level
+    document = b"".join(records) + struct.pack("<iI", 0, 0)
+    tags = filedb.encode_name_table(tag_names)
+    attributes = filedb.encode_name_table(attribute_names)
+    return (document + tags + attributes + struct.pack("<ii", len(document), len(document) + len(tags))
+            + filedb.TRAILER_MAGIC)
+
+
+def test_export_compile_round_trip(gamesetup):
+    assert export_and_compile(gamesetup) == gamesetup
+
+
+def test_export_compile_round_trip_edge_cases():
+    tag, attribute = filedb.build_tag, filedb.build_attribute
+    # Item is a tag and an attribute name, content sizes are not multiples of the content block size
+    document = build_document(
+        {1: "Root", 2: "Item", 3: "Empty"}, {32768: "Item", 32769: "Blob", 32770: "None"},
+        tag(1,
+            tag(3),
+            attribute(32770, b""),
+            tag(2, tag(2, tag(2, attribute(32768, b"\x01\x02\x03")))),
+            attribute(32769, bytes(range(256)) * (filedb.XML_HEX_CHUNK_SIZE // 256 + 3) + b"\xff")),
+        tag(3))
+    assert export_and_compile(document) == document
+
+
+def test_export_compile_round_trip_after_activation(gamesetup):
+    reader = GameSetupReader(gamesetup)
+    writer = GameSetupWriter(reader, reader.initial_bytes)
+    writer.insert_dlcs([DLC.S3_HIGH_LIFE])
+    document = bytes(writer.get_uncompressed_gamesetup_a7s())
+    assert export_and_compile(document) == document
+
+
+def test_patch_without_overlap(gamesetup):
+    patch = filedb.FileDbPatch.from_reader(GameSetupReader(gamesetup))
+    patch.insert_node("/GameSetup/ActiveDLCs", patch.make_attribute("DLC", DLC.S3_HIGH_LIFE.value.to_bytes(4, "big")))
+    patch.remove_node("/GameSetup/Settings/Name", 0)
+    patched = GameSetupReader(patch.apply())
+    assert DLC.S3_HIGH_LIFE in patched.existing_dlcs
+
+
+@pytest.mark.parametrize("edit", [
+    # an attribute inside a removed tag
+    lambda patch: patch.remove_node("/GameSetup/Settings").set_attribute("/GameSetup/Settings/Value", b"\0" * 8),
+    # the same attribute twice
+    lambda patch: patch.set_attribute("/GameSetup/ActiveDLCs/count", b"\0" * 8).set_attribute(
+        "/GameSetup/ActiveDLCs/count", b"\1" + b"\0" * 7),
+    # an attribute and the tag enclosing it
+    lambda patch: patch.remove_node("/GameSetup/ActiveDLCs/DLC", 1).remove_node("/GameSetup/ActiveDLCs"),
+])
+def test_patch_overlap(gamesetup, edit):
+    patch = filedb.FileDbPatch.from_reader(GameSetupReader(gamesetup))
+    edit(patch)
+    with pytest.raises(ValueError, match="overlap"):
+        patch.apply()
+
+
+def test_only_dlcs_inside_active_dlcs_are_active(gamesetup):
+    patch = filedb.FileDbPatch.from_reader(GameSetupReader(gamesetup))
+    patch.insert_node("/GameSetup/Settings", patch.make_attribute("DLC", DLC.S3_HIGH_LIFE.value.to_bytes(4, "big")))
+    document = patch.apply()
+    active_dlcs = GameSetupReader(gamesetup).existing_dlcs
+
+    assert GameSetupReader(document).existing_dlcs == active_dlcs
+    assert filedb.scan_active_dlcs([document]).dlcs == active_dlcs
+    # a full scan collects DLC attributes anywhere, as the first release did
+    reader = GameSetupReader(document)
+    assert reader._parse_active_dlcs(full_scan=True) == [DLC.S3_HIGH_LIFE] + active_dlcs
+
+
+def iter_chunks(document: bytes, fed: list, chunk_size: int = 64):
+    for ptr in range(0, len(document), chunk_size):
+        fed.append(ptr)
+        yield document[ptr:ptr + chunk_size]
+
+
+def test_scan_active_dlcs_stops_early_with_name_ids_hint(monkeypatch, active_dlcs):
+    monkeypatch.setattr(filedb, "_name_ids_hint", None)
+    document = synthetic.build_gamesetup(node_count=100, active_dlcs=active_dlcs, active_dlcs_first=True)
+    expected_state = GameSetupReader(document).get_active_dlcs_state()
+
+    # without a hint the whole document is scanned, the name ids are kept as hint
+    fed = []
+    scan = filedb.scan_active_dlcs(iter_chunks(document, fed))
+    assert not scan.resolved_early and scan.bytes_fed == len(document)
+    assert (scan.dlc_values, scan.count_ptr, scan.insertion_ptr) == expected_state
+    assert filedb._name_ids_hint == filedb.ActiveDlcNameIds(3, 32768, 32769)
+
+    # with the hint the chunks after the ActiveDLCs node are not consumed
+    fed = []
+    scan = filedb.scan_active_dlcs(iter_chunks(document, fed))
+    assert scan.resolved_early and scan.bytes_fed < len(document) // 2
+    assert len(fed) == scan.bytes_fed // 64 + (scan.bytes_fed % 64 > 0)
+    assert (scan.dlc_values, scan.count_ptr, scan.insertion_ptr) == expected_state
+
+    fed = []
+    scan = filedb.scan_active_dlcs(iter_chunks(document, fed), use_name_ids_hint=False)
+    assert not scan.resolved_early and scan.dlcs == active_dlcs
+
+
+@pytest.mark.parametrize("name_ids", [
+    # the hint of another game build
+    filedb.ActiveDlcNameIds(2, 32770, 32771),
+    # the ActiveDLCs tag of the hint with a count which does not match the DLCs
+    filedb.ActiveDlcNameIds(3, 32768, 32770),
+])
+def test_scan_active_dlcs_with_wrong_name_ids_hint(monkeypatch, active_dlcs, name_ids):
+    monkeypatch.setattr(filedb, "_name_ids_hint", name_ids)
+    document = synthetic.build_gamesetup(node_count=100, active_dlcs=active_dlcs, active_dlcs_first=True)
+    scan = filedb.scan_active_dlcs(iter_chunks(document, []))
+    assert not scan.resolved_early and scan.bytes_fed == len(document)
+    assert (scan.dlc_values, scan.count_ptr, scan.insertion_ptr) == GameSetupReader(document).get_active_dlcs_state()
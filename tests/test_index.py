@@ -0,0 +1,63 @@
+import json
+
+from a1800da import pipeline
+from a1800da.lib import DLC, RdaIndex, SaveGameReader
+
+
+def load_index(path) -> RdaIndex:
+    with SaveGameReader.from_file(path) as reader:
+        return reader.get_index(use_sidecar=True)
+
+
+def count_builds(monkeypatch) -> list:
+    builds = []
+    build = RdaIndex.build.__func__
+
+    def counting_build(cls, reader):
+        builds.append(reader.file_path)
+        return build(cls, reader)
+
+    monkeypatch.setattr(RdaIndex, "build", classmethod(counting_build))
+    return builds
+
+
+def test_sidecar_is_reused_for_an_unchanged_save_game(monkeypatch, save_game_path):
+    builds = count_builds(monkeypatch)
+    index = load_index(save_game_path)
+    assert builds == [save_game_path]
+    with open(save_game_path + RdaIndex.SIDECAR_SUFFIX, encoding="utf-8") as f:
+        assert json.load(f)["version"] == RdaIndex.SIDECAR_VERSION
+
+    assert list(load_index(save_game_path)) == list(index)
+    assert builds == [save_game_path]
+
+
+def test_sidecar_is_rebuilt_when_the_save_game_changes(monkeypatch, save_game_path):
+    old_entry = load_index(save_game_path)["gamesetup.a7s"]
+    pipeline.activate_dlcs(save_game_path, [DLC.S3_HIGH_LIFE], in_place=True)
+
+    builds = count_builds(monkeypatch)
+    index = load_index(save_game_path)
+    assert builds == [save_game_path]
+    with SaveGameReader.from_file(save_game_path) as reader:
+        assert list(index) == list(RdaIndex.build(reader))
+        fingerprint = RdaIndex.get_fingerprint(reader)
+    assert index["gamesetup.a7s"].offset != old_entry.offset
+    with open(save_game_path + RdaIndex.SIDECAR_SUFFIX, encoding="utf-8") as f:
+        assert json.load(f)["fingerprint"] == fingerprint
+
+
+def test_sidecar_with_another_fingerprint_is_ignored(monkeypatch, save_game_path):
+    load_index(save_game_path)
+    sidecar_path = save_game_path + RdaIndex.SIDECAR_SUFFIX
+    with open(sidecar_path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["fingerprint"]["hash"] = "0" * 32
+    data["offsets"] = [0] * len(data["offsets"])
+    with open(sidecar_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    builds = count_builds(monkeypatch)
+    with SaveGameReader.from_file(save_game_path) as reader:
+        assert list(reader.get_index(use_sidecar=True)) == list(RdaIndex.build(reader))
+    assert len(builds) == 2
@@ -0,0 +1,88 @@
+import os
+import struct
+import sys
+import zlib
+from typing import List
+
+import pytest
+
+from a1800da import filedb, pipeline, synthetic
+from a1800da.lib import (FILE_NAME_SIZE, FILE_SUFFIX_SIZE, GAMESETUP_A7S_MARKER, DLC, GameSetupReader,
+                         ParseError)
+
+NEW_DLCS = [DLC.S3_HIGH_LIFE, DLC.THE_ANARCHIST]
+
+
+def activate_like_baseline(save_game: bytes, dlcs: List[DLC]) -> bytes:
+    """Activate DLCs in a synthetic save game the way the first release did, as the expected output."""
+    tag_ids = {name: node_id for node_id, name in synthetic.TAG_NAMES.items()}
+    attribute_ids = {name: node_id for node_id, name in synthetic.ATTRIBUTE_NAMES.items()}
+    entry_ptr = save_game.index("gamesetup.a7s".encode("utf-16-le"))
+    offset, compressed_size = struct.unpack_from("<QQ", save_game, entry_ptr + FILE_NAME_SIZE)
+    document = bytearray(zlib.decompress(save_game[offset:offset + compressed_size]))
+
+    # the ActiveDLCs tag is followed by its count
+    insertion_ptr = document.index(struct.pack("<iIiI", 0, tag_ids["ActiveDLCs"], 8, attribute_ids["count"])) + 8
+    count = struct.unpack_from("<q", document, insertion_ptr + 8)[0]
+    for dlc in dlcs:
+        document[insertion_ptr:insertion_ptr] = struct.pack("<iI", 4, attribute_ids["DLC"]) + struct.pack(
+            ">I", dlc.value) + bytes(4)
+    added = 16 * len(dlcs)
+    struct.pack_into("<q", document, insertion_ptr + added + 8, count + len(dlcs))
+    tags_ptr, attributes_ptr = struct.unpack_from("<ii", document, len(document) - 16)
+    struct.pack_into("<ii", document, len(document) - 16, tags_ptr + added, attributes_ptr + added)
+
+    blob = zlib.compress(document, level=9)
+    output = bytearray(save_game)
+    # only the low 4 bytes of the offset, compressed size and size fields were written
+    for i, value in enumerate((len(save_game), sys.getsizeof(blob), sys.getsizeof(blob))):
+        struct.pack_into("<i", output, entry_ptr + FILE_NAME_SIZE + i * 8, value)
+    return bytes(output + blob + GAMESETUP_A7S_MARKER + save_game[-FILE_SUFFIX_SIZE:])
+
+
+def test_activate_dlcs_matches_baseline_writer(save_game_path, active_dlcs):
+    with open(save_game_path, "rb") as f:
+        save_game = f.read()
+    result = pipeline.activate_dlcs(save_game_path, NEW_DLCS, verify_output=True)
+    assert result.error is None and result.verified
+    assert result.priorly_active_dlcs == active_dlcs
+    assert result.activated_dlcs == NEW_DLCS
+    with open(result.output_path, "rb") as f:
+        assert f.read() == activate_like_baseline(save_game, NEW_DLCS)
+    with open(save_game_path, "rb") as f:
+        assert f.read() == save_game
+
+
+def test_activate_dlcs_in_place(save_game_path, active_dlcs):
+    with open(save_game_path, "rb") as f:
+        save_game = f.read()
+    result = pipeline.activate_dlcs(save_game_path, NEW_DLCS, in_place=True, verify_output=True)
+    assert result.error is None and result.verified
+    assert result.output_path == save_game_path
+    with open(save_game_path, "rb") as f:
+        assert f.read() == activate_like_baseline(save_game, NEW_DLCS)
+    assert set(pipeline.read_active_dlcs(save_game_path).priorly_active_dlcs) == set(active_dlcs) | set(NEW_DLCS)
+
+    # nothing to do once all DLCs are active
+    result = pipeline.activate_dlcs(save_game_path, NEW_DLCS, in_place=True)
+    assert result.activated_dlcs == []
+
+
+def test_output_file_paths_do_not_collide():
+    paths = [os.path.join("saves", "a.1.a7s"), os.path.join("saves", "a.2.a7s"), os.path.join("saves.d", "a")]
+    output_paths = [pipeline.get_output_file_path(path) for path in paths]
+    assert output_paths == [os.path.join("saves", "a.1_dlc_activated.a7s"),
+                            os.path.join("saves", "a.2_dlc_activated.a7s"),
+                            os.path.join("saves.d", "a_dlc_activated.a7s")]
+    assert all(pipeline.is_output_file(path) for path in output_paths)
+
+
+def test_activate_dlcs_without_count(make_save_game, gamesetup):
+    patch = filedb.FileDbPatch.from_reader(GameSetupReader(gamesetup))
+    save_game_path = make_save_game(patch.remove_node("/GameSetup/ActiveDLCs/count").apply())
+    with open(save_game_path, "rb") as f:
+        save_game = f.read()
+    with pytest.raises(ParseError, match="No count"):
+        pipeline.activate_dlcs(save_game_path, NEW_DLCS, in_place=True, verify_output=True)
+    with open(save_game_path, "rb") as f:
+        assert f.read() == save_game
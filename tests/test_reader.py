@@ -0,0 +1,28 @@
+import pytest
+
+from a1800da.lib import ParseError, Reader
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 8])
+def test_read(size):
+    reader = Reader(bytes(range(1, 17)))
+    assert reader.read(16 - size, size) == int.from_bytes(bytes(range(17 - size, 17)), "little")
+    assert reader.read_big(0, size) == int.from_bytes(bytes(range(1, size + 1)), "big")
+
+
+@pytest.mark.parametrize("pos, size", [(-1, 4), (-4, 4), (13, 4), (16, 1), (10, 8), (15, 3)])
+def test_read_out_of_range(pos, size):
+    reader = Reader(bytes(16))
+    with pytest.raises(ParseError, match="Cannot read"):
+        reader.read(pos, size)
+    with pytest.raises(ParseError, match="Cannot read"):
+        reader.read_big(pos, size)
+
+
+def test_read_sequentially_past_the_end():
+    reader = Reader(bytes(range(6)))
+    assert reader.read_sequentially(4) == 0x03020100
+    with pytest.raises(ParseError, match="Cannot read"):
+        reader.read_sequentially_big(4)
+    assert reader.tell() == 4
+    assert reader.read_sequentially_big(2) == 0x0405
@@ -0,0 +1,56 @@
+import pytest
+
+from a1800da import pipeline
+from a1800da.lib import DLC, GameSetupReader, ParseError, RdaIndex, SaveGameReader
+from a1800da.session import SaveSession
+
+
+def read_gamesetup(path) -> GameSetupReader:
+    with SaveGameReader.from_file(path) as reader:
+        return GameSetupReader(reader.get_gamesetup_bytes())
+
+
+def test_pointers_shift_across_commits(save_game_path, active_dlcs):
+    session = SaveSession(save_game_path)
+    for dlcs in ([DLC.S3_HIGH_LIFE], [DLC.THE_ANARCHIST, DLC.S2_SEAT_OF_POWER]):
+        assert session.activate_dlcs(dlcs + active_dlcs) == dlcs
+        result = session.commit(verify_output=True)
+        assert result.error is None and result.verified
+        written = read_gamesetup(result.output_path)
+        assert session.active_dlcs == written.existing_dlcs
+        assert session.game_setup_reader.existing_count_node_ptr == written.existing_count_node_ptr
+        assert session.game_setup_reader.new_dlc_insertion_ptr == written.new_dlc_insertion_ptr
+        assert session.game_setup_reader.initial_bytes == written.initial_bytes
+    # the opened save game stays the base of every commit
+    assert result.priorly_active_dlcs == active_dlcs
+    assert set(result.activated_dlcs) == {DLC.S3_HIGH_LIFE, DLC.THE_ANARCHIST, DLC.S2_SEAT_OF_POWER}
+
+
+def test_in_place_commit_updates_index_and_fingerprint(save_game_path, active_dlcs):
+    session = SaveSession(save_game_path)
+    for dlc in (DLC.S3_HIGH_LIFE, DLC.THE_ANARCHIST):
+        session.activate_dlcs([dlc])
+        result = session.commit(in_place=True, verify_output=True)
+        assert result.error is None and result.verified
+        with SaveGameReader.from_file(save_game_path) as reader:
+            assert session.size == reader.size
+            assert session.fingerprint == RdaIndex.get_fingerprint(reader)
+            index = RdaIndex.build(reader)
+        assert list(session.index) == list(index)
+        assert session.saved_dlcs == session.active_dlcs
+        assert not session.unsaved_dlcs
+    assert pipeline.read_active_dlcs(save_game_path).priorly_active_dlcs == session.active_dlcs
+    assert set(session.active_dlcs) == set(active_dlcs) | {DLC.S3_HIGH_LIFE, DLC.THE_ANARCHIST}
+
+
+def test_commit_refuses_a_changed_save_game(save_game_path):
+    session = SaveSession(save_game_path)
+    pipeline.activate_dlcs(save_game_path, [DLC.S1_THE_PASSAGE], in_place=True)
+    with open(save_game_path, "rb") as f:
+        save_game = f.read()
+    session.activate_dlcs([DLC.S3_HIGH_LIFE])
+    with pytest.raises(ParseError, match="changed since it was read"):
+        session.commit(in_place=True)
+    with open(save_game_path, "rb") as f:
+        assert f.read() == save_game
+    assert session.dirty
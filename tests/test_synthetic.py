@@ -0,0 +1,23 @@
+from a1800da import instrumentation
+from a1800da.lib import SaveGameReader
+
+
+def test_directory_entry_sizes(gamesetup, save_game_path):
+    with SaveGameReader.from_file(save_game_path) as reader:
+        for entry in reader.get_index():
+            expected_size = len(gamesetup) if entry.name == "gamesetup.a7s" else 16 * 1024
+            assert entry.size == expected_size
+            assert entry.compressed_size != entry.size
+
+
+def test_gamesetup_is_read_by_compressed_size(gamesetup, save_game_path):
+    events = []
+    instrumentation.enable(instrumentation.CallbackSink(events.append))
+    try:
+        with SaveGameReader.from_file(save_game_path) as reader:
+            assert reader.get_gamesetup_bytes() == gamesetup
+            compressed_size = reader.locate_gamesetup().compressed_size
+    finally:
+        instrumentation.disable()
+    counters = [event["counters"] for event in events if event["type"] == "counters"]
+    assert counters == [{"bytes_read": compressed_size, "bytes_decompressed": len(gamesetup), "buffer_copies": 1}]
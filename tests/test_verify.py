@@ -0,0 +1,98 @@
+import zlib
+
+import pytest
+
+from a1800da import lib, pipeline, verify
+from a1800da.lib import DLC
+from a1800da.session import SaveSession
+
+
+@pytest.fixture()
+def unchanged_gamesetup(monkeypatch, gamesetup):
+    """Make GameSetupWriter compress the gamesetup.a7s without the inserted DLCs."""
+    monkeypatch.setattr(lib.GameSetupWriter, "get_compressed_gamesetup_a7s", lambda self: zlib.compress(gamesetup))
+
+
+def test_in_place_activation_checks_gamesetup_before_writing(save_game_path, unchanged_gamesetup):
+    with open(save_game_path, "rb") as f:
+        save_game = f.read()
+    result = pipeline.activate_dlcs(save_game_path, [DLC.S3_HIGH_LIFE], in_place=True, verify_output=True)
+    assert result.error.startswith("Verification failed, save game not written")
+    assert "misses S3_HIGH_LIFE" in result.error
+    assert result.output_path is None
+    with open(save_game_path, "rb") as f:
+        assert f.read() == save_game
+
+
+def test_in_place_commit_checks_gamesetup_before_writing(save_game_path, unchanged_gamesetup):
+    with open(save_game_path, "rb") as f:
+        save_game = f.read()
+    session = SaveSession(save_game_path)
+    session.activate_dlcs([DLC.S3_HIGH_LIFE])
+    result = session.commit(in_place=True)
+    assert "misses S3_HIGH_LIFE" in result.error
+    assert session.dirty
+    with open(save_game_path, "rb") as f:
+        assert f.read() == save_game
+
+
+def write_activated(save_game_path, output_path, dlcs):
+    """Activate DLCs with the library classes and return the writer of the output, for verify_save_game."""
+    save_game_reader = lib.SaveGameReader.from_file(save_game_path)
+    game_setup_reader = lib.GameSetupReader(save_game_reader.get_gamesetup_bytes())
+    expected_dlcs = game_setup_reader.existing_dlcs + dlcs
+    game_setup_writer = lib.GameSetupWriter(game_setup_reader, game_setup_reader.initial_bytes)
+    game_setup_writer.insert_dlcs(dlcs)
+    save_game_writer = lib.SaveGameWriter(save_game_reader, save_game_reader.initial_bytes)
+    save_game_writer.add_gamesetup_a7s(game_setup_writer.get_compressed_gamesetup_a7s())
+    save_game_writer.write_save_game(output_path)
+    return save_game_reader, save_game_writer, expected_dlcs
+
+
+def flip_byte(f, ptr: int):
+    f.seek(ptr)
+    value = f.read(1)[0]
+    f.seek(ptr)
+    f.write(bytes([value ^ 0xff]))
+
+
+@pytest.mark.parametrize("corrupt, problem", [
+    (lambda f, writer: flip_byte(f, writer.gamesetup_a7s_ptr + writer.gamesetup_a7s_size // 2),
+     "gamesetup.a7s at 0x{blob_ptr:x}"),
+    (lambda f, writer: flip_byte(f, writer.save_game_reader.gamesetup_bytes_ptr_ptr),
+     "gamesetup.a7s offset at 0x{offset_ptr:x} is"),
+    (lambda f, writer: flip_byte(f, writer.save_game_reader.gamesetup_compressed_ptr),
+     "gamesetup.a7s compressed size at 0x{compressed_size_ptr:x} is"),
+    (lambda f, writer: flip_byte(f, writer.size - 1), "File suffix at 0x{suffix_ptr:x} does not match"),
+    (lambda f, writer: flip_byte(f, writer.gamesetup_a7s_ptr + writer.gamesetup_a7s_size),
+     "Marker behind gamesetup.a7s at 0x{marker_ptr:x} is missing"),
+    (lambda f, writer: f.truncate(writer.size - 1), "File size is {truncated_size}, expected {size}"),
+])
+def test_verification_reports_corruption(tmp_path, save_game_path, corrupt, problem):
+    output_path = str(tmp_path / "output.a7s")
+    save_game_reader, save_game_writer, expected_dlcs = write_activated(save_game_path, output_path,
+                                                                        [DLC.S3_HIGH_LIFE])
+    with save_game_reader, save_game_writer:
+        assert verify.verify_save_game(output_path, save_game_writer, expected_dlcs).ok
+        with open(output_path, "r+b") as f:
+            corrupt(f, save_game_writer)
+
+        result = verify.verify_save_game(output_path, save_game_writer, expected_dlcs)
+        assert not result.ok
+        expected_problem = problem.format(
+            blob_ptr=save_game_writer.gamesetup_a7s_ptr,
+            offset_ptr=save_game_reader.gamesetup_bytes_ptr_ptr,
+            compressed_size_ptr=save_game_reader.gamesetup_compressed_ptr,
+            suffix_ptr=save_game_writer.size - lib.FILE_SUFFIX_SIZE,
+            marker_ptr=save_game_writer.gamesetup_a7s_ptr + save_game_writer.gamesetup_a7s_size,
+            truncated_size=save_game_writer.size - 1, size=save_game_writer.size)
+        assert any(found.startswith(expected_problem) for found in result.problems), result.problems
+
+
+def test_verification_reports_missing_dlcs(tmp_path, save_game_path):
+    output_path = str(tmp_path / "output.a7s")
+    save_game_reader, save_game_writer, expected_dlcs = write_activated(save_game_path, output_path,
+                                                                        [DLC.S3_HIGH_LIFE])
+    with save_game_reader, save_game_writer:
+        result = verify.verify_save_game(output_path, save_game_writer, expected_dlcs + [DLC.THE_ANARCHIST])
+    assert result.problems == ["ActiveDLCs of the new gamesetup.a7s misses THE_ANARCHIST"]
@@ -0,0 +1,20 @@
+from a1800da.lib import Writer
+
+
+def test_base_bytes():
+    base = bytearray(range(32))
+    writer = Writer(base)
+    writer.insert(4, b"abc")
+    writer.overwrite(10, b"\xff\xfe")
+    writer.replace(20, 4, b"x")
+    writer.insert(writer.size, b"end")
+
+    expected = bytearray(range(32))
+    expected[4:4] = b"abc"
+    expected[10:12] = b"\xff\xfe"
+    expected[20:24] = b"x"
+    expected += b"end"
+    output = writer.base_bytes
+    assert isinstance(output, bytearray) and output == expected
+    assert base == bytearray(range(32))
+    assert Writer(b"").base_bytes == bytearray()
@@ -155,8 +155,8 @@ def decompress_gamesetup_a7s(gamesetup_a7s_compressed_bytes):
     return zlib.decompress(gamesetup_a7s_compressed_bytes)
 
 
-def compress_gamesetup_a7s(gamesetup_a7s_decompressed_bytes):
-    return zlib.compress(gamesetup_a7s_decompressed_bytes, level=9)
+def compress_gamesetup_a7s(gamesetup_a7s_decompressed_bytes, level=9):
+    return zlib.compress(gamesetup_a7s_decompressed_bytes, level=level)
 
 
 def get_tags_and_attributes_addresses_header(gamesetup_a7s_decompressed_bytes):
@@ -186,9 +186,9 @@ def parse_decompressed_gamesetup_a7s(gamesetup_a7s_decompressed_bytes: bytearray
     handle.seek(initial_tags_address)
     tags_count = read_int(handle, 4)
     print(f"XMl tags count: {tags_count}")
-    tag_ids = [read_int(handle, 2) for _ in range(0, tags_count)]
+    tag_ids = read_ids(handle, tags_count)
     print(tag_ids)
-    tag_names = [read_chars_until_space(handle) for _ in range(0, tags_count)]
+    tag_names = read_names(handle, tags_count)
     print(tag_names)
     tags = dict(zip(tag_ids, tag_names))
 
@@ -196,9 +196,9 @@ def parse_decompressed_gamesetup_a7s(gamesetup_a7s_decompressed_bytes: bytearray
     handle.seek(initial_attributes_address)
     attribute_count = read_int(handle, 4)
     print(f"XMl attributes count: {attribute_count}")
-    attribute_ids = [read_int(handle, 2) for _ in range(0, attribute_count)]
+    attribute_ids = read_ids(handle, attribute_count)
     print(attribute_ids)
-    attribute_names = [read_chars_until_space(handle) for _ in range(0, attribute_count)]
+    attribute_names = read_names(handle, attribute_count)
     print(attribute_names)
     attributes = dict(zip(attribute_ids, attribute_names))
 
@@ -348,14 +348,16 @@ def print_node_tree(tag_node: TagNode, result: str = ""):
     return result
 
 
-def read_chars_until_space(f) -> str:
-    current_character = ""
-    collected_value = ""
-    while current_character != '\0':
-        current_character = f.read(1).decode()
-        if current_character == '\0':
-            return collected_value
-        collected_value = collected_value + current_character
+def read_ids(f, count: int) -> list:
+    # the ids are 2 byte little endian integers in a row, read them at once and unpack them in one pass
+    return [node_id for node_id, in struct.iter_unpack("<H", f.read(2 * count))]
+
+
+def read_names(f, count: int) -> list:
+    # the name tables are at the end of the file, so read the rest at once and split it
+    names = f.read().split(b"\0", count)[:count]
+    return [name.decode() for name in names]
+
 
 def get_node_type(number):
     if number >= 32768: